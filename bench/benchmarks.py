@@ -0,0 +1,220 @@
+"""基准测试定义
+
+每个基准是一个准备函数：完成一次性的准备工作，返回每次迭代调用的协程函数。
+"""
+from fixtures import Env, ExecutionContext, Request
+
+import asgi
+import worker
+from native_runtime import DurableObjectState, SqlStorage
+from output import OutputStore
+from process_pool import ProcessPool
+
+BENCHMARKS = {}
+
+BASE_URL = "http://bench.local"
+
+
+def benchmark(name: str, iterations: int):
+    """注册基准；iterations 是每轮调用的次数，按单次耗时选择，使每轮在几十到几百毫秒之间"""
+    def decorator(setup):
+        BENCHMARKS[name] = (setup, iterations)
+        return setup
+    return decorator
+
+
+@benchmark("exec/print_small", 500)
+def _exec_print_small():
+    async def run():
+        await worker.execute_python_code("print('hello')")
+    return run
+
+
+@benchmark("exec/print_1000_lines", 10)
+def _exec_print_lines():
+    async def run():
+        await worker.execute_python_code("for i in range(1000):\n    print(i)")
+    return run
+
+
+@benchmark("exec/compute", 10)
+def _exec_compute():
+    async def run():
+        await worker.execute_python_code("total = 0\nfor i in range(20000):\n    total += i * i")
+    return run
+
+
+@benchmark("exec/spill_200k", 100)
+def _exec_spill():
+    storage = SqlStorage()
+    output_store = OutputStore(storage)
+
+    async def run():
+        await worker.execute_python_code("print('x' * 200_000)", output_store=output_store)
+        # 清掉溢出的分页，使每次调用面对同样大小的表
+        storage.exec("DELETE FROM output_pages")
+    return run
+
+
+@benchmark("pool/print_small", 200)
+def _pool_print_small():
+    # 单个工作进程且不回收，只测量往返一次进程间通信的开销
+    pool = ProcessPool("worker:_pool_job", size=1, max_jobs=1 << 30)
+    pool.start()
+
+    async def run():
+        await worker.execute_python_code("print('hello')", executor=pool)
+    return run
+
+
+@benchmark("pool/print_1000_lines", 10)
+def _pool_print_lines():
+    pool = ProcessPool("worker:_pool_job", size=1, max_jobs=1 << 30)
+    pool.start()
+
+    async def run():
+        await worker.execute_python_code("for i in range(1000):\n    print(i)", executor=pool)
+    return run
+
+
+@benchmark("stream/print_100_lines", 20)
+def _stream_print_lines():
+    async def run():
+        async for _ in worker.execute_python_code_stream("for i in range(100):\n    print(i)"):
+            pass
+    return run
+
+
+def _server():
+    return worker.FastMCPServer(DurableObjectState(), Env())
+
+
+@benchmark("fetch/discovery", 2000)
+def _fetch_discovery():
+    server = _server()
+
+    async def run():
+        await server.fetch(Request("GET", f"{BASE_URL}/tools"))
+    return run
+
+
+@benchmark("fetch/not_found", 2000)
+def _fetch_not_found():
+    server = _server()
+
+    async def run():
+        await server.fetch(Request("GET", f"{BASE_URL}/no/such/route"))
+    return run
+
+
+@benchmark("fetch/tools_call", 300)
+def _fetch_tools_call():
+    server = _server()
+    body = {"name": "execute_python", "arguments": {"code": "print('hello')"}}
+
+    async def run():
+        await server.fetch(Request("POST", f"{BASE_URL}/tools/call", body))
+    return run
+
+
+@benchmark("fetch/session_call", 300)
+def _fetch_session_call():
+    server = _server()
+    server.sessions.create("bench")
+    body = {
+        "name": "execute_python",
+        "arguments": {"code": "total = sum(range(100))", "session_id": "bench"},
+    }
+
+    async def run():
+        await server.fetch(Request("POST", f"{BASE_URL}/tools/call", body))
+    return run
+
+
+@benchmark("fetch/stream_execute", 50)
+def _fetch_stream_execute():
+    server = _server()
+    body = {"code": "for i in range(20):\n    print(i)"}
+
+    async def run():
+        response = await server.fetch(Request("POST", f"{BASE_URL}/stream/execute", body))
+        await response.text()
+    return run
+
+
+@benchmark("fetch/mcp_batch_10", 25)
+def _fetch_mcp_batch():
+    server = _server()
+    body = [
+        {
+            "jsonrpc": "2.0",
+            "id": i,
+            "method": "tools/call",
+            "params": {"name": "execute_python", "arguments": {"code": f"print({i})"}},
+        }
+        for i in range(10)
+    ]
+
+    async def run():
+        await server.fetch(Request("POST", f"{BASE_URL}/mcp", body))
+    return run
+
+
+async def _small_json_app(scope, receive, send):
+    await receive()
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"application/json")],
+    })
+    await send({"type": "http.response.body", "body": b'{"ok": true}'})
+
+
+async def _upload_app(scope, receive, send):
+    size = 0
+    while True:
+        message = await receive()
+        size += len(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": str(size).encode()})
+
+
+async def _streaming_app(scope, receive, send):
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", b"application/octet-stream")],
+    })
+    chunk = b"x" * 4096
+    for _ in range(15):
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": chunk})
+
+
+@benchmark("asgi/small_json", 2000)
+def _asgi_small_json():
+    async def run():
+        await asgi.process_request(_small_json_app, Request("GET", f"{BASE_URL}/"), Env(), None)
+    return run
+
+
+@benchmark("asgi/upload_64k", 500)
+def _asgi_upload():
+    chunks = [b"u" * 4096] * 16
+
+    async def run():
+        request = Request("POST", f"{BASE_URL}/upload", chunks=chunks)
+        await asgi.process_request(_upload_app, request, Env(), None)
+    return run
+
+
+@benchmark("asgi/stream_16_chunks", 500)
+def _asgi_stream():
+    ctx = ExecutionContext()
+
+    async def run():
+        await asgi.process_request(_streaming_app, Request("GET", f"{BASE_URL}/"), Env(), ctx)
+        await ctx.drain()
+    return run
@@ -0,0 +1,62 @@
+"""基准测试中代替运行时提供的对象：请求、执行上下文；Durable Object 存储由 native_runtime 提供"""
+import json
+
+from js import Uint8Array
+
+
+class Env:
+    """没有绑定任何变量的 Worker 环境"""
+
+
+class Headers(dict):
+    """请求头；与 JS Headers 一样按小写名查找，遍历时产出 (名, 值)"""
+
+    def __init__(self, headers: dict | None = None):
+        super().__init__((name.lower(), value) for name, value in (headers or {}).items())
+
+    def get(self, name: str, default=None):
+        return super().get(name.lower(), default)
+
+    def __iter__(self):
+        return iter(self.items())
+
+
+class _Body:
+    def __init__(self, chunks: list):
+        self._chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            yield Uint8Array(chunk)
+
+
+class Request:
+    """传给 on_fetch、FastMCPServer.fetch 和 asgi.fetch 的请求"""
+
+    def __init__(self, method: str, url: str, json_body=None, headers: dict | None = None,
+                 chunks: list | None = None):
+        self.method = method
+        self.url = url
+        self.headers = Headers(headers)
+        if json_body is not None:
+            chunks = [json.dumps(json_body).encode()]
+        self._chunks = chunks
+        self.body = _Body(chunks) if chunks else None
+
+    async def json(self):
+        return json.loads(b"".join(self._chunks))
+
+
+class ExecutionContext:
+    """收集 waitUntil 传入的任务，由 drain() 等待它们完成"""
+
+    def __init__(self):
+        self._pending = []
+
+    def waitUntil(self, promise):  # noqa: N802
+        self._pending.append(promise)
+
+    async def drain(self):
+        pending, self._pending = self._pending, []
+        for promise in pending:
+            await promise
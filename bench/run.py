@@ -0,0 +1,147 @@
+"""离线基准测试
+
+用 bench/stubs 中的替身代替 Workers 运行时提供的 workers、js 和 pyodide.ffi 模块，
+在普通 CPython 中测量执行、流式输出、路由和 ASGI 桥接的热路径。
+
+    python bench/run.py                      # 运行全部基准并与基线比较
+    python bench/run.py -k fetch/            # 只运行名称包含 fetch/ 的基准
+    python bench/run.py --update-baseline    # 把本次结果保存为新的基线
+
+各轮单次耗时的中位数比基线慢超过阈值时视为性能回退，以退出码 1 结束。
+单独一轮（包括最快的一轮）容易受调度和其他进程的干扰，不作判断依据；最小值只作参考。
+超过阈值的基准会重新测量，每次都超过阈值才判定为回退，取各次中位数最小的结果。
+"""
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+# 替身必须排在 src 之前，使 src 中的 `from workers import ...` 解析到替身
+sys.path[:0] = [str(BENCH_DIR / "stubs"), str(ROOT / "src"), str(BENCH_DIR)]
+
+from benchmarks import BENCHMARKS  # noqa: E402
+
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+DEFAULT_OUTPUT = ROOT / "bench_output.txt"
+DEFAULT_THRESHOLD = 0.5
+DEFAULT_ROUNDS = 15
+DEFAULT_CONFIRM = 2
+
+
+def _environment() -> dict:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+    }
+
+
+async def _measure(setup, iterations: int, rounds: int) -> dict:
+    """先预热一轮，再运行 rounds 轮，返回每次调用耗时（微秒）的中位数和最小值"""
+    run = setup()
+    for _ in range(max(iterations // 10, 1)):
+        await run()
+
+    per_call = []
+    for _ in range(rounds):
+        started = time.perf_counter_ns()
+        for _ in range(iterations):
+            await run()
+        per_call.append((time.perf_counter_ns() - started) / iterations / 1000)
+    return {
+        "median_us": round(statistics.median(per_call), 3),
+        "min_us": round(min(per_call), 3),
+    }
+
+
+def _compare(name: str, result: dict, baseline: dict, threshold: float) -> tuple[str, bool]:
+    """返回与基线的对比说明，以及是否判定为回退"""
+    previous = baseline.get(name)
+    if previous is None:
+        return "new", False
+    change = result["median_us"] / previous["median_us"] - 1
+    regressed = change > threshold
+    return f"{change:+.1%}{'  REGRESSION' if regressed else ''}", regressed
+
+
+async def _run(args) -> int:
+    baseline_data = {}
+    if args.baseline.exists():
+        baseline_data = json.loads(args.baseline.read_text())
+    baseline = baseline_data.get("benchmarks", {})
+    environment = _environment()
+    if baseline_data and baseline_data.get("environment") != environment:
+        print(
+            f"note: baseline was recorded on {baseline_data.get('environment')}, "
+            f"this run is {environment}; comparisons are indicative only",
+            file=sys.stderr,
+        )
+
+    results = {}
+    lines = [f"{'benchmark':<28} {'median_us':>12} {'min_us':>12}  vs baseline"]
+    regressions = []
+    for name, (setup, iterations) in BENCHMARKS.items():
+        if args.k and args.k not in name:
+            continue
+        result = await _measure(setup, iterations, args.rounds)
+        note, regressed = _compare(name, result, baseline, args.threshold)
+        for _ in range(args.confirm):
+            if not regressed:
+                break
+            retry = await _measure(setup, iterations, args.rounds)
+            if retry["median_us"] < result["median_us"]:
+                result = retry
+            note, regressed = _compare(name, result, baseline, args.threshold)
+        results[name] = result
+        if regressed:
+            regressions.append(name)
+        line = f"{name:<28} {result['median_us']:>12.3f} {result['min_us']:>12.3f}  {note}"
+        lines.append(line)
+        print(line, flush=True)
+
+    args.output.write_text("\n".join(lines) + "\n")
+
+    if args.update_baseline:
+        # 只运行部分基准时保留其余基准的旧基线
+        merged = {**baseline, **results} if args.k else results
+        args.baseline.write_text(
+            json.dumps({"environment": environment, "benchmarks": merged}, indent=2) + "\n"
+        )
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    if regressions:
+        print(
+            f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}: "
+            + ", ".join(regressions),
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-k", help="only run benchmarks whose name contains this string")
+    parser.add_argument("--rounds", type=int, default=DEFAULT_ROUNDS)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown of the median round before failing, "
+                             "e.g. 0.5 for 50%%")
+    parser.add_argument("--confirm", type=int, default=DEFAULT_CONFIRM,
+                        help="times a benchmark over the threshold is measured again "
+                             "before it counts as a regression")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT)
+    parser.add_argument("--update-baseline", action="store_true")
+    return asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""基准测试用的 js 模块替身：只实现 src/asgi.py 中用到的全局对象
+
+行为尽量与 Workers 运行时一致：Response.new 复制传入的视图，流的写入按块保存引用。
+"""
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+
+class Uint8Array:
+    """JS 堆上的字节数组"""
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data: bytes):
+        self._data = data
+
+    @classmethod
+    def new(cls, source):
+        return cls(bytes(source))
+
+    @property
+    def byteLength(self) -> int:  # noqa: N802
+        return len(self._data)
+
+    def to_bytes(self) -> bytes:
+        return self._data
+
+
+class URL:
+    @staticmethod
+    def new(url: str):
+        parts = urlsplit(url)
+        return SimpleNamespace(
+            protocol=f"{parts.scheme}:",
+            pathname=parts.path or "/",
+            search=f"?{parts.query}" if parts.query else "",
+        )
+
+
+class Object:
+    @staticmethod
+    def fromEntries(entries):  # noqa: N802
+        return dict(entries)
+
+
+class Response:
+    def __init__(self, body, headers, status: int, webSocket=None):  # noqa: N803
+        self.body = body
+        self.headers = headers or {}
+        self.status = status
+        self.webSocket = webSocket
+
+    @classmethod
+    def new(cls, body=None, headers=None, status: int = 200, webSocket=None):  # noqa: N803
+        if hasattr(body, "tobytes"):
+            # 构造 Response 时运行时会复制借来的视图
+            body = Uint8Array(body.tobytes())
+        return cls(body, headers, status, webSocket)
+
+
+class _Writer:
+    def __init__(self, chunks: list):
+        self._chunks = chunks
+        self.closed = False
+
+    async def write(self, chunk):
+        self._chunks.append(chunk)
+
+    async def close(self):
+        self.closed = True
+
+
+class TransformStream:
+    def __init__(self):
+        self.readable = []
+        writer = _Writer(self.readable)
+        self.writable = SimpleNamespace(getWriter=lambda: writer)
+
+    @classmethod
+    def new(cls):
+        return cls()
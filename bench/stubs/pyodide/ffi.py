@@ -0,0 +1,58 @@
+"""基准测试用的 pyodide.ffi 替身：create_proxy 返回的代理可以把 Python 缓冲区借给 JS"""
+
+
+class _BorrowedView:
+    """借给 JS 的 WASM 堆视图，对应 getBuffer() 返回的 TypedArray"""
+
+    __slots__ = ("_view",)
+
+    def __init__(self, view: memoryview):
+        self._view = view
+
+    def slice(self):
+        """复制到 JS 持有的数组，对应 TypedArray.prototype.slice()"""
+        from js import Uint8Array
+
+        return Uint8Array(self._view.tobytes())
+
+    def tobytes(self) -> bytes:
+        return self._view.tobytes()
+
+
+class _PyBuffer:
+    __slots__ = ("_view", "data")
+
+    def __init__(self, obj):
+        self._view = memoryview(obj).cast("B")
+        self.data = _BorrowedView(self._view)
+
+    def release(self):
+        self._view.release()
+
+
+class _Proxy:
+    __slots__ = ("_obj",)
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def __call__(self, *args):
+        return self._obj(*args)
+
+    def __await__(self):
+        # 传给 JS 的 Future 在 JS 侧是 Promise，这里直接等待原对象
+        return self._obj.__await__()
+
+    def getBuffer(self):  # noqa: N802
+        return _PyBuffer(self._obj)
+
+    def destroy(self):
+        self._obj = None
+
+
+def create_proxy(obj):
+    return _Proxy(obj)
+
+
+def to_js(obj, **kwargs):
+    return obj
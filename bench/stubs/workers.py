@@ -0,0 +1,27 @@
+"""基准测试用的 workers 模块替身：只实现 src 中用到的 Response 和 DurableObject"""
+
+
+class Response:
+    def __init__(self, body=None, status: int = 200, headers: dict | None = None, web_socket=None):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+        self.web_socket = web_socket
+
+    async def text(self) -> str:
+        """读出完整的响应体；流式响应体在这里被消费"""
+        body = self.body
+        if body is None:
+            return ""
+        if isinstance(body, (bytes, bytearray)):
+            return bytes(body).decode()
+        if isinstance(body, str):
+            return body
+        parts = [chunk async for chunk in body]
+        return "".join(chunk.decode() if isinstance(chunk, bytes) else chunk for chunk in parts)
+
+
+class DurableObject:
+    def __init__(self, ctx, env):
+        self.ctx = ctx
+        self.env = env
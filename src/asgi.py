@@ -1,9 +1,18 @@
-from asyncio import Event, Future, Queue, create_task, ensure_future, sleep
+import atexit
+from asyncio import Event, Future, Queue, create_task, ensure_future, shield
 from contextlib import contextmanager
-from inspect import isawaitable
 
 ASGI = {"spec_version": "2.0", "version": "3.0"}
 
+# Request bodies are pulled from the JS stream only as the app asks for them; at
+# most this many chunks are read ahead, so a slow app back-pressures the upload.
+BODY_QUEUE_SIZE = 4
+
+# Default limit for request bodies in bytes, None for no limit. Larger bodies get
+# a 413 before the app runs when Content-Length announces them, otherwise as soon
+# as the limit is crossed while reading.
+MAX_BODY_SIZE = None
+
 
 background_tasks = set()
 
@@ -27,7 +36,65 @@ def acquire_js_buffer(pybuffer):
         buf.release()
 
 
-def request_to_scope(req, env, ws=False):
+# Totals over every request served by this isolate, filled in by BufferBridge.close().
+bridge_stats = {"requests": 0, "bytes_copied": 0, "max_request_bytes_copied": 0}
+
+
+class BufferBridge:
+    """Moves body bytes between the Python and JS heaps, one request at a time.
+
+    Python buffers are lent to JS as views into the WASM heap and released as soon
+    as JS is done with them, so each chunk crosses the heap boundary exactly once.
+    Bytes, bytearrays and memoryviews are all accepted as they are, without first
+    converting them to bytes. bytes_copied counts what crossed.
+    """
+
+    def __init__(self):
+        self.bytes_copied = 0
+
+    def response(self, body, **kwargs):
+        """Create a Response from a complete body."""
+        from js import Response
+
+        if not body:
+            return Response.new(None, **kwargs)
+        # The Response constructor copies the view, so the buffer can go right after.
+        with acquire_js_buffer(body) as view:
+            response = Response.new(view, **kwargs)
+        self.bytes_copied += len(body)
+        return response
+
+    def to_js(self, body):
+        """Copy a chunk into a JS-owned Uint8Array for stream writes.
+
+        Streams keep chunks by reference until the client reads them, so unlike
+        Response bodies the chunk has to leave the WASM heap before it is released.
+        """
+        with acquire_js_buffer(body) as view:
+            chunk = view.slice()
+        self.bytes_copied += len(body)
+        return chunk
+
+    def send(self, socket, body):
+        """Send a binary WebSocket frame; send() copies the view eagerly."""
+        with acquire_js_buffer(body) as view:
+            socket.send(view)
+        self.bytes_copied += len(body)
+
+    def to_py(self, data):
+        """Copy a JS Uint8Array chunk into Python bytes."""
+        self.bytes_copied += data.byteLength
+        return data.to_bytes()
+
+    def close(self):
+        """Add this request's copies to the isolate totals."""
+        bridge_stats["requests"] += 1
+        bridge_stats["bytes_copied"] += self.bytes_copied
+        if self.bytes_copied > bridge_stats["max_request_bytes_copied"]:
+            bridge_stats["max_request_bytes_copied"] = self.bytes_copied
+
+
+def request_to_scope(req, env, ws=False, state=None):
     from js import URL
 
     # @app.get("/example")
@@ -45,7 +112,7 @@ def request_to_scope(req, env, ws=False):
         ty = "websocket"
     else:
         ty = "http"
-    return {
+    scope = {
         "asgi": ASGI,
         "headers": headers,
         "http_version": "1.1",
@@ -56,22 +123,26 @@ def request_to_scope(req, env, ws=False):
         "type": ty,
         "env": env,
     }
+    if ws:
+        protocols = req.headers.get("sec-websocket-protocol")
+        scope["subprotocols"] = [p.strip() for p in protocols.split(",")] if protocols else []
+    if state is not None:
+        # Each request gets a shallow copy of the state filled in by lifespan startup.
+        scope["state"] = dict(state)
+    return scope
 
 
-async def start_application(app):
+async def start_application(app, state=None):
     shutdown_future = Future()
-
-    async def shutdown():
-        shutdown_future.set_result(None)
-        await sleep(0)
-
-    it = iter([{"type": "lifespan.startup"}, Future()])
+    started = False
 
     async def receive():
-        res = next(it)
-        if isawaitable(res):
-            await res
-        return res
+        nonlocal started
+        if not started:
+            started = True
+            return {"type": "lifespan.startup"}
+        await shutdown_future
+        return {"type": "lifespan.shutdown"}
 
     ready = Future()
 
@@ -79,114 +150,223 @@ async def start_application(app):
         if got["type"] == "lifespan.startup.complete":
             ready.set_result(None)
             return
-        if got["type"] == "lifespan.shutdown.complete":
+        if got["type"] == "lifespan.startup.failed":
+            ready.set_exception(
+                RuntimeError(f"Application startup failed: {got.get('message', '')}")
+            )
+            return
+        if got["type"] in ("lifespan.shutdown.complete", "lifespan.shutdown.failed"):
             return
         raise RuntimeError(f"Unexpected lifespan event {got['type']}")
 
-    run_in_background(
-        app(
-            {
-                "asgi": ASGI,
-                "state": {},
-                "type": "lifespan",
-            },
-            receive,
-            send,
-        )
-    )
+    async def run_lifespan():
+        try:
+            await app(
+                {
+                    "asgi": ASGI,
+                    "state": state if state is not None else {},
+                    "type": "lifespan",
+                },
+                receive,
+                send,
+            )
+        except Exception:
+            # Apps without lifespan support raise on the unknown scope type; the
+            # ASGI spec says to carry on serving them without startup/shutdown.
+            pass
+        if not ready.done():
+            ready.set_result(None)
+
+    lifespan_task = ensure_future(run_lifespan())
+    background_tasks.add(lifespan_task)
+    lifespan_task.add_done_callback(background_tasks.discard)
     await ready
+
+    async def shutdown():
+        if not shutdown_future.done():
+            shutdown_future.set_result(None)
+        await lifespan_task
+
     return shutdown
 
 
-async def process_request(app, req, env, ctx):
-    from js import Object, Response, TransformStream
+# app -> (startup future resolving to its shutdown function, lifespan state).
+# The lifespan runs once per isolate and the app stays warm between requests.
+_lifespans = {}
+
+
+async def ensure_started(app):
+    """Start the app's lifespan on first use; concurrent first requests share one startup."""
+    entry = _lifespans.get(app)
+    if entry is None:
+        state = {}
+        entry = _lifespans[app] = (ensure_future(start_application(app, state)), state)
+    ready, state = entry
+    try:
+        # shield: a cancelled request must not cancel the startup other requests wait on
+        await shield(ready)
+    except BaseException:
+        if ready.done() and _lifespans.get(app) is entry:
+            # Startup failed; let the next request try again.
+            del _lifespans[app]
+        raise
+    return state
+
+
+async def shutdown_application(app):
+    """Run the lifespan shutdown of a started app."""
+    entry = _lifespans.pop(app, None)
+    if entry is None:
+        return
+    ready, _ = entry
+    shutdown = await ready
+    await shutdown()
+
 
+@atexit.register
+def _shutdown_at_exit():
+    # Isolate teardown: ask every started app to shut down. This is best effort,
+    # the event loop may not get to run the shutdown handlers before exit.
+    for app, (ready, _) in list(_lifespans.items()):
+        if ready.done() and not ready.cancelled() and ready.exception() is None:
+            coro = shutdown_application(app)
+            try:
+                run_in_background(coro)
+            except RuntimeError:
+                # No event loop left to run it on.
+                coro.close()
+
+
+def _body_too_large():
+    from js import Response
+
+    return Response.new("Request body too large", status=413)
+
+
+async def process_request(app, req, env, ctx, state=None, max_body_size=MAX_BODY_SIZE):
+    from js import Object, Response, TransformStream
     from pyodide.ffi import create_proxy
 
+    if max_body_size is not None:
+        content_length = req.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_body_size:
+            return _body_too_large()
+
     status = None
     headers = None
     result = Future()
-    is_sse = False
     finished_response = Event()
+    bridge = BufferBridge()
 
-    receive_queue = Queue()
-    if req.body:
-        async for data in req.body:
-            await receive_queue.put(
-                {
-                    "body": data.to_bytes(),
-                    "more_body": True,
-                    "type": "http.request",
-                }
-            )
-    await receive_queue.put({"body": b"", "more_body": False, "type": "http.request"})
+    receive_queue = Queue(maxsize=BODY_QUEUE_SIZE)
+    body_reader = None
+    body_done = False
+    rejected = False
+
+    async def read_body():
+        nonlocal rejected
+        received = 0
+        try:
+            if req.body:
+                async for data in req.body:
+                    chunk = bridge.to_py(data)
+                    received += len(chunk)
+                    if max_body_size is not None and received > max_body_size:
+                        if not result.done():
+                            # Answer 413 right away; whatever the app sends afterwards is dropped.
+                            rejected = True
+                            result.set_result(_body_too_large())
+                            finished_response.set()
+                        await receive_queue.put({"type": "http.disconnect"})
+                        return
+                    # Blocks while the queue is full, which stops pulling from the stream.
+                    await receive_queue.put(
+                        {"body": chunk, "more_body": True, "type": "http.request"}
+                    )
+        except Exception:
+            # The client went away mid-upload.
+            await receive_queue.put({"type": "http.disconnect"})
+            return
+        await receive_queue.put({"body": b"", "more_body": False, "type": "http.request"})
 
     async def receive():
-        message = None
-        if not receive_queue.empty():
+        nonlocal body_reader, body_done
+        if not body_done:
+            if body_reader is None:
+                body_reader = create_task(read_body())
             message = await receive_queue.get()
-        else:
-            await finished_response.wait()
-            message = {"type": "http.disconnect"}
-        return message
+            if message["type"] == "http.disconnect" or not message["more_body"]:
+                body_done = True
+            return message
+        await finished_response.wait()
+        return {"type": "http.disconnect"}
+
+    writer = None
+
+    def start_stream():
+        # Only streamed responses pay for a TransformStream; its readable side
+        # becomes the response body as soon as the stream is opened.
+        nonlocal writer
+        transform_stream = TransformStream.new()
+        writer = transform_stream.writable.getWriter()
+        result.set_result(
+            Response.new(
+                transform_stream.readable,
+                headers=Object.fromEntries(headers),
+                status=status,
+            )
+        )
 
-    # Create a transform stream for handling streaming responses
-    transform_stream = TransformStream.new()
-    readable = transform_stream.readable
-    writable = transform_stream.writable
-    writer = writable.getWriter()
+    async def finish_stream():
+        await writer.close()
+        finished_response.set()
 
     async def send(got):
         nonlocal status
         nonlocal headers
-        nonlocal is_sse
+
+        if rejected:
+            return
 
         if got["type"] == "http.response.start":
             status = got["status"]
             # Like above, we need to convert byte-pairs into string explicitly.
             headers = [(k.decode(), v.decode()) for k, v in got["headers"]]
-            # Check if this is a server-sent events response
+            # Server-sent events are streamed from http.response.start on, so the
+            # client sees the headers before the first event is ready.
             for k, v in headers:
                 if k.lower() == "content-type" and v.lower().startswith(
                     "text/event-stream"
                 ):
-                    is_sse = True
+                    start_stream()
                     break
-            if is_sse:
-                # For SSE, create and return the response immediately after http.response.start
-                resp = Response.new(
-                    readable, headers=Object.fromEntries(headers), status=status
-                )
-                result.set_result(resp)
 
         elif got["type"] == "http.response.body":
             body = got["body"]
             more_body = got.get("more_body", False)
 
-            # Convert body to JS buffer
-            px = create_proxy(body)
-            buf = px.getBuffer()
-            px.destroy()
-
-            if is_sse:
-                # For SSE, write chunk to the stream
-                await writer.write(buf.data)
-                # If this is the last chunk, close the writer
-                if not more_body:
-                    await writer.close()
-                    finished_response.set()
-            else:
-                resp = Response.new(
-                    buf.data, headers=Object.fromEntries(headers), status=status
+            if writer is None and not more_body:
+                # The whole body in one message: no stream needed.
+                result.set_result(
+                    bridge.response(body, headers=Object.fromEntries(headers), status=status)
                 )
-                result.set_result(resp)
-                await writer.close()
                 finished_response.set()
-
-    # Run the application in the background to handle SSE
+                return
+
+            if writer is None:
+                start_stream()
+            if body:
+                # Resolves once the chunk is taken from the stream, which back-pressures
+                # the app to the speed of the client.
+                await writer.write(bridge.to_js(body))
+            if not more_body:
+                await finish_stream()
+
+    # Run the application in the background so streamed responses can be returned
+    # before the app has finished
     async def run_app():
         try:
-            await app(request_to_scope(req, env), receive, send)
+            await app(request_to_scope(req, env, state=state), receive, send)
 
             # If we get here and no response has been set yet, the app didn't generate a response
             if not result.done():
@@ -195,8 +375,14 @@ async def process_request(app, req, env, ctx):
             # Handle any errors in the application
             if not result.done():
                 result.set_exception(e)
-                await writer.close()  # Close the writer
                 finished_response.set()
+            elif writer is not None and not finished_response.is_set():
+                # Streaming had started: end the body so the client isn't left waiting
+                await finish_stream()
+        finally:
+            if body_reader is not None:
+                body_reader.cancel()
+            bridge.close()
 
     # Create task to run the application in the background
     app_task = create_task(run_app())
@@ -204,80 +390,125 @@ async def process_request(app, req, env, ctx):
     # Wait for the result (the response)
     response = await result
 
-    # For non-SSE responses, we need to wait for the application to complete
-    if not is_sse:
+    # Buffered responses are complete once the app returns; streamed ones keep running
+    if writer is None:
         await app_task
-    else:  # noqa: PLR5501
-        if ctx is not None:
-            ctx.waitUntil(create_proxy(app_task))
-        else:
-            raise RuntimeError(
-                "Server-Side-Events require ctx to be passed to asgi.fetch"
-            )
+    elif ctx is not None:
+        ctx.waitUntil(create_proxy(app_task))
+    else:
+        # Without ctx the runtime keeps the request alive only while the client
+        # reads the body; hold a reference so the task isn't collected meanwhile.
+        background_tasks.add(app_task)
+        app_task.add_done_callback(background_tasks.discard)
     return response
 
 
-async def process_websocket(app, req):
-    from js import Response, WebSocketPair
+async def process_websocket(app, req, env=None, state=None):
+    from js import Object, Response, Uint8Array, WebSocketPair
+    from pyodide.ffi import create_proxy
 
     client, server = WebSocketPair.new().object_values()
     server.accept()
     queue = Queue()
+    bridge = BufferBridge()
+    # Resolves with the app's first websocket.accept or websocket.close
+    handshake = Future()
+    closed = False
 
-    def onopen(evt):
-        msg = {"type": "websocket.connect"}
-        queue.put_nowait(msg)
+    # The socket is open as soon as accept() returns; there is no open event to
+    # wait for, so websocket.connect is queued up front.
+    queue.put_nowait({"type": "websocket.connect"})
 
-    # onopen doesn't seem to get called. WS lifecycle events are a bit messed up
-    # here.
-    onopen(1)
+    def onmessage(evt):
+        if isinstance(evt.data, str):
+            queue.put_nowait({"type": "websocket.receive", "text": evt.data})
+        else:
+            data = bridge.to_py(Uint8Array.new(evt.data))
+            queue.put_nowait({"type": "websocket.receive", "bytes": data})
 
     def onclose(evt):
-        msg = {"type": "websocket.close", "code": evt.code, "reason": evt.reason}
-        queue.put_nowait(msg)
-
-    def onmessage(evt):
-        msg = {"type": "websocket.receive", "text": evt.data}
-        queue.put_nowait(msg)
+        nonlocal closed
+        closed = True
+        queue.put_nowait({"type": "websocket.disconnect", "code": evt.code, "reason": evt.reason})
+
+    def onerror(evt):
+        nonlocal closed
+        closed = True
+        queue.put_nowait({"type": "websocket.disconnect", "code": 1006})
+
+    listeners = [
+        (name, create_proxy(handler))
+        for name, handler in (("message", onmessage), ("close", onclose), ("error", onerror))
+    ]
+    for name, proxy in listeners:
+        server.addEventListener(name, proxy)
 
-    server.onopen = onopen
-    server.onopen = onclose
-    server.onmessage = onmessage
+    async def ws_receive():
+        return await queue.get()
 
     async def ws_send(got):
-        if got["type"] == "websocket.send":
-            b = got.get("bytes", None)
-            s = got.get("text", None)
-            if b:
-                with acquire_js_buffer(b) as jsbytes:
-                    # Unlike the `Response` constructor,  server.send seems to
-                    # eagerly copy the source buffer
-                    server.send(jsbytes)
-            if s:
-                server.send(s)
-
+        nonlocal closed
+        if got["type"] == "websocket.accept":
+            if not handshake.done():
+                handshake.set_result(got)
+        elif got["type"] == "websocket.send":
+            if closed:
+                return
+            if got.get("bytes") is not None:
+                bridge.send(server, got["bytes"])
+            elif got.get("text") is not None:
+                server.send(got["text"])
+        elif got["type"] == "websocket.close":
+            if not handshake.done():
+                handshake.set_result(got)
+            elif not closed:
+                server.close(got.get("code", 1000), got.get("reason") or "")
+            closed = True
         else:
-            print(" == Not implemented", got["type"])
-
-    async def ws_receive():
-        received = await queue.get()
-        return received
+            raise RuntimeError(f"Unexpected websocket event {got['type']}")
 
-    env = {}
-    run_in_background(app(request_to_scope(req, env, ws=True), ws_receive, ws_send))
-
-    return Response.new(None, status=101, webSocket=client)
+    async def run_app():
+        nonlocal closed
+        try:
+            await app(request_to_scope(req, env, ws=True, state=state), ws_receive, ws_send)
+        except Exception as e:
+            if not handshake.done():
+                handshake.set_exception(e)
+            elif not closed:
+                server.close(1011, "Internal error")
+                closed = True
+        finally:
+            if not handshake.done():
+                handshake.set_result({"type": "websocket.close"})
+            if not closed:
+                server.close(1000, "")
+            for name, proxy in listeners:
+                server.removeEventListener(name, proxy)
+                proxy.destroy()
+            bridge.close()
+
+    run_in_background(run_app())
+
+    message = await handshake
+    if message["type"] == "websocket.close":
+        # The app turned the connection down before accepting it
+        return Response.new("Forbidden", status=403)
+    headers = [(k.decode(), v.decode()) for k, v in message.get("headers", [])]
+    if message.get("subprotocol"):
+        headers.append(("sec-websocket-protocol", message["subprotocol"]))
+    return Response.new(
+        None, status=101, webSocket=client, headers=Object.fromEntries(headers)
+    )
 
 
-async def fetch(app, req, env, ctx=None):
-    shutdown = await start_application(app)
-    result = await process_request(app, req, env, ctx)
-    await shutdown()
-    return result
+async def fetch(app, req, env, ctx=None, max_body_size=MAX_BODY_SIZE):
+    state = await ensure_started(app)
+    return await process_request(app, req, env, ctx, state, max_body_size)
 
 
-async def websocket(app, req):
-    return await process_websocket(app, req)
+async def websocket(app, req, env=None):
+    state = await ensure_started(app)
+    return await process_websocket(app, req, env if env is not None else {}, state)
 
 
 def __getattr__(name):
@@ -0,0 +1,93 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class CompileCache:
+    """按源码哈希缓存 compile() 结果的有界 LRU 缓存
+
+    同时限制条目数和总大小（以源码字节数近似代码对象的内存占用）。
+    编译失败的源码以负缓存条目保存，重复提交时直接抛出相同的异常。
+    """
+
+    def __init__(self, max_entries: int = 512, max_bytes: int = 8 * 1024 * 1024,
+                 filename: str = "<string>"):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.filename = filename
+        # key -> (code 对象或 None, (异常类型, 异常参数) 或 None, 大小)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # 流式执行在工作线程中编译，查找与写入需要互斥
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+    def compile(self, source: str):
+        """返回源码对应的代码对象，命中缓存时跳过解析和编译"""
+        encoded = source.encode("utf-8", "surrogatepass")
+        key = hashlib.blake2b(encoded, digest_size=16).digest()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if entry is not None:
+            code, error, _ = entry
+            if error is not None:
+                self.negative_hits += 1
+                error_type, error_args = error
+                raise error_type(*error_args)
+            return code
+
+        try:
+            code = compile(source, self.filename, "exec")
+        except (SyntaxError, ValueError, OverflowError) as e:
+            self._store(key, (None, (type(e), e.args), len(encoded)))
+            raise
+        self._store(key, (code, None, len(encoded)))
+        return code
+
+    def _store(self, key: bytes, entry: tuple):
+        size = entry[2]
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = entry
+            self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        """清空缓存，保留统计计数"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """返回缓存的命中、未命中和淘汰计数"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
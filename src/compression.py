@@ -0,0 +1,71 @@
+import gzip
+import sys
+import zlib
+
+# 小于该字节数的 JSON 响应不压缩，压缩收益抵不过开销
+COMPRESSION_MIN_BYTES = 1024
+COMPRESSION_LEVEL = 6
+
+# Workers 运行时会按 Content-Encoding 响应头自行压缩响应体（encodeBody 默认为 "automatic"），
+# 在 Pyodide 中只需设置响应头：原生压缩比在 WebAssembly 中运行 zlib 快，也避免重复压缩
+RUNTIME_COMPRESSES = sys.platform == "emscripten"
+
+
+def negotiate(accept_encoding: str | None) -> str | None:
+    """按 Accept-Encoding 请求头选择响应编码，目前只支持 gzip；不压缩时返回 None"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[coding.strip().lower()] = quality
+    quality = weights.get("gzip", weights.get("x-gzip", weights.get("*", 0.0)))
+    return "gzip" if quality > 0 else None
+
+
+def encode_body(body: bytes) -> bytes:
+    """压缩完整的响应体；运行时负责压缩时原样返回"""
+    if RUNTIME_COMPRESSES:
+        return body
+    return gzip.compress(body, COMPRESSION_LEVEL, mtime=0)
+
+
+class StreamCompressor:
+    """增量 gzip 压缩器
+
+    每个事件之后做一次同步刷新，客户端无需等待后续数据就能解压出已收到的完整事件。
+    """
+
+    def __init__(self, level: int = COMPRESSION_LEVEL):
+        # wbits=31 生成带 gzip 头和校验尾的数据
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+async def encode_stream(chunks):
+    """逐事件压缩流式响应体；运行时负责压缩时原样转发"""
+    if RUNTIME_COMPRESSES:
+        async for chunk in chunks:
+            yield chunk
+        return
+
+    compressor = StreamCompressor()
+    async for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
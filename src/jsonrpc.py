@@ -0,0 +1,88 @@
+import asyncio
+import traceback
+
+# JSON-RPC 2.0 预定义的错误码
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class JSONRPCError(Exception):
+    """方法处理器抛出后转换为 JSON-RPC 错误响应"""
+
+    def __init__(self, code: int, message: str, data=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.data = data
+
+
+def error_response(request_id, code: int, message: str, data=None) -> dict:
+    error = {"code": code, "message": message}
+    if data is not None:
+        error["data"] = data
+    return {"jsonrpc": "2.0", "id": request_id, "error": error}
+
+
+def result_response(request_id, result) -> dict:
+    return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+
+class JSONRPCDispatcher:
+    """按方法名分发 JSON-RPC 2.0 消息
+
+    批量请求中的各条消息并发处理，响应按完成顺序产出；通知（没有 id 的请求）不产生响应。
+    """
+
+    def __init__(self):
+        self._methods = {}
+
+    def method(self, name: str):
+        """注册方法处理器：async (params, ctx) -> result"""
+        def decorator(handler):
+            self._methods[name] = handler
+            return handler
+        return decorator
+
+    async def handle(self, message, ctx) -> dict | None:
+        """处理一条消息，返回响应；通知返回 None"""
+        if (not isinstance(message, dict) or message.get("jsonrpc") != "2.0"
+                or not isinstance(message.get("method"), str)):
+            request_id = message.get("id") if isinstance(message, dict) else None
+            return error_response(request_id, INVALID_REQUEST, "Invalid Request")
+
+        is_notification = "id" not in message
+        request_id = message.get("id")
+        handler = self._methods.get(message["method"])
+        params = message.get("params")
+        try:
+            if handler is None:
+                raise JSONRPCError(METHOD_NOT_FOUND, f"Method not found: {message['method']}")
+            if params is not None and not isinstance(params, (dict, list)):
+                raise JSONRPCError(INVALID_PARAMS, "params must be an object or array")
+            result = await handler(params if params is not None else {}, ctx)
+        except JSONRPCError as e:
+            response = error_response(request_id, e.code, e.message, e.data)
+        except Exception as e:
+            response = error_response(
+                request_id, INTERNAL_ERROR, f"Internal error: {e}",
+                {"traceback": traceback.format_exc()},
+            )
+        else:
+            response = result_response(request_id, result)
+        return None if is_notification else response
+
+    async def handle_batch(self, messages: list, ctx):
+        """并发处理批量消息，按完成顺序产出响应"""
+        tasks = [asyncio.ensure_future(self.handle(message, ctx)) for message in messages]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                response = await next_done
+                if response is not None:
+                    yield response
+        finally:
+            # 客户端提前断开时取消尚未完成的调用
+            for task in tasks:
+                task.cancel()
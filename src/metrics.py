@@ -0,0 +1,182 @@
+import bisect
+import math
+
+# 默认耗时分桶上限（秒），覆盖亚毫秒级的路由处理到数秒的代码执行
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        if value.is_integer():
+            return str(int(value))
+    return repr(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """单调递增的计数器，按标签值分组"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+
+    def inc(self, amount: float = 1, *labelvalues):
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        for labelvalues, value in self._values.items():
+            yield self.name, _format_labels(self.labelnames, labelvalues), value
+
+
+class Gauge(Counter):
+    """可增可减的数值，按标签值分组"""
+
+    kind = "gauge"
+
+    def set(self, value: float, *labelvalues):
+        self._values[labelvalues] = value
+
+    def dec(self, amount: float = 1, *labelvalues):
+        self._values[labelvalues] = self._values.get(labelvalues, 0) - amount
+
+
+class _HistogramChild:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, size: int):
+        # 最后一格对应 +Inf 桶；各格不累加，导出时再求累计值
+        self.counts = [0] * size
+        self.sum = 0.0
+
+
+class Histogram:
+    """按标签值分组的直方图
+
+    每组的分桶计数在首次记录时分配一次，之后每次记录只做一次二分查找和两次加法。
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._children = {}
+
+    def observe(self, value: float, *labelvalues):
+        child = self._children.get(labelvalues)
+        if child is None:
+            child = self._children[labelvalues] = _HistogramChild(len(self.buckets) + 1)
+        child.counts[bisect.bisect_left(self.buckets, value)] += 1
+        child.sum += value
+
+    def samples(self):
+        bounds = [_format_value(float(bound)) for bound in self.buckets] + ["+Inf"]
+        for labelvalues, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(bounds, child.counts, strict=True):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, f'le="{bound}"')
+                yield f"{self.name}_bucket", labels, cumulative
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum", labels, child.sum
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    """进程内的指标注册表，按 Prometheus 文本格式导出
+
+    记录只在事件循环线程上进行，单线程内无需加锁。已有统计的组件（缓存、会话等）
+    不重复记录，而是注册采集函数，在导出时把当时的统计转换为指标。
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, collect):
+        """注册采集函数：collect(context) 产出 (名称, 类型, 说明, [(标签字典, 值), ...])"""
+        self._collectors.append(collect)
+        return collect
+
+    def render(self, context=None, const_labels: dict | None = None) -> str:
+        """导出全部指标；context 原样传给各采集函数，const_labels 加到每个样本上"""
+        const_labels = const_labels or {}
+        prefix = _format_labels(tuple(const_labels), tuple(const_labels.values()))[1:-1]
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                if prefix:
+                    labels = f"{{{prefix},{labels[1:]}" if labels else f"{{{prefix}}}"
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        for collect in self._collectors:
+            for name, kind, documentation, samples in collect(context):
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    labels = {**const_labels, **labels}
+                    rendered = _format_labels(tuple(labels), tuple(labels.values()))
+                    lines.append(f"{name}{rendered} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def merge_expositions(texts) -> str:
+    """合并多份文本格式的导出，例如各分片的指标
+
+    同名指标的 HELP 和 TYPE 只保留第一份，各份的样本按指标归到一起。
+    名称和标签都相同的序列来自同一来源（例如同一 isolate 中多个分片共享的指标），只保留最后
+    导出的一份，不重复累加；来源不同的样本须已带有区分来源的标签。
+    """
+    families = {}
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith(("# HELP ", "# TYPE ")):
+                name = line.split(" ", 3)[2]
+                family = families.setdefault(name, ({}, {}))
+                family[0].setdefault(line[2:6], line)
+            elif line and family is not None:
+                family[1][line.rpartition(" ")[0]] = line
+    lines = []
+    for headers, samples in families.values():
+        lines.extend(headers.values())
+        lines.extend(samples.values())
+    return "\n".join(lines) + "\n"
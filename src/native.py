@@ -0,0 +1,301 @@
+"""原生 CPython 部署：把 FastMCPServer 的路由表作为 ASGI 应用，在预先 fork 的多个进程中运行
+
+    python src/native.py --port 8000 --workers 4
+
+每个工作进程都有一个 FastMCPServer，处理代码与 Durable Object 中完全相同；
+ctx.storage.sql 由 sqlite3 代替，指向同一个文件时结果缓存和输出分页由全部进程共享。
+会话和持久流保存在进程内存中，只对处理它们的那个进程可见。
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from urllib.parse import quote
+
+# src/uvicorn.py 只是为 Workers 中的 mcp 准备的空模块。把 src 目录移到 sys.path 末尾，
+# 使 uvicorn 解析到真正安装的包，同目录的 worker 等模块仍然可以导入
+_SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:] = [path for path in sys.path if os.path.abspath(path or os.curdir) != _SRC_DIR]
+sys.path.append(_SRC_DIR)
+
+import worker  # noqa: E402
+from logger import logger  # noqa: E402
+from native_runtime import DurableObjectState  # noqa: E402
+
+DEFAULT_STORAGE_PATH = "native_storage.sqlite3"
+# 请求体上限（字节），超过时返回 413；可用同名环境变量覆盖
+DEFAULT_MAX_BODY_BYTES = 16 * 1024 * 1024
+
+# 工作进程启动后不到该秒数就退出时，延迟重启，避免反复崩溃时占满 CPU
+_RESTART_BACKOFF_S = 1.0
+
+
+class NativeEnv:
+    """以进程环境变量代替 Worker 的 env 绑定，未设置的变量为 None"""
+
+    def __getattr__(self, name: str):
+        return os.environ.get(name)
+
+
+class _Headers(dict):
+    """请求头；与 JS Headers 一样按小写名查找，同名的多个值以逗号连接"""
+
+    def __init__(self, raw_headers):
+        super().__init__()
+        for name, value in raw_headers:
+            name, value = name.decode("latin-1").lower(), value.decode("latin-1")
+            self[name] = f"{self[name]}, {value}" if name in self else value
+
+    def get(self, name: str, default=None):
+        return super().get(name.lower(), default)
+
+
+class NativeRequest:
+    """把 ASGI 请求包装成路由表用到的 Workers 请求接口：method、url、headers 和 json()"""
+
+    def __init__(self, scope: dict, body: bytes):
+        self.method = scope["method"]
+        self.headers = _Headers(scope["headers"])
+        host = self.headers.get("host")
+        if host is None:
+            server_host, server_port = scope.get("server") or ("localhost", None)
+            host = f"{server_host}:{server_port}" if server_port else server_host
+        raw_path = scope.get("raw_path")
+        if raw_path:
+            path = raw_path.decode("latin-1")
+        else:
+            path = quote(scope.get("root_path", "") + scope["path"])
+        query = scope.get("query_string", b"").decode("latin-1")
+        self.url = f"{scope.get('scheme', 'http')}://{host}{path}" + (f"?{query}" if query else "")
+        self._body = body
+
+    async def json(self):
+        return json.loads(self._body)
+
+
+def _encode_headers(headers: dict) -> list:
+    return [
+        (name.lower().encode("latin-1"), str(value).encode("latin-1"))
+        for name, value in headers.items()
+    ]
+
+
+async def _wait_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+class NativeApp:
+    """ASGI 应用：每个进程在首次使用时创建自己的 FastMCPServer
+
+    服务器必须在 fork 之后创建，使每个进程持有自己的 sqlite3 连接和事件循环中的状态。
+    """
+
+    def __init__(self, storage_path: str | None = None):
+        self.storage_path = storage_path
+        # 多进程运行时由监督进程设置，作为输出句柄和指标中的分片名
+        self.worker_name = None
+        self._server = None
+        self._max_body_bytes = None
+
+    def _get_server(self) -> worker.FastMCPServer:
+        if self._server is None:
+            path = (self.storage_path or os.environ.get("NATIVE_STORAGE_PATH")
+                    or DEFAULT_STORAGE_PATH)
+            env = NativeEnv()
+            self._server = worker.FastMCPServer(DurableObjectState(path), env)
+            self._server.output_store.shard = self.worker_name
+            self._max_body_bytes = worker._env_int(
+                env, "NATIVE_MAX_BODY_BYTES", DEFAULT_MAX_BODY_BYTES
+            )
+        return self._server
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            # /ws 依赖运行时的 WebSocketPair，原生部署中拒绝握手
+            await send({"type": "websocket.close", "code": 1003})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self._get_server()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await worker.close_executor()
+                if self._server is not None:
+                    self._server.ctx.storage.sql.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _read_body(self, receive) -> bytes | None:
+        """读出请求体；超过上限时读到越过上限为止，客户端中途断开时返回 None"""
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            chunk = message.get("body", b"")
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > self._max_body_bytes or not message.get("more_body", False):
+                return b"".join(chunks)
+
+    async def _http(self, scope, receive, send):
+        server = self._get_server()
+        body = await self._read_body(receive)
+        if body is None:
+            return
+        if len(body) > self._max_body_bytes:
+            response = worker._json_response({"error": "Request body too large"}, 413)
+        else:
+            request = NativeRequest(scope, body)
+            if (request.headers.get("upgrade") or "").lower() == "websocket":
+                response = worker._json_response(
+                    {"error": "WebSocket is not available in native mode"}, 501
+                )
+            else:
+                response = await server.fetch(request)
+        await self._send_response(response, receive, send)
+
+    async def _send_response(self, response, receive, send):
+        body = response.body
+        headers = dict(response.headers)
+        if body is None or isinstance(body, (str, bytes, bytearray)):
+            data = body.encode() if isinstance(body, str) else bytes(body or b"")
+            headers["Content-Length"] = str(len(data))
+            await send({"type": "http.response.start", "status": response.status,
+                        "headers": _encode_headers(headers)})
+            await send({"type": "http.response.body", "body": data})
+            return
+
+        await send({"type": "http.response.start", "status": response.status,
+                    "headers": _encode_headers(headers)})
+        # 客户端断开时取消推送，持久流等无限的响应体由此得以结束并清理
+        streaming = asyncio.ensure_future(self._stream_body(body, send))
+        disconnect = asyncio.ensure_future(_wait_disconnect(receive))
+        try:
+            await asyncio.wait({streaming, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            disconnect.cancel()
+            if not streaming.done():
+                streaming.cancel()
+            await asyncio.gather(streaming, disconnect, return_exceptions=True)
+
+    @staticmethod
+    async def _stream_body(body, send):
+        try:
+            async for chunk in body:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            aclose = getattr(body, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+
+app = NativeApp()
+
+
+def _run_worker(sock: socket.socket, index: int, log_level: str):
+    """在 fork 出的子进程中运行 uvicorn，接受监督进程监听的套接字上的连接"""
+    import uvicorn
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    app.worker_name = f"worker-{index}"
+    config = uvicorn.Config(app, lifespan="on", log_level=log_level, access_log=False)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def serve(host: str = "127.0.0.1", port: int = 8000, workers: int | None = None,
+          log_level: str = "info"):
+    """预先 fork 的多进程服务器
+
+    监督进程监听套接字后 fork 出 workers 个工作进程，由内核在它们之间分配连接；
+    worker 模块在 fork 之前已经导入，子进程共享其代码对象和内置函数表。
+    工作进程意外退出时在同一位置重启，收到 SIGINT/SIGTERM 时通知全部工作进程退出。
+    未设置 EXEC_POOL_SIZE 时，每个工作进程的执行进程池大小为 CPU 数除以 workers，至少为 1。
+    """
+    import uvicorn  # noqa: F401  在 fork 之前导入，缺少依赖时立即报错
+
+    workers = workers or os.cpu_count() or 1
+    # 每个工作进程各有一个执行进程池；未指定池大小时由各工作进程平分 CPU，
+    # 否则总进程数会是 CPU 数的平方
+    os.environ.setdefault("EXEC_POOL_SIZE", str(max((os.cpu_count() or 1) // workers, 1)))
+    sock = socket.create_server((host, port), backlog=2048)
+    sock.set_inheritable(True)
+
+    children = {}
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(sock, index, log_level)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = (index, time.monotonic())
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for index in range(workers):
+        spawn(index)
+    logger.info("Serving on http://%s:%d with %d worker processes", host, port, workers)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index, started = children.pop(pid, (None, 0))
+        if stopping or index is None:
+            continue
+        logger.warning("Worker %d (pid %d) exited with status %d, restarting",
+                       index, pid, os.waitstatus_to_exitcode(status))
+        if time.monotonic() - started < _RESTART_BACKOFF_S:
+            time.sleep(_RESTART_BACKOFF_S)
+        spawn(index)
+    sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve the MCP server natively with pre-forked workers"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument("--storage", default=None,
+                        help=f"SQLite file standing in for Durable Object storage "
+                             f"(default: $NATIVE_STORAGE_PATH or {DEFAULT_STORAGE_PATH})")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+    app.storage_path = args.storage
+    serve(args.host, args.port, args.workers, args.log_level)
+
+
+if __name__ == "__main__":
+    main()
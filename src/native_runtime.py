@@ -0,0 +1,69 @@
+"""在原生 CPython 中代替 Workers 运行时的对象：Response、DurableObject 和 Durable Object 存储"""
+import sqlite3
+
+
+class Response:
+    """与 workers.Response 相同的构造参数；响应体可以是 str、bytes 或异步迭代器"""
+
+    def __init__(self, body=None, status: int = 200, headers: dict | None = None, web_socket=None):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+        self.web_socket = web_socket
+
+
+class DurableObject:
+    def __init__(self, ctx, env):
+        self.ctx = ctx
+        self.env = env
+
+
+class _Row:
+    """SQL 查询结果的一行，列以属性访问，与运行时返回的 JS 对象一致"""
+
+    def __init__(self, row: sqlite3.Row):
+        self.__dict__.update(zip(row.keys(), row, strict=True))
+
+
+class _Cursor:
+    def __init__(self, rows: list):
+        self._rows = rows
+
+    def toArray(self) -> list:  # noqa: N802
+        return self._rows
+
+
+class SqlStorage:
+    """以 sqlite3 代替 ctx.storage.sql
+
+    path 为 ":memory:" 时数据只在本连接中可见；指向文件时可由多个进程共享，
+    此时使用 WAL 日志，读写可以并发，写入冲突时等待而不是立即报错。
+    """
+
+    def __init__(self, path: str = ":memory:", busy_timeout_ms: int = 5000):
+        # 执行在工作线程中，存储会被不同线程访问；自动提交，与 Durable Object 的单条语句写入一致
+        self._db = sqlite3.connect(
+            path, timeout=busy_timeout_ms / 1000, check_same_thread=False, isolation_level=None,
+        )
+        self._db.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+
+    def exec(self, query: str, *bindings):
+        return _Cursor([_Row(row) for row in self._db.execute(query, bindings)])
+
+    def close(self):
+        self._db.close()
+
+
+class _Storage:
+    def __init__(self, sql: SqlStorage):
+        self.sql = sql
+
+
+class DurableObjectState:
+    """FastMCPServer 的 ctx：只提供用到的 storage.sql"""
+
+    def __init__(self, path: str = ":memory:"):
+        self.storage = _Storage(SqlStorage(path))
@@ -0,0 +1,238 @@
+import asyncio
+import time
+import uuid
+from io import TextIOBase
+
+# 直接随结果返回的输出字符数上限
+DEFAULT_INLINE_LIMIT = 64 * 1024
+# 溢出输出每页的字符数
+DEFAULT_PAGE_SIZE = 64 * 1024
+# 单个输出流最多溢出到存储的字符数，超出部分只计数不保存
+DEFAULT_SPILL_LIMIT = 16 * 1024 * 1024
+# 流式输出合并为一个事件的默认大小上限（字符数）和最长等待时间
+DEFAULT_FLUSH_BYTES = 8 * 1024
+DEFAULT_FLUSH_INTERVAL_MS = 50
+# 两次清理过期输出页之间的最短间隔（秒）
+DEFAULT_SWEEP_INTERVAL_S = 60
+
+
+class BoundedCapture(TextIOBase):
+    """有上限的输出捕获缓冲区
+
+    前 inline_limit 个字符保存在内存中随结果返回；之后的输出按页交给 spill 回调
+    写入存储，超过 spill_limit 或没有 spill 回调时只统计被丢弃的字符数。
+    """
+
+    def __init__(self, inline_limit: int = DEFAULT_INLINE_LIMIT, spill=None,
+                 page_size: int = DEFAULT_PAGE_SIZE, spill_limit: int = DEFAULT_SPILL_LIMIT):
+        self.inline_limit = inline_limit
+        self.page_size = page_size
+        self.spill_limit = spill_limit
+        self._spill = spill
+        self._inline = []
+        self._inline_chars = 0
+        self._pending = []
+        self._pending_chars = 0
+        self.total_chars = 0
+        self.spilled_chars = 0
+        self.spilled_pages = 0
+        self.dropped_chars = 0
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        n = len(s)
+        self.total_chars += n
+        room = self.inline_limit - self._inline_chars
+        if room > 0:
+            if n <= room:
+                self._inline.append(s)
+                self._inline_chars += n
+                return n
+            self._inline.append(s[:room])
+            self._inline_chars += room
+            s = s[room:]
+        self._overflow(s)
+        return n
+
+    def _overflow(self, s: str):
+        allowed = self.spill_limit - self.spilled_chars - self._pending_chars
+        if self._spill is None or allowed <= 0:
+            self.dropped_chars += len(s)
+            return
+        if len(s) > allowed:
+            self.dropped_chars += len(s) - allowed
+            s = s[:allowed]
+
+        self._pending.append(s)
+        self._pending_chars += len(s)
+        if self._pending_chars >= self.page_size:
+            data = "".join(self._pending)
+            offset = 0
+            while len(data) - offset >= self.page_size:
+                self._spill_page(data[offset:offset + self.page_size])
+                offset += self.page_size
+            rest = data[offset:]
+            self._pending = [rest] if rest else []
+            self._pending_chars = len(rest)
+
+    def _spill_page(self, page: str):
+        self._spill(self.spilled_pages, page)
+        self.spilled_pages += 1
+        self.spilled_chars += len(page)
+
+    def finish(self):
+        """把尚未写满一页的溢出内容作为最后一页写入存储"""
+        if self._pending:
+            self._spill_page("".join(self._pending))
+            self._pending = []
+            self._pending_chars = 0
+
+    def getvalue(self) -> str:
+        return "".join(self._inline)
+
+    @property
+    def truncated(self) -> bool:
+        return self.total_chars > self._inline_chars
+
+    def summary(self) -> dict:
+        return {
+            "total_chars": self.total_chars,
+            "inline_chars": self._inline_chars,
+            "spilled_pages": self.spilled_pages,
+            "dropped_chars": self.dropped_chars,
+        }
+
+
+class OutputSpill:
+    """一次执行溢出到存储的输出；写入第一页时才生成句柄，没有溢出的执行不访问存储"""
+
+    def __init__(self, store: "OutputStore"):
+        self._store = store
+        self._expires_at = time.time() + store.ttl
+        self.handle = None
+
+    def writer(self, stream: str):
+        """返回把该输出流的页写入存储的回调，供 BoundedCapture 使用"""
+        def write_page(seq: int, content: str):
+            if self.handle is None:
+                self.handle = self._store.new_handle()
+            self._store.write_page(self.handle, stream, seq, content, self._expires_at)
+
+        return write_page
+
+
+class OutputStore:
+    """在 Durable Object SQLite 存储中保存溢出的输出页，通过句柄和游标分页读取
+
+    过期的输出页在生成新句柄时顺带清理，两次清理至少间隔 sweep_interval 秒；
+    清理按 expires_at 索引只访问过期的行。读取时忽略已过期但尚未清理的页。
+    """
+
+    def __init__(self, sql, ttl: float = 3600, sweep_interval: float = DEFAULT_SWEEP_INTERVAL_S):
+        self._sql = sql
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+        # 句柄前缀，用于让入口 Worker 把分页请求路由回保存输出的分片
+        self.shard = None
+        self._sql.exec(
+            "CREATE TABLE IF NOT EXISTS output_pages ("
+            " handle TEXT NOT NULL,"
+            " stream TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " content TEXT NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " PRIMARY KEY (handle, stream, seq))"
+        )
+        self._sql.exec(
+            "CREATE INDEX IF NOT EXISTS output_pages_expires_at ON output_pages (expires_at)"
+        )
+
+    def spill(self) -> OutputSpill:
+        """开始一次执行的输出溢出"""
+        return OutputSpill(self)
+
+    def new_handle(self) -> str:
+        """生成新的输出句柄；距上次清理已超过 sweep_interval 时顺带删除过期的输出页"""
+        now = time.time()
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            self._sql.exec("DELETE FROM output_pages WHERE expires_at <= ?", now)
+        token = uuid.uuid4().hex
+        return f"{self.shard}~{token}" if self.shard else token
+
+    def write_page(self, handle: str, stream: str, seq: int, content: str, expires_at: float):
+        self._sql.exec(
+            "INSERT OR REPLACE INTO output_pages (handle, stream, seq, content, expires_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            handle, stream, seq, content, expires_at,
+        )
+
+    def read(self, handle: str, stream: str, cursor: int) -> dict | None:
+        """读取游标位置的一页；句柄不存在或已过期时返回 None"""
+        rows = self._sql.exec(
+            "SELECT seq, content FROM output_pages"
+            " WHERE handle = ? AND stream = ? AND seq >= ? AND expires_at > ?"
+            " ORDER BY seq LIMIT 2",
+            handle, stream, cursor, time.time(),
+        ).toArray()
+        if not len(rows) or rows[0].seq != cursor:
+            return None
+        return {
+            "handle": handle,
+            "stream": stream,
+            "cursor": cursor,
+            "content": rows[0].content,
+            "next_cursor": cursor + 1 if len(rows) > 1 else None,
+        }
+
+
+async def coalesce_output(queue: asyncio.Queue, flush_bytes: int = DEFAULT_FLUSH_BYTES,
+                          flush_interval_ms: float = DEFAULT_FLUSH_INTERVAL_MS):
+    """把队列中连续的同类输出块合并后产出
+
+    队列元素为 (kind, text)，None 表示结束。合并的内容达到 flush_bytes 个字符，
+    或距其中第一块到达已过 flush_interval_ms 毫秒时产出 (kind, text)；
+    输出类型变化或结束时立即产出已合并的内容。
+    """
+    loop = asyncio.get_running_loop()
+    interval = flush_interval_ms / 1000
+    kind = None
+    parts = []
+    size = 0
+    deadline = 0.0
+    while True:
+        if not parts:
+            item = await queue.get()
+        else:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                try:
+                    if timeout <= 0:
+                        raise TimeoutError
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except TimeoutError:
+                    yield kind, "".join(parts)
+                    parts, size = [], 0
+                    continue
+
+        if item is None:
+            if parts:
+                yield kind, "".join(parts)
+            return
+        item_kind, text = item
+        if parts and item_kind != kind:
+            yield kind, "".join(parts)
+            parts, size = [], 0
+        if not parts:
+            kind = item_kind
+            deadline = loop.time() + interval
+        parts.append(text)
+        size += len(text)
+        if size >= flush_bytes:
+            yield kind, "".join(parts)
+            parts, size = [], 0
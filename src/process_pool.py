@@ -0,0 +1,378 @@
+"""预先启动的执行进程池
+
+代码在独立的工作进程中执行：CPU 密集的代码不阻塞服务器的事件循环，多个执行可以并行使用多核，
+执行中的崩溃只影响所在的工作进程。父子进程之间通过 socketpair 上的帧通信，每帧为
+1 字节类型、4 字节负载长度（网络字节序）和负载；任务和结果用 marshal 编码，输出直接是 UTF-8 文本。
+"""
+import asyncio
+import importlib
+import marshal
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+from io import StringIO, TextIOBase
+
+from logger import logger
+
+_HEADER = struct.Struct("!cI")
+# 父进程 -> 工作进程：(代码, 时间预算毫秒)
+JOB = b"J"
+# 工作进程 -> 父进程：预热完成，负载为 (常驻内存字节,)
+READY = b"W"
+# 工作进程 -> 父进程：执行期间的输出文本
+STDOUT = b"O"
+STDERR = b"E"
+# 工作进程 -> 父进程：(错误, 墙钟毫秒, CPU 毫秒, 是否超时, 常驻内存字节)
+# 错误为 None 或 (类型名, 消息, 回溯)
+RESULT = b"R"
+
+# 工作进程中的输出累计超过该字符数时立即发给父进程，否则每隔 OUTPUT_FLUSH_INTERVAL_MS 毫秒发送一次
+OUTPUT_BUFFER_CHARS = 16 * 1024
+OUTPUT_FLUSH_INTERVAL_MS = 5
+
+# 超过时间预算后再等待这么久仍没有结果（例如卡在不触发跟踪钩子的 C 调用中）时，强制结束工作进程
+KILL_GRACE_MS = 1000
+
+DEFAULT_MAX_JOBS = 100
+DEFAULT_MAX_GROWTH_BYTES = 64 * 1024 * 1024
+
+
+class RemoteError(Exception):
+    """执行的代码在工作进程中抛出的异常；保留原异常的类型名和工作进程中的回溯"""
+
+    def __init__(self, type_name: str, message: str, remote_traceback: str):
+        super().__init__(message)
+        self.type_name = type_name
+        self.remote_traceback = remote_traceback
+
+
+class ExecutionProcessError(RuntimeError):
+    """工作进程在执行期间意外退出"""
+
+
+def _rss_bytes() -> int:
+    """当前进程的常驻内存；没有 /proc 时退而使用峰值"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _frame(kind: bytes, payload: bytes) -> bytes:
+    return _HEADER.pack(kind, len(payload)) + payload
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> tuple[bytes, bytes]:
+    kind, length = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return kind, await reader.readexactly(length)
+
+
+# ---- 工作进程 ----
+
+class _Channel:
+    """工作进程一侧的帧读写
+
+    两路输出共用一个缓冲，保持 stdout 与 stderr 之间的先后顺序。后台线程定时发送缓冲中的输出，
+    逐行打印的代码不必每行发一帧，只打印一次就长时间运行的代码的输出也能及时送达。
+    """
+
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+        self._rfile = sock.makefile("rb")
+        self._pending = []
+        self._pending_chars = 0
+        self._lock = threading.Lock()
+        threading.Thread(target=self._flush_periodically, daemon=True).start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(OUTPUT_FLUSH_INTERVAL_MS / 1000)
+            if self._pending:
+                self.flush_output()
+
+    def recv(self) -> tuple[bytes | None, bytes]:
+        """读取一帧；父进程关闭连接时返回 (None, b"")"""
+        header = self._rfile.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return None, b""
+        kind, length = _HEADER.unpack(header)
+        return kind, self._rfile.read(length)
+
+    def send(self, kind: bytes, payload: bytes):
+        with self._lock:
+            self._sock.sendall(_frame(kind, payload))
+
+    def write_output(self, kind: bytes, s: str):
+        with self._lock:
+            if self._pending and self._pending[-1][0] == kind:
+                self._pending[-1][1].append(s)
+            else:
+                self._pending.append((kind, [s]))
+            self._pending_chars += len(s)
+            full = self._pending_chars >= OUTPUT_BUFFER_CHARS
+        if full:
+            self.flush_output()
+
+    def flush_output(self):
+        with self._lock:
+            if not self._pending:
+                return
+            frames = [
+                _frame(kind, "".join(parts).encode("utf-8", "surrogatepass"))
+                for kind, parts in self._pending
+            ]
+            self._pending.clear()
+            self._pending_chars = 0
+            self._sock.sendall(b"".join(frames))
+
+
+class _ChannelWriter(TextIOBase):
+    def __init__(self, channel: _Channel, kind: bytes):
+        self._channel = channel
+        self._kind = kind
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        if s:
+            self._channel.write_output(self._kind, s)
+        return len(s)
+
+    def flush(self):
+        self._channel.flush_output()
+
+
+def _serve(fd: int, handler: str, preload: list):
+    """工作进程的主循环：预热后逐个执行任务，父进程关闭连接时退出
+
+    handler 为 "模块:函数"，以 (代码, 时间预算毫秒, stdout, stderr) 调用，
+    返回 (错误, 墙钟毫秒, CPU 毫秒, 是否超时)。
+    """
+    channel = _Channel(socket.socket(fileno=fd))
+    for name in preload:
+        importlib.import_module(name)
+    module_name, _, function_name = handler.partition(":")
+    run_job = getattr(importlib.import_module(module_name), function_name)
+    # 空跑一次，使编译和执行路径上的惰性初始化在第一个任务之前完成；其输出丢弃
+    run_job("pass", 1000, StringIO(), StringIO())
+    stdout, stderr = _ChannelWriter(channel, STDOUT), _ChannelWriter(channel, STDERR)
+    channel.send(READY, marshal.dumps((_rss_bytes(),)))
+
+    while True:
+        kind, payload = channel.recv()
+        if kind is None:
+            return
+        code, time_budget_ms = marshal.loads(payload)
+        result = run_job(code, time_budget_ms, stdout, stderr)
+        channel.flush_output()
+        channel.send(RESULT, marshal.dumps((*result, _rss_bytes())))
+
+
+# ---- 父进程 ----
+
+class _Worker:
+    __slots__ = ("baseline_rss", "jobs", "process", "reader", "rss", "writer")
+
+    def __init__(self, process, reader, writer, rss: int):
+        self.process = process
+        self.reader = reader
+        self.writer = writer
+        self.jobs = 0
+        self.baseline_rss = rss
+        self.rss = rss
+
+
+class ProcessPool:
+    """保持 size 个预热好的工作进程，把执行分派给空闲的进程
+
+    工作进程是新启动的解释器，不从服务器进程 fork：服务器中已有事件循环和线程，
+    fork 后子进程可能继承被其他线程持有的锁。启动时导入 handler 所在模块和 preload 中的模块，
+    并空跑一次执行路径，之后才接受任务。一个进程执行满 max_jobs 次，或常驻内存比预热完成时
+    增长超过 max_growth_bytes 后被回收，替代进程在后台提前启动。
+    """
+
+    def __init__(self, handler: str, size: int | None = None, max_jobs: int = DEFAULT_MAX_JOBS,
+                 max_growth_bytes: int = DEFAULT_MAX_GROWTH_BYTES, preload: tuple = ()):
+        self.handler = handler
+        self.size = max(size or os.cpu_count() or 1, 1)
+        self.max_jobs = max_jobs
+        self.max_growth_bytes = max_growth_bytes
+        self.preload = tuple(preload)
+        # 空闲的工作进程；后台启动失败时放入异常，唤醒等待中的调用
+        self._idle = asyncio.Queue()
+        # 存活或正在启动的工作进程数
+        self._live = 0
+        self._closed = False
+        self._tasks = set()
+        self.jobs = 0
+        self.recycled = 0
+        self.crashed = 0
+        self.killed = 0
+
+    def start(self):
+        """在后台预先启动全部工作进程"""
+        while self._live < self.size:
+            self._prestart()
+
+    async def run(self, code: str, stdout, stderr, budget):
+        """在工作进程中执行代码：输出写入 stdout/stderr，耗时记入 budget
+
+        代码抛出的异常以 RemoteError 重新抛出；超时被强制结束时抛出 TimeoutError，
+        工作进程崩溃时抛出 ExecutionProcessError。
+        """
+        worker = await self._acquire()
+        try:
+            error = await self._execute(worker, code, stdout, stderr, budget)
+        except BaseException:
+            # 超时、崩溃或调用被取消：工作进程的状态不再可信
+            self._retire(worker, kill=True)
+            raise
+        self._release(worker)
+        if error is not None:
+            raise RemoteError(*error)
+
+    async def _acquire(self) -> _Worker:
+        if self._closed:
+            raise RuntimeError("The execution process pool is closed")
+        if self._idle.empty() and self._live < self.size:
+            self._live += 1
+            try:
+                return await self._spawn()
+            except BaseException:
+                self._live -= 1
+                raise
+        worker = await self._idle.get()
+        if isinstance(worker, BaseException):
+            raise RuntimeError("Failed to start an execution process") from worker
+        return worker
+
+    async def _spawn(self) -> _Worker:
+        parent_sock, child_sock = socket.socketpair()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__),
+                str(child_sock.fileno()), self.handler, ",".join(self.preload),
+                pass_fds=(child_sock.fileno(),), stdin=asyncio.subprocess.DEVNULL,
+            )
+        except BaseException:
+            parent_sock.close()
+            raise
+        finally:
+            child_sock.close()
+        reader, writer = await asyncio.open_connection(sock=parent_sock)
+        try:
+            kind, payload = await _read_frame(reader)
+        except asyncio.IncompleteReadError:
+            kind = None
+        if kind != READY:
+            writer.close()
+            if process.returncode is None:
+                process.kill()
+            status = await process.wait()
+            raise ExecutionProcessError(f"Execution process failed to start (status {status})")
+        (rss,) = marshal.loads(payload)
+        return _Worker(process, reader, writer, rss)
+
+    def _prestart(self):
+        async def spawn():
+            try:
+                worker = await self._spawn()
+            except Exception as e:
+                self._live -= 1
+                logger.warning("Failed to start an execution process: %s", e)
+                self._idle.put_nowait(e)
+                return
+            if self._closed:
+                self._retire(worker)
+            else:
+                self._idle.put_nowait(worker)
+
+        self._live += 1
+        self._background(spawn())
+
+    def _background(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, worker: _Worker, code: str, stdout, stderr, budget):
+        worker.writer.write(_frame(JOB, marshal.dumps((code, budget.limit_ms))))
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            async with asyncio.timeout_at(started + (budget.limit_ms + KILL_GRACE_MS) / 1000):
+                while True:
+                    kind, payload = await _read_frame(worker.reader)
+                    if kind == RESULT:
+                        break
+                    text = payload.decode("utf-8", "surrogatepass")
+                    (stdout if kind == STDOUT else stderr).write(text)
+        except TimeoutError:
+            self.killed += 1
+            budget.exceeded = True
+            budget.used_ms = (loop.time() - started) * 1000
+            raise TimeoutError(budget.message) from None
+        except asyncio.IncompleteReadError:
+            self.crashed += 1
+            status = await worker.process.wait()
+            raise ExecutionProcessError(
+                f"Execution process exited unexpectedly with status {status}"
+            ) from None
+
+        error, budget.used_ms, budget.cpu_ms, budget.exceeded, worker.rss = marshal.loads(payload)
+        worker.jobs += 1
+        self.jobs += 1
+        return error
+
+    def _release(self, worker: _Worker):
+        if self._closed:
+            self._retire(worker)
+        elif (worker.jobs >= self.max_jobs
+              or worker.rss - worker.baseline_rss > self.max_growth_bytes):
+            self.recycled += 1
+            self._retire(worker)
+            self._prestart()
+        else:
+            self._idle.put_nowait(worker)
+
+    def _retire(self, worker: _Worker, kill: bool = False):
+        """结束工作进程：正常回收时关闭连接，由它自行退出；kill 时立即杀死，并补充一个新进程"""
+        self._live -= 1
+        if kill and worker.process.returncode is None:
+            worker.process.kill()
+        worker.writer.close()
+        self._background(worker.process.wait())
+        if kill and not self._closed:
+            self._prestart()
+
+    async def close(self):
+        """关闭进程池：空闲进程立即退出，执行中的进程在当前任务完成后退出"""
+        self._closed = True
+        while not self._idle.empty():
+            worker = self._idle.get_nowait()
+            if not isinstance(worker, BaseException):
+                self._retire(worker)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "live": self._live,
+            "idle": self._idle.qsize(),
+            "jobs": self.jobs,
+            "recycled": self.recycled,
+            "crashed": self.crashed,
+            "killed": self.killed,
+        }
+
+
+if __name__ == "__main__":
+    _serve(int(sys.argv[1]), sys.argv[2], [name for name in sys.argv[3].split(",") if name])
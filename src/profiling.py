@@ -0,0 +1,138 @@
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+PROFILE_TOP_DEFAULT = 10
+PROFILE_TOP_MAX = 50
+
+# tracemalloc 为每次分配只记录最内层的一帧，足以定位到用户代码的行
+_TRACE_FRAMES = 1
+
+# tracemalloc 是进程级的：同一时间只剖析一次执行的内存，避免峰值互相干扰
+_memory_lock = threading.Lock()
+
+# 剖析器自身产生的调用，不出现在报告中
+_HIDDEN_FUNCTIONS = {
+    "<built-in method builtins.exec>",
+    "<method 'disable' of '_lsprof.Profiler' objects>",
+}
+
+
+def parse_profile_option(value, top=None) -> dict | None:
+    """解析 profile 参数，返回 ExecutionProfiler 的构造参数；未开启时返回 None
+
+    true 同时剖析 CPU 和内存，"cpu" 或 "memory" 只剖析其一，也可以传入二者组成的列表。
+    """
+    if not value:
+        return None
+    if value is True:
+        kinds = {"cpu", "memory"}
+    else:
+        if isinstance(value, str):
+            kinds = {value}
+        else:
+            kinds = set(value) if isinstance(value, list) else None
+        if not kinds or not kinds <= {"cpu", "memory"}:
+            raise ValueError('profile must be true, "cpu", "memory" or a list of them')
+    top = PROFILE_TOP_DEFAULT if top is None else int(top)
+    return {
+        "cpu": "cpu" in kinds,
+        "memory": "memory" in kinds,
+        "top": min(max(top, 1), PROFILE_TOP_MAX),
+    }
+
+
+class ExecutionProfiler:
+    """剖析一次代码执行
+
+    cProfile 统计函数的调用次数和耗时，tracemalloc 统计执行期间的峰值内存和仍未释放的分配位置。
+    只有开启剖析的执行才创建剖析器，未开启时执行路径上没有任何额外开销。
+    """
+
+    def __init__(self, cpu: bool = True, memory: bool = True, top: int = PROFILE_TOP_DEFAULT,
+                 filename: str = "<string>"):
+        self.top = top
+        self.filename = filename
+        self._cpu = cProfile.Profile() if cpu else None
+        self._trace_allocations = memory
+        self._memory = None
+        self._snapshot = None
+
+    def run(self, code_object, exec_globals: dict, runner=None):
+        """在剖析下执行代码对象；CPU 剖析只包住 exec 本身，报告中不含剖析器的调用
+
+        传入 runner 时以 runner(func, *args) 调用 exec，例如在时间预算中调用。
+        """
+        if runner is None:
+            def runner(func, *args):
+                return func(*args)
+        with self._trace_memory() if self._trace_allocations else nullcontext():
+            if self._cpu is None:
+                runner(exec, code_object, exec_globals)
+            else:
+                runner(self._cpu.runcall, exec, code_object, exec_globals)
+
+    @contextmanager
+    def _trace_memory(self):
+        with _memory_lock:
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start(_TRACE_FRAMES)
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            try:
+                yield
+            finally:
+                current, peak = tracemalloc.get_traced_memory()
+                # 只保留被执行代码中的分配位置
+                self._snapshot = tracemalloc.take_snapshot().filter_traces(
+                    [tracemalloc.Filter(True, self.filename)]
+                )
+                if started:
+                    tracemalloc.stop()
+                self._memory = {
+                    "peak_bytes": max(peak - baseline, 0),
+                    "retained_bytes": max(current - baseline, 0),
+                }
+
+    def _top_functions(self) -> list:
+        self._cpu.create_stats()
+        entries = sorted(self._cpu.stats.items(), key=lambda item: item[1][3], reverse=True)
+        functions = []
+        for (filename, line, name), (_, calls, total, cumulative, _) in entries:
+            if name in _HIDDEN_FUNCTIONS:
+                continue
+            functions.append({
+                "function": name,
+                "file": None if filename == "~" else filename,
+                "line": line,
+                "calls": calls,
+                "total_ms": round(total * 1000, 3),
+                "cumulative_ms": round(cumulative * 1000, 3),
+            })
+            if len(functions) == self.top:
+                break
+        return functions
+
+    def _top_allocations(self, source_lines: list) -> list:
+        allocations = []
+        for stat in self._snapshot.statistics("lineno")[:self.top]:
+            line = stat.traceback[0].lineno
+            allocations.append({
+                "line": line,
+                "code": source_lines[line - 1].strip() if 0 < line <= len(source_lines) else None,
+                "size_bytes": stat.size,
+                "count": stat.count,
+            })
+        return allocations
+
+    def report(self, source: str) -> dict:
+        """返回精简的剖析报告；source 用于在分配位置旁附上对应的代码行"""
+        report = {}
+        if self._cpu is not None:
+            report["functions"] = self._top_functions()
+        if self._memory is not None:
+            top_allocations = self._top_allocations(source.splitlines())
+            report["memory"] = {**self._memory, "top_allocations": top_allocations}
+        return report
@@ -0,0 +1,162 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """确定性代码片段的执行结果缓存
+
+    内存中的 LRU 层位于 Durable Object SQLite 层之前，热点条目无需访问存储。
+    SQLite 层按 TTL 过期，并在总大小超限时按最近访问时间淘汰。
+    sql 为 None 时（没有 Durable Object 存储）只使用内存层。
+    """
+
+    def __init__(self, sql=None, ttl: float = 3600, max_bytes: int = 32 * 1024 * 1024,
+                 max_entry_bytes: int = 1024 * 1024, memory_entries: int = 128):
+        self._sql = sql
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.memory_entries = memory_entries
+        # key -> (结果字典, 过期时间)
+        self._memory = OrderedDict()
+        self.memory_hits = 0
+        self.storage_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self._sql is not None:
+            self._sql.exec(
+                "CREATE TABLE IF NOT EXISTS result_cache ("
+                " key TEXT PRIMARY KEY,"
+                " stdout TEXT NOT NULL,"
+                " stderr TEXT NOT NULL,"
+                " error TEXT,"
+                " size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._sql.exec(
+                "CREATE INDEX IF NOT EXISTS result_cache_last_access"
+                " ON result_cache (last_access)"
+            )
+            self._bytes = self._stored_bytes()
+        else:
+            self._bytes = 0
+
+    @staticmethod
+    def make_key(code: str, cache_key: str | None = None) -> str:
+        """由源码和可选的调用方缓存键生成条目键"""
+        digest = hashlib.sha256(code.encode("utf-8", "surrogatepass"))
+        if cache_key:
+            digest.update(b"\0")
+            digest.update(str(cache_key).encode("utf-8", "surrogatepass"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        """查找缓存的执行结果，未命中或已过期时返回 None"""
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            result, expires_at = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return result
+            del self._memory[key]
+
+        if self._sql is not None:
+            rows = self._sql.exec(
+                "SELECT stdout, stderr, error, expires_at FROM result_cache"
+                " WHERE key = ? AND expires_at > ?",
+                key, now,
+            ).toArray()
+            if len(rows):
+                row = rows[0]
+                result = {
+                    "success": row.error is None,
+                    "stdout": row.stdout,
+                    "stderr": row.stderr,
+                    "error": row.error,
+                }
+                self._sql.exec(
+                    "UPDATE result_cache SET last_access = ? WHERE key = ?", now, key
+                )
+                self._remember(key, result, row.expires_at)
+                self.storage_hits += 1
+                return result
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, result: dict, ttl: float | None = None):
+        """保存执行结果；超过单条大小上限或 TTL 不为正数的结果不缓存"""
+        stdout = result["stdout"]
+        stderr = result["stderr"]
+        error = result["error"]
+        size = len(stdout) + len(stderr) + len(error or "")
+        ttl = self.ttl if ttl is None else ttl
+        if size > self.max_entry_bytes or not ttl > 0:
+            return
+
+        now = time.time()
+        expires_at = now + ttl
+        entry = {"success": error is None, "stdout": stdout, "stderr": stderr, "error": error}
+        self._remember(key, entry, expires_at)
+
+        if self._sql is not None:
+            # 替换已有条目时先减去旧条目的大小，避免重复计入
+            rows = self._sql.exec("SELECT size FROM result_cache WHERE key = ?", key).toArray()
+            if len(rows):
+                self._bytes -= rows[0].size
+            self._sql.exec(
+                "INSERT OR REPLACE INTO result_cache"
+                " (key, stdout, stderr, error, size, expires_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                key, stdout, stderr, error, size, expires_at, now,
+            )
+            self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._evict(now)
+
+    def _remember(self, key: str, result: dict, expires_at: float):
+        self._memory[key] = (result, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _stored_bytes(self) -> int:
+        rows = self._sql.exec("SELECT COALESCE(SUM(size), 0) AS total FROM result_cache").toArray()
+        return int(rows[0].total)
+
+    def _evict(self, now: float):
+        """先删除过期条目，仍超限时按最近访问时间淘汰，直到降到上限的 90%"""
+        self._sql.exec("DELETE FROM result_cache WHERE expires_at <= ?", now)
+        self._bytes = self._stored_bytes()
+        target = int(self.max_bytes * 0.9)
+        while self._bytes > target:
+            rows = self._sql.exec(
+                "SELECT key, size FROM result_cache ORDER BY last_access LIMIT 32"
+            ).toArray()
+            if not len(rows):
+                break
+            for row in rows:
+                if self._bytes <= target:
+                    break
+                self._sql.exec("DELETE FROM result_cache WHERE key = ?", row.key)
+                self._memory.pop(row.key, None)
+                self._bytes -= row.size
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """返回各层的命中与淘汰计数"""
+        return {
+            "memory_entries": len(self._memory),
+            "stored_bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "memory_hits": self.memory_hits,
+            "storage_hits": self.storage_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "persistent": self._sql is not None,
+        }
@@ -0,0 +1,185 @@
+import time
+from urllib.parse import parse_qs, urlparse
+
+
+class HTTPError(Exception):
+    """处理器或中间件中断请求时抛出，由错误映射中间件转换为 JSON 错误响应"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Route:
+    """一条路由：方法、路径模式、处理器，以及是否只在入口 Worker 处理"""
+
+    __slots__ = ("edge", "handler", "methods", "name", "pattern", "segments")
+
+    def __init__(self, methods: tuple, pattern: str, handler, name: str, edge: bool):
+        self.methods = methods
+        self.pattern = pattern
+        self.handler = handler
+        self.name = name
+        self.edge = edge
+        self.segments = pattern.strip("/").split("/")
+
+    def match(self, segments: list) -> dict | None:
+        """按段匹配路径，成功时返回路径参数"""
+        params = {}
+        for expected, actual in zip(self.segments, segments, strict=True):
+            if expected.startswith("{"):
+                if not actual:
+                    return None
+                params[expected[1:-1]] = actual
+            elif expected != actual:
+                return None
+        return params
+
+
+class RequestContext:
+    """一次请求在处理管道中携带的上下文"""
+
+    __slots__ = ("_query", "method", "params", "path", "request", "route", "state", "url")
+
+    def __init__(self, request, state):
+        self.request = request
+        self.state = state
+        self.method = request.method
+        self.url = urlparse(request.url)
+        self.path = self.url.path
+        self.route = None
+        self.params = {}
+        self._query = None
+
+    @property
+    def query(self) -> dict:
+        """解析后的查询参数，首次访问时才解析"""
+        if self._query is None:
+            self._query = parse_qs(self.url.query)
+        return self._query
+
+    def query_value(self, name: str, default: str | None = None) -> str | None:
+        values = self.query.get(name)
+        return values[0] if values else default
+
+
+class Router:
+    """表驱动的路由器
+
+    静态路径按 (方法, 路径) 直接查表；带参数的路径按 (方法, 首段, 段数) 分桶后逐个匹配。
+    中间件按注册顺序由外向内包裹处理器，组合结果缓存到路由表或中间件变化为止。
+    入口 Worker 和 Durable Object 共用同一个路由器，各自传入自己的 state。
+    """
+
+    def __init__(self):
+        self._static = {}
+        self._dynamic = {}
+        self._middleware = []
+        self._pipeline = None
+
+    def add(self, methods, pattern: str, handler, name: str | None = None, edge: bool = False):
+        """注册路由；pattern 中的 {name} 段作为路径参数"""
+        if isinstance(methods, str):
+            methods = (methods,)
+        route = Route(tuple(methods), pattern, handler, name or handler.__name__.lstrip("_"), edge)
+        for method in route.methods:
+            if "{" in pattern:
+                key = (method, route.segments[0], len(route.segments))
+                self._dynamic.setdefault(key, []).append(route)
+            else:
+                self._static[(method, pattern)] = route
+        return route
+
+    def route(self, methods, pattern: str, name: str | None = None, edge: bool = False):
+        """以装饰器形式注册路由"""
+        def decorator(handler):
+            self.add(methods, pattern, handler, name, edge)
+            return handler
+        return decorator
+
+    def use(self, middleware):
+        """添加中间件：async (ctx, call_next) -> response"""
+        self._middleware.append(middleware)
+        self._pipeline = None
+        return middleware
+
+    def match(self, method: str, path: str) -> tuple[Route | None, dict]:
+        """查找请求对应的路由，未匹配时返回 (None, {})"""
+        route = self._static.get((method, path))
+        if route is not None:
+            return route, {}
+        segments = path.strip("/").split("/")
+        for route in self._dynamic.get((method, segments[0], len(segments)), ()):
+            params = route.match(segments)
+            if params is not None:
+                return route, params
+        return None, {}
+
+    def _compose(self):
+        async def endpoint(ctx):
+            if ctx.route is None:
+                raise HTTPError(404, "Not found")
+            return await ctx.route.handler(ctx)
+
+        def wrap(middleware, call_next):
+            async def handler(ctx):
+                return await middleware(ctx, call_next)
+            return handler
+
+        pipeline = endpoint
+        for middleware in reversed(self._middleware):
+            pipeline = wrap(middleware, pipeline)
+        return pipeline
+
+    async def dispatch(self, request, state):
+        """匹配路由并通过中间件管道处理请求"""
+        if self._pipeline is None:
+            self._pipeline = self._compose()
+        ctx = RequestContext(request, state)
+        ctx.route, ctx.params = self.match(ctx.method, ctx.path)
+        return await self._pipeline(ctx)
+
+
+class RouteTimer:
+    """按路由统计请求数、异常数和处理耗时的中间件
+
+    流式响应只计到响应头返回为止。传入 histogram 时同时按路由名记录耗时分布。
+    """
+
+    def __init__(self, histogram=None):
+        # 路由名 -> [请求数, 异常数, 总耗时, 最大耗时]，耗时单位为秒
+        self._routes = {}
+        self._histogram = histogram
+
+    async def __call__(self, ctx, call_next):
+        start = time.perf_counter()
+        failed = True
+        try:
+            response = await call_next(ctx)
+            failed = False
+            return response
+        finally:
+            elapsed = time.perf_counter() - start
+            name = ctx.route.name if ctx.route is not None else "unmatched"
+            entry = self._routes.get(name)
+            if entry is None:
+                entry = self._routes[name] = [0, 0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += failed
+            entry[2] += elapsed
+            entry[3] = max(entry[3], elapsed)
+            if self._histogram is not None:
+                self._histogram.observe(elapsed, name)
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                "count": count,
+                "errors": errors,
+                "total_ms": round(total * 1000, 3),
+                "mean_ms": round(total * 1000 / count, 3),
+                "max_ms": round(maximum * 1000, 3),
+            }
+            for name, (count, errors, total, maximum) in self._routes.items()
+        }
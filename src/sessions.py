@@ -0,0 +1,143 @@
+import re
+import sys
+import time
+from collections import OrderedDict
+
+# 会话 ID 同时用于 URL 路径和分片路由键
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+# 估算命名空间大小时最多访问的对象数，避免巨大的数据结构拖慢每次调用
+_MAX_SIZED_OBJECTS = 100_000
+
+
+def estimate_size(namespace: dict) -> int:
+    """粗略估算命名空间中用户对象占用的内存字节数"""
+    seen = set()
+    stack = [value for name, value in namespace.items() if name != "__builtins__"]
+    total = 0
+    while stack and len(seen) < _MAX_SIZED_OBJECTS:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj, 64)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return total
+
+
+class Session:
+    """一个会话保留的解释器命名空间"""
+
+    __slots__ = ("created_at", "last_used", "namespace", "session_id", "size")
+
+    def __init__(self, session_id: str, namespace: dict):
+        self.session_id = session_id
+        self.namespace = namespace
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.size = 0
+
+    def info(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "created_at": self.created_at,
+            "last_used": self.last_used,
+            "size_bytes": self.size,
+        }
+
+
+class SessionStore:
+    """保存在 Durable Object 内存中的会话命名空间
+
+    同时限制单个会话和全部会话的内存占用；超过全局上限或会话数上限时，
+    按最近使用顺序淘汰空闲会话。
+    """
+
+    def __init__(self, make_namespace, max_sessions: int = 64,
+                 max_session_bytes: int = 16 * 1024 * 1024,
+                 max_total_bytes: int = 128 * 1024 * 1024):
+        self._make_namespace = make_namespace
+        self.max_sessions = max_sessions
+        self.max_session_bytes = max_session_bytes
+        self.max_total_bytes = max_total_bytes
+        # 按最近使用排序，队首是最久未使用的会话
+        self._sessions = OrderedDict()
+        self._total_bytes = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def create(self, session_id: str) -> tuple[Session, bool]:
+        """创建会话；会话已存在时直接返回，第二个返回值表示是否新建"""
+        session = self.get(session_id)
+        if session is not None:
+            return session, False
+        session = Session(session_id, self._make_namespace())
+        self._sessions[session_id] = session
+        self._evict(keep=session_id)
+        return session, True
+
+    def get(self, session_id: str) -> Session | None:
+        """查找会话并标记为最近使用"""
+        session = self._sessions.get(session_id)
+        if session is not None:
+            self._sessions.move_to_end(session_id)
+            session.last_used = time.time()
+        return session
+
+    def reset(self, session_id: str) -> bool:
+        """清空会话的命名空间，会话本身保留"""
+        session = self.get(session_id)
+        if session is None:
+            return False
+        session.namespace = self._make_namespace()
+        self._total_bytes -= session.size
+        session.size = 0
+        return True
+
+    def drop(self, session_id: str) -> bool:
+        """删除会话"""
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._total_bytes -= session.size
+        return True
+
+    def update_size(self, session: Session) -> bool:
+        """执行后重新计算会话大小；超过单会话上限时重置会话并返回 False"""
+        size = estimate_size(session.namespace)
+        self._total_bytes += size - session.size
+        session.size = size
+        if size > self.max_session_bytes:
+            self.reset(session.session_id)
+            return False
+        self._evict(keep=session.session_id)
+        return True
+
+    def _evict(self, keep: str):
+        """淘汰最久未使用的会话，直到满足会话数和总内存上限"""
+        while (len(self._sessions) > self.max_sessions
+               or self._total_bytes > self.max_total_bytes):
+            victim = next(iter(self._sessions))
+            if victim == keep:
+                if len(self._sessions) == 1:
+                    break
+                self._sessions.move_to_end(keep)
+                continue
+            self.drop(victim)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self._sessions),
+            "total_bytes": self._total_bytes,
+            "max_sessions": self.max_sessions,
+            "max_session_bytes": self.max_session_bytes,
+            "max_total_bytes": self.max_total_bytes,
+            "evictions": self.evictions,
+        }
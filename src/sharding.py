@@ -0,0 +1,64 @@
+import bisect
+import hashlib
+from collections import OrderedDict
+
+
+class ShardRouter:
+    """在多个 Durable Object 分片之间分发请求
+
+    带会话或客户端键的请求通过一致性哈希固定到同一分片，分片数变化时只有少量键迁移；
+    无状态请求发送到本 isolate 中最久未使用的分片，使负载均匀分布。
+    分片 stub 在 isolate 内缓存，不会每个请求重新创建。
+    """
+
+    def __init__(self, namespace, shard_count: int, virtual_nodes: int = 64):
+        if shard_count < 1:
+            raise ValueError("shard_count must be at least 1")
+        self._namespace = namespace
+        # 第 0 个分片沿用原来的 "main" 实例名，保留已有的存储数据
+        self.shard_names = ["main"] + [f"shard-{i}" for i in range(1, shard_count)]
+
+        ring = sorted(
+            (self._hash(f"{name}#{replica}"), name)
+            for name in self.shard_names
+            for replica in range(virtual_nodes)
+        )
+        self._ring_hashes = [point for point, _ in ring]
+        self._ring_names = [name for _, name in ring]
+
+        self._stubs = {}
+        # 按最近使用时间排序，队首是最久未使用的分片
+        self._usage = OrderedDict((name, None) for name in self.shard_names)
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+    def shard_for_key(self, key: str) -> str:
+        """返回键在哈希环上对应的分片名"""
+        index = bisect.bisect(self._ring_hashes, self._hash(key))
+        if index == len(self._ring_hashes):
+            index = 0
+        return self._ring_names[index]
+
+    def least_recently_used(self) -> str:
+        """返回本 isolate 中最久未使用的分片名"""
+        return next(iter(self._usage))
+
+    def stub(self, name: str):
+        """返回分片的 stub，同一 isolate 内复用"""
+        stub = self._stubs.get(name)
+        if stub is None:
+            stub = self._namespace.get(self._namespace.idFromName(name))
+            self._stubs[name] = stub
+        return stub
+
+    def route(self, key: str | None = None) -> tuple[str, object]:
+        """为请求选择分片，返回分片名和 stub"""
+        name = self.shard_for_key(key) if key else self.least_recently_used()
+        return name, self.route_to(name)
+
+    def route_to(self, name: str):
+        """把请求发送到指定分片并返回其 stub"""
+        self._usage.move_to_end(name)
+        return self.stub(name)
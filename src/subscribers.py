@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+# 每个连接最多缓冲的事件数；客户端读得太慢、缓冲写满时断开该连接，由客户端重连
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_HEARTBEAT_MS = 15000
+
+
+class Subscriber:
+    """一个持久流连接及其待发送的事件"""
+
+    __slots__ = ("channel_id", "closed", "connected_at", "queue")
+
+    def __init__(self, channel_id: str, queue_size: int):
+        self.channel_id = channel_id
+        self.queue = asyncio.Queue(queue_size)
+        self.connected_at = time.time()
+        self.closed = False
+
+
+class SubscriberHub:
+    """按频道跟踪 Durable Object 中的持久流连接，并把事件扇出到频道的每个连接
+
+    同一频道可以同时有多个连接（例如客户端重连期间），提交到频道的执行在后台运行，
+    产出的事件带上请求 ID 后发给其中每一个连接。空闲连接只在心跳间隔到期时被唤醒。
+    """
+
+    def __init__(self, max_subscribers: int = 256, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        # 频道 ID -> 该频道的连接集合
+        self._channels = {}
+        self._count = 0
+        # 正在运行的执行；保存引用以免任务在完成前被回收
+        self._tasks = set()
+        self.published = 0
+        self.overflows = 0
+
+    def __len__(self):
+        return self._count
+
+    def subscribe(self, channel_id: str) -> Subscriber | None:
+        """为频道添加一个连接；连接数已达上限时返回 None"""
+        if self._count >= self.max_subscribers:
+            return None
+        subscriber = Subscriber(channel_id, self.queue_size)
+        self._channels.setdefault(channel_id, set()).add(subscriber)
+        self._count += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self._channels.get(subscriber.channel_id)
+        if subscribers is None or subscriber not in subscribers:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self._channels[subscriber.channel_id]
+        self._count -= 1
+
+    def subscribers(self, channel_id: str) -> int:
+        return len(self._channels.get(channel_id, ()))
+
+    def publish(self, channel_id: str, event: dict) -> int:
+        """把事件发给频道的每个连接，返回送达的连接数"""
+        delivered = 0
+        for subscriber in tuple(self._channels.get(channel_id, ())):
+            if subscriber.closed:
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._overflow(subscriber)
+                continue
+            delivered += 1
+        self.published += delivered
+        return delivered
+
+    def _overflow(self, subscriber: Subscriber):
+        """断开缓冲写满的连接：丢弃积压的事件，只留下结束标记"""
+        subscriber.closed = True
+        self.overflows += 1
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+        self.unsubscribe(subscriber)
+
+    def spawn(self, channel_id: str, request_id: str, events):
+        """在后台消费一次执行的事件流，逐个带上请求 ID 后发布到频道"""
+        async def pump():
+            async for event in events:
+                self.publish(channel_id, {**event, "request_id": request_id})
+
+        task = asyncio.ensure_future(pump())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def listen(self, subscriber: Subscriber, heartbeat_ms: int = DEFAULT_HEARTBEAT_MS):
+        """产出连接的事件；没有事件时每隔 heartbeat_ms 毫秒产出一次心跳，连接关闭时退订"""
+        try:
+            yield {
+                "type": "connection_established",
+                "channel_id": subscriber.channel_id,
+                "heartbeat_ms": heartbeat_ms,
+                "timestamp": time.time(),
+            }
+            timeout = heartbeat_ms / 1000
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout)
+                except TimeoutError:
+                    yield {"type": "heartbeat", "timestamp": time.time()}
+                    continue
+                if event is None:
+                    yield {"type": "connection_closed", "reason": "Subscriber fell too far behind"}
+                    return
+                yield event
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self) -> dict:
+        return {
+            "channels": len(self._channels),
+            "subscribers": self._count,
+            "max_subscribers": self.max_subscribers,
+            "running": len(self._tasks),
+            "published": self.published,
+            "overflows": self.overflows,
+        }
@@ -1,55 +1,516 @@
-import sys
-import json
 import asyncio
-import traceback
+import contextvars
+import hashlib
+import heapq
+import itertools
+import json
+import sys
+import threading
 import time
-from io import StringIO
-from contextlib import redirect_stdout, redirect_stderr
+import traceback
+import uuid
+from contextlib import contextmanager
+from functools import partial
+from io import TextIOBase
+
+try:
+    from workers import DurableObject, Response
+except ImportError:
+    # 原生 CPython 部署（见 native.py）中没有 Workers 运行时
+    from native_runtime import DurableObject, Response
 
-from workers import DurableObject, Response
+from compile_cache import CompileCache
+from compression import (
+    COMPRESSION_MIN_BYTES,
+    RUNTIME_COMPRESSES,
+    encode_body,
+    encode_stream,
+    negotiate,
+)
+from jsonrpc import (
+    INTERNAL_ERROR,
+    INVALID_PARAMS,
+    INVALID_REQUEST,
+    PARSE_ERROR,
+    JSONRPCDispatcher,
+    JSONRPCError,
+    error_response,
+)
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from metrics import Registry, merge_expositions
+from output import (
+    DEFAULT_FLUSH_BYTES,
+    DEFAULT_FLUSH_INTERVAL_MS,
+    DEFAULT_INLINE_LIMIT,
+    BoundedCapture,
+    OutputStore,
+    coalesce_output,
+)
+from process_pool import DEFAULT_MAX_GROWTH_BYTES, DEFAULT_MAX_JOBS, ProcessPool, RemoteError
+from profiling import ExecutionProfiler, parse_profile_option
+from result_cache import ResultCache
+from router import HTTPError, Router, RouteTimer
+from sessions import SESSION_ID_PATTERN, SessionStore
+from sharding import ShardRouter
+from subscribers import DEFAULT_HEARTBEAT_MS, SubscriberHub
 
 sys.path.insert(0, "/session/metadata/vendor")
 sys.path.insert(0, "/session/metadata")
 
+# Pyodide 中无法创建线程，此时只能在事件循环中直接执行代码
+_THREADS_AVAILABLE = sys.platform != "emscripten"
+# 执行在工作线程中时只统计该线程的 CPU 时间
+_cpu_clock = time.thread_time if _THREADS_AVAILABLE else time.process_time
+
+# 默认的单次执行时间预算和调用方可申请的上限（毫秒），可用环境变量覆盖
+DEFAULT_TIME_BUDGET_MS = 10_000
+MAX_TIME_BUDGET_MS = 60_000
+
+# 时间预算使用的 sys.monitoring 工具编号；0、1、2、5 留给调试器、覆盖率、剖析器和优化器
+_BUDGET_TOOL_ID = 4
+# 检查预算的事件：无限循环和无限递归都会不断产生循环回跳或 Python 函数开始事件
+_BUDGET_EVENTS = sys.monitoring.events.JUMP | sys.monitoring.events.PY_START
+
+# 调用方可指定的输出合并阈值上限
+MAX_FLUSH_BYTES = 1024 * 1024
+MAX_FLUSH_INTERVAL_MS = 5_000
+
+# 持久流心跳间隔的下限，避免空闲连接被频繁唤醒
+MIN_HEARTBEAT_MS = 1_000
+
+# 单个批量请求最多包含的代码片段数
+BATCH_MAX_ITEMS = 500
+
+# 两条执行路径共享的编译缓存
+compile_cache = CompileCache()
+
+# 没有 Durable Object 时使用的纯内存结果缓存
+_stateless_result_cache = ResultCache()
+
+# EXEC_BACKEND 为 "process" 时本进程的执行进程池，首次使用时创建
+_executor = None
+
+# 用于选择分片的会话/客户端键所在的请求头，按优先级排列
+_ROUTING_KEY_HEADERS = ("mcp-session-id", "x-session-id", "x-client-id")
+
+# 在入口读取请求体、按工具参数选择分片的路由
+_BODY_ROUTED = frozenset(("tools_call", "mcp_post"))
+
+# 入口 Worker 通过该请求头告知 Durable Object 它所在的分片名
+_SHARD_HEADER = "x-mcp-shard"
+
+# 每个 isolate 缓存一个分片路由器及其 stub
+_shard_router = None
+
+# 执行代码时可用的内置函数白名单
+_SAFE_BUILTINS = {
+    'print': print,
+    'len': len,
+    'str': str,
+    'int': int,
+    'float': float,
+    'list': list,
+    'dict': dict,
+    'tuple': tuple,
+    'set': set,
+    'range': range,
+    'enumerate': enumerate,
+    'zip': zip,
+    'sum': sum,
+    'max': max,
+    'min': min,
+    'abs': abs,
+    'round': round,
+    'sorted': sorted,
+    'reversed': reversed,
+    'type': type,
+    'isinstance': isinstance,
+    'hasattr': hasattr,
+    'getattr': getattr,
+    'setattr': setattr,
+    'bool': bool,
+    # 常用异常类，供代码抛出和捕获
+    'Exception': Exception,
+    'ArithmeticError': ArithmeticError,
+    'AssertionError': AssertionError,
+    'AttributeError': AttributeError,
+    'IndexError': IndexError,
+    'KeyError': KeyError,
+    'LookupError': LookupError,
+    'NotImplementedError': NotImplementedError,
+    'RuntimeError': RuntimeError,
+    'StopIteration': StopIteration,
+    'TypeError': TypeError,
+    'ValueError': ValueError,
+    'ZeroDivisionError': ZeroDivisionError,
+}
+
+# 当前执行上下文的输出目标；为 None 时写入原始的 sys.stdout / sys.stderr
+_stdout_target = contextvars.ContextVar("stdout_target", default=None)
+_stderr_target = contextvars.ContextVar("stderr_target", default=None)
+
+# 本次请求协商出的响应编码（目前只有 gzip），由压缩中间件设置
+_response_encoding = contextvars.ContextVar("response_encoding", default=None)
+
+# 设置后，本上下文中 execute_python_code 的每个输出块都会以 (kind, text) 回调转发
+_output_listener = contextvars.ContextVar("output_listener", default=None)
+
+# 执行指标的 tool 标签：经工具调用时为工具名，否则为路由名
+_exec_label = contextvars.ContextVar("exec_label", default="direct")
+
+# 本 isolate（原生部署中为进程）内的指标，同一 isolate 中的各分片共享，导出时带 isolate 标签；
+# 由 /metrics 以 Prometheus 文本格式导出
+metrics = Registry()
+# 分片自身状态的指标：结果缓存、会话和持久流，导出时带 shard 标签
+shard_metrics = Registry()
+_isolate_id = None
+_request_seconds = metrics.histogram(
+    "mcp_request_duration_seconds", "Time until response headers, by route", ("route",)
+)
+_exec_wall_seconds = metrics.histogram(
+    "mcp_exec_wall_seconds", "Wall-clock time of code execution, by tool", ("tool",)
+)
+_exec_cpu_seconds = metrics.histogram(
+    "mcp_exec_cpu_seconds", "CPU time of code execution, by tool", ("tool",)
+)
+_executions = metrics.counter(
+    "mcp_executions_total", "Finished code executions, by tool and outcome", ("tool", "outcome")
+)
+_output_chars = metrics.counter(
+    "mcp_output_chars_total",
+    "Characters written to stdout and stderr by executed code",
+    ("stream",),
+)
+_executions_in_flight = metrics.gauge(
+    "mcp_executions_in_flight", "Code executions currently running"
+)
+
+
+class _OutputRouter(TextIOBase):
+    """按执行上下文转发 sys.stdout / sys.stderr 的写入，使并发执行互不干扰"""
+
+    def __init__(self, target, fallback):
+        self._target = target
+        self._fallback = fallback
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        stream = self._target.get()
+        if stream is None:
+            stream = self._fallback
+        return stream.write(s)
+
+    def flush(self):
+        stream = self._target.get()
+        if stream is None:
+            stream = self._fallback
+        stream.flush()
+
+
+class _StreamingWriter(TextIOBase):
+    """把写入的文本块实时推送到 asyncio 队列，同时保留前 retain_limit 个字符用于错误事件"""
+
+    def __init__(self, kind: str, queue: asyncio.Queue, loop, threaded: bool,
+                 retain_limit: int = DEFAULT_INLINE_LIMIT):
+        self._kind = kind
+        self._parts = []
+        self._room = retain_limit
+        self.total_chars = 0
+        if threaded:
+            # 从执行线程写入时必须通过事件循环投递
+            self._push = partial(loop.call_soon_threadsafe, queue.put_nowait)
+        else:
+            self._push = queue.put_nowait
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        self.total_chars += len(s)
+        if s:
+            if self._room > 0:
+                self._parts.append(s[:self._room])
+                self._room -= len(s)
+            self._push((self._kind, s))
+        return len(s)
+
+    def getvalue(self) -> str:
+        return "".join(self._parts)
+
+
+class _TeeWriter(TextIOBase):
+    """写入捕获缓冲区的同时把文本块转发给输出监听器"""
+
+    def __init__(self, capture, kind: str, push):
+        self._capture = capture
+        self._kind = kind
+        self._push = push
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        if s:
+            self._push(self._kind, s)
+        return self._capture.write(s)
+
+
+# 线程 ID -> 该线程中正在执行的预算
+_active_budgets = {}
+_budget_lock = threading.Lock()
+# 正在由 sys.monitoring 事件检查的预算数，为 0 时关闭事件
+_monitored_budgets = 0
+
+
+def _on_budget_event(code, offset, *args):
+    """sys.monitoring 回调：当前线程的预算已用完时抛出 TimeoutError
+
+    回调抛出的异常不会关闭监控，被执行代码捕获 TimeoutError 后的下一次循环或调用会再次抛出。
+    """
+    budget = _active_budgets.get(threading.get_ident())
+    if budget is not None and time.perf_counter() > budget._deadline:
+        budget.exceeded = True
+        raise TimeoutError(budget.message)
+
+
+sys.monitoring.use_tool_id(_BUDGET_TOOL_ID, "mcp-time-budget")
+sys.monitoring.register_callback(_BUDGET_TOOL_ID, sys.monitoring.events.JUMP, _on_budget_event)
+sys.monitoring.register_callback(_BUDGET_TOOL_ID, sys.monitoring.events.PY_START, _on_budget_event)
+
 
-async def execute_python_code(code: str) -> dict:
-    """执行 Python 代码并返回结果"""
-    stdout_capture = StringIO()
-    stderr_capture = StringIO()
+def _monitor_budget(budget: "TimeBudget"):
+    """开始以 sys.monitoring 事件检查预算；预算已结束时不做任何事"""
+    global _monitored_budgets
+    with _budget_lock:
+        if budget._monitored or not budget._running:
+            return
+        budget._monitored = True
+        _monitored_budgets += 1
+        if _monitored_budgets == 1:
+            sys.monitoring.set_events(_BUDGET_TOOL_ID, _BUDGET_EVENTS)
+
+
+def _unmonitor_budget(budget: "TimeBudget"):
+    global _monitored_budgets
+    with _budget_lock:
+        budget._running = False
+        if budget._monitored:
+            _monitored_budgets -= 1
+            if not _monitored_budgets:
+                sys.monitoring.set_events(_BUDGET_TOOL_ID, 0)
+
+
+class _BudgetWatchdog:
+    """在预算到期时开启 sys.monitoring 事件的后台线程
+
+    到期之前被执行代码不触发任何回调，时间预算没有额外开销；首次使用时才启动线程。
+    已结束的预算留在堆中，到期时跳过。
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        # (截止时间, 序号, 预算) 组成的小顶堆
+        self._deadlines = []
+        self._sequence = itertools.count()
+        self._thread = None
+
+    def watch(self, budget: "TimeBudget"):
+        with self._condition:
+            entry = (budget._deadline, next(self._sequence), budget)
+            heapq.heappush(self._deadlines, entry)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="time-budget-watchdog", daemon=True
+                )
+                self._thread.start()
+            elif self._deadlines[0] is entry:
+                self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    now = time.perf_counter()
+                    if self._deadlines and self._deadlines[0][0] <= now:
+                        break
+                    timeout = self._deadlines[0][0] - now if self._deadlines else None
+                    self._condition.wait(timeout)
+                _, _, budget = heapq.heappop(self._deadlines)
+            _monitor_budget(budget)
+
+
+_budget_watchdog = _BudgetWatchdog()
+
+
+class TimeBudget:
+    """通过 sys.monitoring 限制一次执行的墙钟时间
+
+    到期后被执行代码的下一次循环回跳或 Python 函数调用抛出 TimeoutError，此后每次都再次抛出，
+    捕获异常也无法继续运行。线程可用时由后台线程在到期时开启事件，到期前没有开销；
+    Pyodide 中没有线程，整个执行期间都开启事件。
+    单个长时间运行的 C 调用不产生事件，无法被中途打断，会在返回后中止。
+    """
+
+    def __init__(self, limit_ms: int):
+        self.limit_ms = limit_ms
+        self.used_ms = 0.0
+        self.cpu_ms = 0.0
+        self.exceeded = False
+        self._deadline = 0.0
+        self._running = False
+        self._monitored = False
+
+    @property
+    def message(self) -> str:
+        return f"execution exceeded the time budget of {self.limit_ms} ms"
+
+    def run(self, func, *args):
+        """在当前线程中启用预算检查并调用 func(*args)"""
+        ident = threading.get_ident()
+        started = time.perf_counter()
+        cpu_started = _cpu_clock()
+        self._deadline = started + self.limit_ms / 1000
+        self._running = True
+        _active_budgets[ident] = self
+        if _THREADS_AVAILABLE:
+            _budget_watchdog.watch(self)
+        else:
+            _monitor_budget(self)
+        try:
+            return func(*args)
+        finally:
+            # 到期后本线程中的任何回跳和调用都会抛出，必须在调用其他函数之前先移除预算
+            del _active_budgets[ident]
+            _unmonitor_budget(self)
+            self.used_ms = (time.perf_counter() - started) * 1000
+            self.cpu_ms = (_cpu_clock() - cpu_started) * 1000
+
+    def report(self) -> dict:
+        return {
+            "limit_ms": self.limit_ms,
+            "used_ms": round(self.used_ms, 3),
+            "cpu_ms": round(self.cpu_ms, 3),
+            "exceeded": self.exceeded,
+        }
+
+
+def _make_exec_globals() -> dict:
+    """创建一次执行使用的全局命名空间"""
+    return {'__builtins__': dict(_SAFE_BUILTINS)}
+
+
+@contextmanager
+def _capture_output(stdout, stderr):
+    """把当前上下文中的标准输出和标准错误重定向到给定的缓冲区"""
+    if not isinstance(sys.stdout, _OutputRouter):
+        sys.stdout = _OutputRouter(_stdout_target, sys.stdout)
+    if not isinstance(sys.stderr, _OutputRouter):
+        sys.stderr = _OutputRouter(_stderr_target, sys.stderr)
+    stdout_token = _stdout_target.set(stdout)
+    stderr_token = _stderr_target.set(stderr)
+    try:
+        yield
+    finally:
+        _stdout_target.reset(stdout_token)
+        _stderr_target.reset(stderr_token)
+
+
+def _exec_captured(code: str, exec_globals: dict, stdout, stderr, budget: TimeBudget,
+                   profiler: ExecutionProfiler | None = None):
+    """在捕获输出并限制执行时间的上下文中同步执行代码；传入 profiler 时同时剖析"""
+    with _capture_output(stdout, stderr):
+        code_object = compile_cache.compile(code)
+        if profiler is None:
+            budget.run(exec, code_object, exec_globals)
+        else:
+            profiler.run(code_object, exec_globals, budget.run)
+
+
+async def _run_code(code: str, namespace: dict | None, stdout, stderr, budget: TimeBudget,
+                    profiler: ExecutionProfiler | None = None, executor: ProcessPool | None = None):
+    """执行代码；namespace 为 None 时使用新的命名空间
+
+    传入 executor 时，新命名空间中的执行交给执行后端；会话命名空间和剖析执行只能在本进程中进行。
+    本进程中的执行在线程可用时放到工作线程中，避免阻塞事件循环。剖析执行总在事件循环线程上运行：
+    cProfile 会同时收到其他线程的调用事件，在工作线程中剖析得到的调用栈不可靠。
+    """
+    _executions_in_flight.inc()
+    try:
+        if executor is not None and namespace is None and profiler is None:
+            await executor.run(code, stdout, stderr, budget)
+            return
+        exec_globals = _make_exec_globals() if namespace is None else namespace
+        if _THREADS_AVAILABLE and profiler is None:
+            await asyncio.to_thread(
+                _exec_captured, code, exec_globals, stdout, stderr, budget, profiler
+            )
+        else:
+            _exec_captured(code, exec_globals, stdout, stderr, budget, profiler)
+    finally:
+        _executions_in_flight.dec()
+
+
+def _pool_job(code: str, time_budget_ms: int, stdout, stderr) -> tuple:
+    """在执行进程池的工作进程中执行一次代码，捕获输出和时间预算的方式与本进程执行相同"""
+    budget = TimeBudget(time_budget_ms)
+    error = None
+    try:
+        _exec_captured(code, _make_exec_globals(), stdout, stderr, budget)
+    except Exception as e:
+        error = (type(e).__name__, str(e), traceback.format_exc())
+    return error, budget.used_ms, budget.cpu_ms, budget.exceeded
+
+
+def _exception_details(e: Exception) -> tuple[str, str, str]:
+    """返回异常的类型名、消息和回溯；在工作进程中抛出的异常使用其原始信息，须在 except 块中调用"""
+    if isinstance(e, RemoteError):
+        return e.type_name, str(e), e.remote_traceback
+    return type(e).__name__, str(e), traceback.format_exc()
+
+
+def _record_execution(label: str, budget: TimeBudget, success: bool,
+                      stdout_chars: int, stderr_chars: int):
+    """在事件循环线程上记录一次执行的指标"""
+    _exec_wall_seconds.observe(budget.used_ms / 1000, label)
+    _exec_cpu_seconds.observe(budget.cpu_ms / 1000, label)
+    _executions.inc(1, label, "success" if success else "error")
+    _output_chars.inc(stdout_chars, "stdout")
+    _output_chars.inc(stderr_chars, "stderr")
+
+
+async def execute_python_code(code: str, namespace: dict | None = None,
+                              time_budget_ms: int = DEFAULT_TIME_BUDGET_MS,
+                              output_limit: int = DEFAULT_INLINE_LIMIT,
+                              output_store: OutputStore | None = None,
+                              profile: dict | None = None,
+                              executor: ProcessPool | None = None) -> dict:
+    """执行 Python 代码并返回结果；传入 namespace 时在其中执行并保留状态
+
+    超过 output_limit 的输出不随结果返回：有 output_store 时溢出到存储并通过句柄分页读取，
+    否则只统计被截断的字符数。传入 profile（ExecutionProfiler 的构造参数）时结果中附带剖析报告。
+    传入 executor 时不带命名空间的执行在执行后端中进行。
+    """
+    spill = output_store.spill() if output_store is not None else None
+    stdout_capture = BoundedCapture(output_limit, spill.writer("stdout") if spill else None)
+    stderr_capture = BoundedCapture(output_limit, spill.writer("stderr") if spill else None)
+    budget = TimeBudget(time_budget_ms)
+    profiler = ExecutionProfiler(**profile, filename=compile_cache.filename) if profile else None
+    stdout, stderr = stdout_capture, stderr_capture
+    listener = _output_listener.get()
+    if listener is not None:
+        if _THREADS_AVAILABLE:
+            # 从执行线程写入时必须通过事件循环投递
+            loop = asyncio.get_running_loop()
+            push = partial(loop.call_soon_threadsafe, listener)
+        else:
+            push = listener
+        stdout = _TeeWriter(stdout_capture, "stdout", push)
+        stderr = _TeeWriter(stderr_capture, "stderr", push)
     
     try:
-        with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
-            exec_globals = {
-                '__builtins__': {
-                    'print': print,
-                    'len': len,
-                    'str': str,
-                    'int': int,
-                    'float': float,
-                    'list': list,
-                    'dict': dict,
-                    'tuple': tuple,
-                    'set': set,
-                    'range': range,
-                    'enumerate': enumerate,
-                    'zip': zip,
-                    'sum': sum,
-                    'max': max,
-                    'min': min,
-                    'abs': abs,
-                    'round': round,
-                    'sorted': sorted,
-                    'reversed': reversed,
-                    'type': type,
-                    'isinstance': isinstance,
-                    'hasattr': hasattr,
-                    'getattr': getattr,
-                    'setattr': setattr,
-                    'bool': bool,
-                }
-            }
-            
-            exec(code, exec_globals)
+        await _run_code(code, namespace, stdout, stderr, budget, profiler, executor)
             
         result = {
             "success": True,
@@ -59,447 +520,1448 @@ async def execute_python_code(code: str) -> dict:
         }
         
     except Exception as e:
+        error_type, message, remote_traceback = _exception_details(e)
         result = {
             "success": False,
             "stdout": stdout_capture.getvalue(),
             "stderr": stderr_capture.getvalue(),
-            "error": f"{type(e).__name__}: {str(e)}\n{traceback.format_exc()}"
+            "error": f"{error_type}: {message}\n{remote_traceback}"
         }
     
+    if budget.exceeded and result["success"]:
+        # 超时异常被代码自身捕获时仍按超时处理
+        result["success"] = False
+        result["error"] = f"TimeoutError: {budget.message}"
+    result["budget"] = budget.report()
+    if profiler is not None:
+        result["profile"] = profiler.report(code)
+    _record_execution(_exec_label.get(), budget, result["success"],
+                      stdout_capture.total_chars, stderr_capture.total_chars)
+    
+    if stdout_capture.truncated or stderr_capture.truncated:
+        stdout_capture.finish()
+        stderr_capture.finish()
+        result["truncated"] = True
+        result["output"] = {
+            "handle": spill.handle if spill else None,
+            "stdout": stdout_capture.summary(),
+            "stderr": stderr_capture.summary(),
+        }
     return result
 
 
-async def execute_python_code_stream(code: str):
-    """执行 Python 代码并返回流式结果"""
-    stdout_capture = StringIO()
-    stderr_capture = StringIO()
+async def execute_python_code_stream(code: str, time_budget_ms: int = DEFAULT_TIME_BUDGET_MS,
+                                     flush_bytes: int = DEFAULT_FLUSH_BYTES,
+                                     flush_interval_ms: float = DEFAULT_FLUSH_INTERVAL_MS,
+                                     label: str = "stream", executor: ProcessPool | None = None):
+    """执行 Python 代码并在运行过程中产出事件字典，由 _stream_response 按所选格式编码
+
+    连续的同类输出合并为一个事件，达到 flush_bytes 个字符或等待满 flush_interval_ms 毫秒时发送。
+    事件流在响应阶段才被消费，请求上下文已不可用，执行指标的标签由 label 传入。
+    """
+    budget = TimeBudget(time_budget_ms)
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stdout_capture = _StreamingWriter("stdout", queue, loop, _THREADS_AVAILABLE)
+    stderr_capture = _StreamingWriter("stderr", queue, loop, _THREADS_AVAILABLE)
+    success = False
     
     try:
         # 发送开始事件
-        yield f"data: {json.dumps({'type': 'start', 'timestamp': time.time()})}\n\n"
+        yield {'type': 'start', 'timestamp': time.time()}
         
-        with redirect_stdout(stdout_capture), redirect_stderr(stderr_capture):
-            exec_globals = {
-                '__builtins__': {
-                    'print': print,
-                    'len': len,
-                    'str': str,
-                    'int': int,
-                    'float': float,
-                    'list': list,
-                    'dict': dict,
-                    'tuple': tuple,
-                    'set': set,
-                    'range': range,
-                    'enumerate': enumerate,
-                    'zip': zip,
-                    'sum': sum,
-                    'max': max,
-                    'min': min,
-                    'abs': abs,
-                    'round': round,
-                    'sorted': sorted,
-                    'reversed': reversed,
-                    'type': type,
-                    'isinstance': isinstance,
-                    'hasattr': hasattr,
-                    'getattr': getattr,
-                    'setattr': setattr,
-                    'bool': bool,
-                }
-            }
-            
-            # 发送执行中事件
-            yield f"data: {json.dumps({'type': 'executing', 'code': code[:100] + ('...' if len(code) > 100 else '')})}\n\n"
-            
-            exec(code, exec_globals)
-            
-        # 发送输出事件
-        stdout_output = stdout_capture.getvalue()
-        stderr_output = stderr_capture.getvalue()
+        # 发送执行中事件
+        yield {'type': 'executing', 'code': code[:100] + ('...' if len(code) > 100 else '')}
         
-        if stdout_output:
-            yield f"data: {json.dumps({'type': 'stdout', 'content': stdout_output})}\n\n"
+        task = asyncio.ensure_future(
+            _run_code(code, None, stdout_capture, stderr_capture, budget, executor=executor)
+        )
+        # 执行结束后投递哨兵；它排在执行期间写入的所有输出块之后
+        task.add_done_callback(lambda _: queue.put_nowait(None))
         
-        if stderr_output:
-            yield f"data: {json.dumps({'type': 'stderr', 'content': stderr_output})}\n\n"
+        # 输出在运行过程中合并转发，而不是等待执行结束
+        async for kind, content in coalesce_output(queue, flush_bytes, flush_interval_ms):
+            yield {'type': kind, 'content': content}
+        
+        await task
+        if budget.exceeded:
+            # 超时异常被代码自身捕获时仍按超时处理
+            raise TimeoutError(budget.message)
         
         # 发送成功完成事件
-        yield f"data: {json.dumps({'type': 'success', 'timestamp': time.time()})}\n\n"
+        success = True
+        yield {'type': 'success', 'budget': budget.report(), 'timestamp': time.time()}
         
     except Exception as e:
         # 发送错误事件
-        error_info = {
+        error_type, message, remote_traceback = _exception_details(e)
+        yield {
             'type': 'error',
-            'error_type': type(e).__name__,
-            'error_message': str(e),
-            'traceback': traceback.format_exc(),
+            'error_type': error_type,
+            'error_message': message,
+            'traceback': remote_traceback,
             'stdout': stdout_capture.getvalue(),
             'stderr': stderr_capture.getvalue(),
+            'budget': budget.report(),
             'timestamp': time.time()
         }
-        yield f"data: {json.dumps(error_info)}\n\n"
     
+    _record_execution(
+        label, budget, success, stdout_capture.total_chars, stderr_capture.total_chars
+    )
     # 发送结束事件
-    yield f"data: {json.dumps({'type': 'end', 'timestamp': time.time()})}\n\n"
+    yield {'type': 'end', 'success': success, 'timestamp': time.time()}
 
 
-class FastMCPServer(DurableObject):
-    def __init__(self, ctx, env):
-        self.ctx = ctx
-        self.env = env
+def _sse_event(payload: dict) -> str:
+    """把一个事件编码为 SSE 帧"""
+    return f"data: {json.dumps(payload)}\n\n"
 
-    async def fetch(self, request):
-        """处理请求的核心逻辑"""
+
+# NDJSON 流沿用早期流式接口的事件名
+_NDJSON_EVENT_TYPES = {"start": "execution_start", "end": "execution_complete"}
+
+
+def _ndjson_event(payload: dict) -> str:
+    """把一个事件编码为一行 JSON"""
+    event_type = _NDJSON_EVENT_TYPES.get(payload.get("type"))
+    if event_type is not None:
+        payload = {**payload, "type": event_type}
+    return json.dumps(payload) + "\n"
+
+
+# 流式响应格式：名称 -> (Content-Type, 事件编码函数)；同一事件流可以按任一格式输出
+STREAM_FORMATS = {
+    "sse": ("text/event-stream", _sse_event),
+    "ndjson": ("application/x-ndjson", _ndjson_event),
+}
+
+
+# 服务器信息和工具列表；发现端点的响应在导入时序列化一次
+SERVER_INFO = {
+    "name": "Python Code Executor MCP Server",
+    "version": "1.0.0",
+    "description": "Execute Python code via MCP protocol with streaming support",
+    "endpoints": {
+        "tools": "/tools",
+        "call_tool": "/tools/call",
+        "stream": "/stream",
+        "stream_execute": "/stream/execute",
+        "persistent_stream": "/stream/persistent",
+        "batch": "/tools/batch",
+        "stats": "/stats",
+        "metrics": "/metrics",
+        "sessions": "/sessions",
+        "output": "/output/{handle}",
+        "mcp": "/mcp",
+        "websocket": "/ws"
+    },
+    "streaming_formats": {name: content_type for name, (content_type, _) in STREAM_FORMATS.items()}
+}
+
+_CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, POST, DELETE, OPTIONS",
+    "Access-Control-Allow-Headers": "*",
+}
+
+
+def _json_response(data, status: int = 200, headers: dict | None = None):
+    """返回带 CORS 响应头的 JSON 响应；客户端接受 gzip 且响应足够大时压缩"""
+    body = json.dumps(data)
+    headers = {
+        "Content-Type": "application/json",
+        "Vary": "Accept-Encoding",
+        **(headers or {}),
+        **_CORS_HEADERS,
+    }
+    encoding = _response_encoding.get()
+    if encoding and len(body) >= COMPRESSION_MIN_BYTES:
+        if not RUNTIME_COMPRESSES:
+            # 运行时自行压缩时保留 str，转换为 bytes 只会多一次缓冲区转换
+            body = encode_body(body.encode())
+        headers["Content-Encoding"] = encoding
+    return Response(body, status=status, headers=headers)
+
+
+def _sse_response(chunks, content_type: str = "text/event-stream"):
+    """返回带 CORS 响应头的流式响应；客户端接受 gzip 时逐块压缩"""
+    headers = {
+        "Content-Type": content_type,
+        "Cache-Control": "no-cache",
+        "Connection": "keep-alive",
+        "Vary": "Accept-Encoding",
+        **_CORS_HEADERS,
+    }
+    encoding = _response_encoding.get()
+    if encoding:
+        # 流的总大小事先未知，协商成功就压缩
+        chunks = encode_stream(chunks)
+        headers["Content-Encoding"] = encoding
+    return Response(chunks, headers=headers)
+
+
+def _stream_response(events, stream_format: str = "sse"):
+    """按流式格式编码事件字典并返回流式响应"""
+    content_type, encode = STREAM_FORMATS[stream_format]
+
+    async def chunks():
         try:
-            # 解析请求路径
-            from urllib.parse import urlparse
-            parsed_url = urlparse(request.url) 
-            path = parsed_url.path
-            status = 200
-            
-            # 简化的路由处理
-            if path == "/" or path == "":
-                response_data = {
-                    "name": "Python Code Executor MCP Server",
-                    "version": "1.0.0",
-                    "description": "Execute Python code via MCP protocol with streaming support",
-                    "endpoints": {
-                        "tools": "/tools",
-                        "call_tool": "/tools/call",
-                        "stream": "/stream"
-                    }
-                }
-                
-            elif path == "/tools":
-                response_data = {
-                    "tools": [
-                        {
-                            "name": "execute_python",
-                            "description": "Execute Python code and return the result",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "code": {
-                                        "type": "string",
-                                        "description": "Python code to execute"
-                                    }
-                                },
-                                "required": ["code"]
-                            }
-                        },
-                        {
-                            "name": "execute_python_stream",
-                            "description": "Execute Python code and return streaming results",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "code": {
-                                        "type": "string",
-                                        "description": "Python code to execute"
-                                    }
-                                },
-                                "required": ["code"]
-                            }
-                        }
-                    ]
-                }
-                
-            elif path == "/stream" and request.method == "POST":
-                # 处理流式工具调用
-                body = await request.json()
-                code = body.get("code", "")
-                
-                if not code:
-                    return Response(
-                        "Error: No code provided",
-                        status=400,
-                        headers={
-                            "Content-Type": "text/plain",
-                            "Access-Control-Allow-Origin": "*",
-                        }
-                    )
-                
-                # 创建流式响应
-                async def stream_generator():
-                    async for chunk in execute_python_code_stream(code):
-                        yield chunk
-                
-                return Response(
-                    stream_generator(),
-                    headers={
-                        "Content-Type": "text/event-stream",
-                        "Cache-Control": "no-cache",
-                        "Connection": "keep-alive",
-                        "Access-Control-Allow-Origin": "*",
-                        "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-                        "Access-Control-Allow-Headers": "*",
-                    }
+            async for event in events:
+                yield encode(event)
+        finally:
+            # 客户端断开时立即关闭事件源，释放它持有的连接和任务
+            await events.aclose()
+
+    return _sse_response(chunks(), content_type)
+
+
+def _stream_format(ctx, requested: str | None = None, default: str = "sse") -> str:
+    """选择流式格式：显式的 format 参数优先，其次按 Accept 请求头，都没有时使用 default"""
+    requested = requested or ctx.query_value("format")
+    if requested is not None:
+        if requested not in STREAM_FORMATS:
+            raise HTTPError(400, f"Unsupported stream format: {requested}")
+        return requested
+    accept = ctx.request.headers.get("accept") or ""
+    for name, (content_type, _) in STREAM_FORMATS.items():
+        if content_type in accept:
+            return name
+    return default
+
+
+def _format_result_text(result: dict) -> str:
+    """把执行结果格式化为工具调用返回的文本"""
+    output_parts = []
+    if result["stdout"]:
+        output_parts.append(f"Output:\n{result['stdout']}")
+    if result["stderr"]:
+        output_parts.append(f"Errors:\n{result['stderr']}")
+    if result["error"]:
+        output_parts.append(f"Exception:\n{result['error']}")
+
+    if not output_parts:
+        output_parts.append("Code executed successfully with no output.")
+
+    if result.get("truncated"):
+        output = result["output"]
+        for stream in ("stdout", "stderr"):
+            summary = output[stream]
+            omitted = summary["total_chars"] - summary["inline_chars"]
+            if not omitted:
+                continue
+            if summary["spilled_pages"]:
+                output_parts.append(
+                    f"[{stream} truncated: {omitted} more characters available at "
+                    f"/output/{output['handle']}?stream={stream}&cursor=0]"
                 )
-                
-            elif path == "/tools/call" and request.method == "POST":
-                # 处理工具调用
-                body = await request.json()
-                tool_name = body.get("name")
-                args = body.get("arguments", {})
-                
-                if tool_name == "execute_python":
-                    code = args.get("code", "")
-                    
-                    if not code:
-                        response_data = {
-                            "content": [{"type": "text", "text": "Error: No code provided"}]
-                        }
-                        status = 400
-                    else:
-                        # 执行 Python 代码
-                        result = await execute_python_code(code)
-                        
-                        # 格式化输出
-                        output_parts = []
-                        if result["stdout"]:
-                            output_parts.append(f"Output:\n{result['stdout']}")
-                        if result["stderr"]:
-                            output_parts.append(f"Errors:\n{result['stderr']}")
-                        if result["error"]:
-                            output_parts.append(f"Exception:\n{result['error']}")
-                        
-                        if not output_parts:
-                            output_parts.append("Code executed successfully with no output.")
-                        
-                        response_text = "\n\n".join(output_parts)
-                        
-                        response_data = {
-                            "content": [{"type": "text", "text": response_text}]
-                        }
-                        status = 200
-                elif tool_name == "execute_python_stream":
-                    code = args.get("code", "")
-                    
-                    if not code:
-                        response_data = {
-                            "content": [{"type": "text", "text": "Error: No code provided. Use /stream endpoint for streaming execution."}]
-                        }
-                        status = 400
-                    else:
-                        response_data = {
-                            "content": [{"type": "text", "text": f"Use /stream endpoint for streaming execution of code. POST to /stream with {{'code': 'your_code_here'}}"}]
-                        }
-                        status = 200
-                else:
-                    response_data = {"error": "Tool not found"}
-                    status = 404
             else:
-                response_data = {"error": "Not found"}
-                status = 404
-            
-            # 返回响应
-            return Response(
-                json.dumps(response_data),
-                status=status,
-                headers={
-                    "Content-Type": "application/json",
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-                    "Access-Control-Allow-Headers": "*",
-                }
-            )
-            
-        except Exception as e:
-            # 错误处理
-            error_response = {
-                "error": f"Internal server error: {str(e)}",
-                "traceback": traceback.format_exc()
-            }
-            return Response(
-                json.dumps(error_response),
-                status=500,
-                headers={
-                    "Content-Type": "application/json",
-                    "Access-Control-Allow-Origin": "*",
-                }
-            )
+                output_parts.append(f"[{stream} truncated: {omitted} characters omitted]")
 
+    return "\n\n".join(output_parts)
 
-async def on_fetch(request, env):
-    """Cloudflare Workers 的入口点"""
+
+def _env_int(env, name: str, default: int) -> int:
+    """读取整数类型的环境变量，未配置时返回默认值"""
+    value = getattr(env, name, None)
+    return int(value) if value not in (None, "") else default
+
+
+def _time_budget_ms(requested, env) -> int:
+    """计算一次调用的执行时间预算：未指定时使用服务器默认值，限制在 1 毫秒到服务器上限之间"""
+    maximum = _env_int(env, "EXEC_TIME_BUDGET_MAX_MS", MAX_TIME_BUDGET_MS)
+    if not requested:
+        requested = _env_int(env, "EXEC_TIME_BUDGET_MS", DEFAULT_TIME_BUDGET_MS)
     try:
-        # 直接处理 OPTIONS 请求
-        if request.method == "OPTIONS":
-            return Response(
-                "",
-                status=200,
-                headers={
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-                    "Access-Control-Allow-Headers": "*",
-                }
-            )
-        
-        # 获取 Durable Object 实例
-        if hasattr(env, 'FAST_MCP_SERVER'):
-            id = env.FAST_MCP_SERVER.idFromName("main")
-            obj = env.FAST_MCP_SERVER.get(id)
-            return await obj.fetch(request)
-        else:
-            # 如果没有 Durable Object，直接处理请求
-            from urllib.parse import urlparse
-            parsed_url = urlparse(request.url) 
-            path = parsed_url.path
-            status = 200
-            
-            if path == "/" or path == "":
-                response_data = {
-                    "name": "Python Code Executor MCP Server",
-                    "version": "1.0.0",
-                    "description": "Execute Python code via MCP protocol with streaming support",
-                    "endpoints": {
-                        "tools": "/tools",
-                        "call_tool": "/tools/call",
-                        "stream": "/stream"
-                    }
-                }
-                
-            elif path == "/tools":
-                response_data = {
-                    "tools": [
-                        {
-                            "name": "execute_python",
-                            "description": "Execute Python code and return the result",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "code": {
-                                        "type": "string",
-                                        "description": "Python code to execute"
-                                    }
-                                },
-                                "required": ["code"]
-                            }
+        requested = int(requested)
+    except (TypeError, ValueError, OverflowError):
+        raise HTTPError(400, "timeout_ms must be an integer") from None
+    return max(min(requested, maximum), 1)
+
+
+def _output_limit(requested, env) -> int:
+    """计算一次调用内联返回的输出字符数：未指定时使用服务器配置，限制在 1 到服务器配置之间"""
+    maximum = _env_int(env, "OUTPUT_INLINE_LIMIT", DEFAULT_INLINE_LIMIT)
+    if not requested:
+        return maximum
+    try:
+        requested = int(requested)
+    except (TypeError, ValueError, OverflowError):
+        raise HTTPError(400, "output_limit must be a positive integer") from None
+    return max(min(requested, maximum), 1)
+
+
+def _exec_options(args: dict, env, output_store: OutputStore | None = None) -> dict:
+    """根据调用参数和服务器配置生成 execute_python_code 的执行选项"""
+    output_limit = _output_limit(args.get("output_limit"), env)
+    try:
+        profile = parse_profile_option(args.get("profile"), args.get("profile_top"))
+    except (TypeError, ValueError) as e:
+        raise HTTPError(400, str(e)) from None
+    return {
+        "time_budget_ms": _time_budget_ms(args.get("timeout_ms"), env),
+        "output_limit": output_limit,
+        "output_store": output_store,
+        "profile": profile,
+        "executor": _get_executor(env),
+    }
+
+
+def _get_executor(env) -> ProcessPool | None:
+    """返回 EXEC_BACKEND 选择的执行后端；默认的 "thread" 在本进程中执行，返回 None"""
+    global _executor
+    backend = getattr(env, "EXEC_BACKEND", None) or "thread"
+    if backend == "thread":
+        return None
+    if backend != "process":
+        raise HTTPError(500, f"Unknown EXEC_BACKEND: {backend}")
+    if _executor is None:
+        if not _THREADS_AVAILABLE:
+            raise HTTPError(501, "EXEC_BACKEND=process is not available in the Workers runtime")
+        preload = getattr(env, "EXEC_POOL_PRELOAD", None) or ""
+        _executor = ProcessPool(
+            "worker:_pool_job",
+            size=_env_int(env, "EXEC_POOL_SIZE", 0) or None,
+            max_jobs=_env_int(env, "EXEC_POOL_MAX_JOBS", DEFAULT_MAX_JOBS),
+            max_growth_bytes=_env_int(env, "EXEC_POOL_MAX_GROWTH_BYTES", DEFAULT_MAX_GROWTH_BYTES),
+            preload=[name.strip() for name in preload.split(",") if name.strip()],
+        )
+        _executor.start()
+    return _executor
+
+
+async def close_executor():
+    """关闭本进程的执行进程池；原生部署退出时调用"""
+    global _executor
+    if _executor is not None:
+        executor, _executor = _executor, None
+        await executor.close()
+
+
+def _flush_options(args: dict) -> dict:
+    """读取调用方指定的输出合并阈值，并限制在合理范围内"""
+    try:
+        flush_bytes = int(args.get("flush_bytes") or DEFAULT_FLUSH_BYTES)
+        flush_interval_ms = float(args.get("flush_interval_ms", DEFAULT_FLUSH_INTERVAL_MS))
+    except (TypeError, ValueError):
+        raise HTTPError(400, "flush_bytes and flush_interval_ms must be numbers") from None
+    return {
+        "flush_bytes": min(max(flush_bytes, 1), MAX_FLUSH_BYTES),
+        "flush_interval_ms": min(max(flush_interval_ms, 0), MAX_FLUSH_INTERVAL_MS),
+    }
+
+
+def _validate_batch(items, env) -> str | None:
+    """检查批量执行的条目，返回错误信息；合法时返回 None
+
+    条目的执行选项在执行任何条目之前校验，一个条目的参数错误不会使批量执行中途失败。
+    """
+    if not isinstance(items, list) or not items:
+        return "items must be a non-empty array"
+    if len(items) > BATCH_MAX_ITEMS:
+        return f"at most {BATCH_MAX_ITEMS} items are allowed per batch"
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            return "every item must be an object"
+        if not isinstance(item.get("code"), str) or not item["code"]:
+            return "every item needs a non-empty code string"
+        try:
+            _output_limit(item.get("output_limit"), env)
+            _time_budget_ms(item.get("timeout_ms"), env)
+        except HTTPError as e:
+            return f"items[{index}]: {e.message}"
+    return None
+
+
+async def execute_python_batch(items: list, env, output_store: OutputStore | None = None):
+    """依次执行一批代码片段，每个片段使用独立的命名空间和执行预算，完成一个产出一个结果"""
+    for index, item in enumerate(items):
+        result = await execute_python_code(item["code"], **_exec_options(item, env, output_store))
+        result["index"] = index
+        result["id"] = item.get("id", index)
+        yield result
+        # 让出事件循环，使流式响应能及时发送已完成的结果
+        await asyncio.sleep(0)
+
+
+def _cache_ttl(requested) -> float | None:
+    """校验调用指定的缓存有效期（秒）；未指定时返回 None，使用缓存的默认值"""
+    if requested is None:
+        return None
+    try:
+        ttl = float(requested)
+    except (TypeError, ValueError):
+        raise HTTPError(400, "cache_ttl must be a number") from None
+    if not ttl > 0:
+        raise HTTPError(400, "cache_ttl must be positive")
+    return ttl
+
+
+async def _execute_with_cache(args: dict, result_cache: ResultCache,
+                              **options) -> tuple[dict, bool]:
+    """执行 execute_python 调用；标记为确定性或带缓存键时优先使用缓存结果，剖析执行不使用缓存"""
+    code = args["code"]
+    cache_key = args.get("cache_key")
+    if options.get("profile") or not (args.get("deterministic") or cache_key):
+        return await execute_python_code(code, **options), False
+
+    ttl = _cache_ttl(args.get("cache_ttl"))
+    key = ResultCache.make_key(code, cache_key)
+    cached = result_cache.get(key)
+    if cached is not None:
+        return cached, True
+
+    result = await execute_python_code(code, **options)
+    if not (result["budget"]["exceeded"] or result.get("truncated")):
+        result_cache.put(key, result, ttl)
+    return result, False
+
+
+async def _execute_in_session(sessions: SessionStore, session_id: str, code: str,
+                              **options) -> dict | None:
+    """在会话的持久命名空间中执行代码；会话不存在时返回 None"""
+    session = sessions.get(session_id)
+    if session is None:
+        return None
+
+    result = await execute_python_code(code, session.namespace, **options)
+    if not sessions.update_size(session):
+        message = (
+            f"MemoryError: session exceeded {sessions.max_session_bytes} bytes "
+            "and its namespace was reset"
+        )
+        result["success"] = False
+        result["error"] = f"{result['error']}\n{message}" if result["error"] else message
+    return result
+
+
+# 已注册的工具定义和处理器；/tools 和 /tools/call 都从这里读取
+TOOLS = []
+_TOOL_HANDLERS = {}
+# 支持流式调用的工具：arguments.stream 为真时 /tools/call 改用这里的处理器
+_TOOL_STREAMS = {}
+# 发现端点序列化后的响应体和 ETag，按路径在首次请求时计算；注册工具时清空，使 /tools 随之更新
+_DISCOVERY_CACHE = {}
+
+
+def register_tool(name: str, description: str, input_schema: dict):
+    """注册一个 MCP 工具：处理器接收 (ctx, arguments)，返回 (响应数据, 状态码)"""
+    def decorator(handler):
+        TOOLS.append({"name": name, "description": description, "inputSchema": input_schema})
+        _TOOL_HANDLERS[name] = handler
+        _DISCOVERY_CACHE.clear()
+        return handler
+    return decorator
+
+
+def register_tool_stream(name: str):
+    """为已注册的工具添加流式处理器：接收 (ctx, arguments)，返回事件字典的异步迭代器"""
+    def decorator(handler):
+        _TOOL_STREAMS[name] = handler
+        return handler
+    return decorator
+
+
+@register_tool(
+    "execute_python",
+    "Execute Python code and return the result",
+    {
+        "type": "object",
+        "properties": {
+            "code": {
+                "type": "string",
+                "description": "Python code to execute"
+            },
+            "deterministic": {
+                "type": "boolean",
+                "description": "Cache the result and serve repeat calls without executing"
+            },
+            "cache_key": {
+                "type": "string",
+                "description": "Extra key for the result cache; implies caching"
+            },
+            "cache_ttl": {
+                "type": "number",
+                "description": "Result cache lifetime in seconds"
+            },
+            "session_id": {
+                "type": "string",
+                "description": "Run in the persistent namespace of this session (see /sessions)"
+            },
+            "timeout_ms": {
+                "type": "integer",
+                "description": "Execution time budget in milliseconds"
+            },
+            "output_limit": {
+                "type": "integer",
+                "description": "Maximum characters of each output stream returned inline"
+            },
+            "stream": {
+                "type": "boolean",
+                "description": "Stream output events while the code runs (POST /tools/call only)"
+            },
+            "profile": {
+                "description": (
+                    "Profile the run: true for CPU and memory, or \"cpu\" / \"memory\" alone"
+                ),
+                "anyOf": [
+                    {"type": "boolean"},
+                    {"type": "string", "enum": ["cpu", "memory"]},
+                    {"type": "array", "items": {"type": "string", "enum": ["cpu", "memory"]}}
+                ]
+            },
+            "profile_top": {
+                "type": "integer",
+                "description": "Number of functions and allocation sites in the profile report"
+            }
+        },
+        "required": ["code"]
+    }
+)
+async def _tool_execute_python(ctx, args: dict) -> tuple[dict, int]:
+    state = ctx.state
+    code = args.get("code", "")
+    if not code:
+        return {"content": [{"type": "text", "text": "Error: No code provided"}]}, 400
+    if not isinstance(code, str):
+        return {"content": [{"type": "text", "text": "Error: code must be a string"}]}, 400
+
+    options = _exec_options(args, state.env, state.output_store)
+    if args.get("session_id"):
+        # 在会话的持久命名空间中执行
+        if state.sessions is None:
+            return {
+                "content": [
+                    {"type": "text", "text": "Error: Sessions require the Durable Object binding"}
+                ]
+            }, 501
+        result = await _execute_in_session(state.sessions, args["session_id"], code, **options)
+        if result is None:
+            return {"content": [{"type": "text", "text": "Error: Session not found"}]}, 404
+        cached = None
+    else:
+        result, cached = await _execute_with_cache(args, state.result_cache, **options)
+
+    response_data = {
+        "content": [{"type": "text", "text": _format_result_text(result)}]
+    }
+    if "budget" in result:
+        response_data["budget"] = result["budget"]
+    if result.get("truncated"):
+        response_data["output"] = result["output"]
+    if "profile" in result:
+        response_data["profile"] = result["profile"]
+    if not result["success"]:
+        response_data["isError"] = True
+    if cached is not None and (args.get("deterministic") or args.get("cache_key")):
+        response_data["cached"] = cached
+    return response_data, 200
+
+
+@register_tool(
+    "execute_python_batch",
+    "Execute many independent Python snippets in one call, "
+    "each in its own namespace and time budget",
+    {
+        "type": "object",
+        "properties": {
+            "items": {
+                "type": "array",
+                "maxItems": BATCH_MAX_ITEMS,
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {
+                            "type": "string",
+                            "description": "Identifier echoed back in the item result"
                         },
-                        {
-                            "name": "execute_python_stream",
-                            "description": "Execute Python code and return streaming results",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "code": {
-                                        "type": "string",
-                                        "description": "Python code to execute"
-                                    }
-                                },
-                                "required": ["code"]
-                            }
-                        }
-                    ]
-                }
-                
-            elif path == "/stream" and request.method == "POST":
-                # 处理流式工具调用
-                body = await request.json()
-                code = body.get("code", "")
-                
-                if not code:
-                    return Response(
-                        "Error: No code provided",
-                        status=400,
-                        headers={
-                            "Content-Type": "text/plain",
-                            "Access-Control-Allow-Origin": "*",
-                        }
-                    )
-                
-                # 创建流式响应
-                async def stream_generator():
-                    async for chunk in execute_python_code_stream(code):
-                        yield chunk
-                
-                return Response(
-                    stream_generator(),
-                    headers={
-                        "Content-Type": "text/event-stream",
-                        "Cache-Control": "no-cache",
-                        "Connection": "keep-alive",
-                        "Access-Control-Allow-Origin": "*",
-                        "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-                        "Access-Control-Allow-Headers": "*",
-                    }
-                )
-                
-            elif path == "/tools/call" and request.method == "POST":
-                body = await request.json()
-                tool_name = body.get("name")
-                args = body.get("arguments", {})
-                
-                if tool_name == "execute_python":
-                    code = args.get("code", "")
-                    
-                    if not code:
-                        response_data = {
-                            "content": [{"type": "text", "text": "Error: No code provided"}]
-                        }
-                        status = 400
-                    else:
-                        result = await execute_python_code(code)
-                        
-                        output_parts = []
-                        if result["stdout"]:
-                            output_parts.append(f"Output:\n{result['stdout']}")
-                        if result["stderr"]:
-                            output_parts.append(f"Errors:\n{result['stderr']}")
-                        if result["error"]:
-                            output_parts.append(f"Exception:\n{result['error']}")
-                        
-                        if not output_parts:
-                            output_parts.append("Code executed successfully with no output.")
-                        
-                        response_text = "\n\n".join(output_parts)
-                        
-                        response_data = {
-                            "content": [{"type": "text", "text": response_text}]
-                        }
-                        status = 200
-                elif tool_name == "execute_python_stream":
-                    code = args.get("code", "")
-                    
-                    if not code:
-                        response_data = {
-                            "content": [{"type": "text", "text": "Error: No code provided. Use /stream endpoint for streaming execution."}]
-                        }
-                        status = 400
-                    else:
-                        response_data = {
-                            "content": [{"type": "text", "text": f"Use /stream endpoint for streaming execution of code. POST to /stream with {{'code': 'your_code_here'}}"}]
+                        "code": {
+                            "type": "string",
+                            "description": "Python code to execute"
+                        },
+                        "timeout_ms": {
+                            "type": "integer",
+                            "description": "Execution time budget of this item in milliseconds"
+                        },
+                        "output_limit": {
+                            "type": "integer",
+                            "description":
+                                "Maximum characters of each output stream returned inline"
                         }
-                        status = 200
-                else:
-                    response_data = {"error": "Tool not found"}
-                    status = 404
-            else:
-                response_data = {"error": "Not found"}
-                status = 404
-            
-            return Response(
-                json.dumps(response_data),
-                status=status,
-                headers={
-                    "Content-Type": "application/json",
-                    "Access-Control-Allow-Origin": "*",
-                    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-                    "Access-Control-Allow-Headers": "*",
+                    },
+                    "required": ["code"]
                 }
-            )
-            
+            }
+        },
+        "required": ["items"]
+    }
+)
+async def _tool_execute_python_batch(ctx, args: dict) -> tuple[dict, int]:
+    items = args.get("items")
+    error = _validate_batch(items, ctx.state.env)
+    if error:
+        return {"content": [{"type": "text", "text": f"Error: {error}"}]}, 400
+
+    state = ctx.state
+    results = [
+        result async for result in execute_python_batch(items, state.env, state.output_store)
+    ]
+    return {
+        "content": [
+            {"type": "text", "text": f"[{result['id']}]\n{_format_result_text(result)}"}
+            for result in results
+        ],
+        "results": results
+    }, 200
+
+
+@register_tool(
+    "execute_python_stream",
+    "Execute Python code and return streaming results",
+    {
+        "type": "object",
+        "properties": {
+            "code": {
+                "type": "string",
+                "description": "Python code to execute"
+            }
+        },
+        "required": ["code"]
+    }
+)
+async def _tool_execute_python_stream(ctx, args: dict) -> tuple[dict, int]:
+    if not args.get("code", ""):
+        text = "Error: No code provided. Use /stream/execute endpoint for streaming execution."
+        return {"content": [{"type": "text", "text": text}]}, 400
+    text = (
+        "Use /stream/execute endpoint for streaming execution of code, "
+        "or call this tool with arguments.stream set to true. "
+        "POST to /stream/execute with {'code': 'your_code_here'}"
+    )
+    return {"content": [{"type": "text", "text": text}]}, 200
+
+
+@register_tool_stream("execute_python")
+@register_tool_stream("execute_python_stream")
+async def _stream_execute_python(ctx, args: dict):
+    code = args.get("code", "")
+    if not code:
+        raise HTTPError(400, "No code provided")
+    if not isinstance(code, str):
+        raise HTTPError(400, "code must be a string")
+    if args.get("session_id"):
+        raise HTTPError(400, "Streaming execution does not support session_id")
+    time_budget_ms = _time_budget_ms(args.get("timeout_ms"), ctx.state.env)
+    return execute_python_code_stream(
+        code, time_budget_ms, **_flush_options(args),
+        label=_exec_label.get(), executor=_get_executor(ctx.state.env),
+    )
+
+
+def _precompute_discovery(data) -> tuple[str, str]:
+    """序列化发现端点的响应体，并计算其强 ETag"""
+    body = json.dumps(data)
+    etag = '"' + hashlib.sha256(body.encode()).hexdigest()[:32] + '"'
+    return body, etag
+
+
+# 发现端点的响应数据；/tools 读取当前注册的工具，与 MCP 的 tools/list 一致
+_DISCOVERY_DATA = {
+    "/": lambda: SERVER_INFO,
+    "": lambda: SERVER_INFO,
+    "/tools": lambda: {"tools": TOOLS},
+}
+
+# 发现端点允许客户端和边缘缓存复用的时间（秒），过期后凭 ETag 重新验证
+_DISCOVERY_MAX_AGE = 300
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """判断 If-None-Match 请求头是否命中当前 ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in candidates
+
+
+def _discovery_response(request, body: str, etag: str):
+    """返回预先序列化的发现端点响应；客户端缓存仍然有效时返回 304"""
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={_DISCOVERY_MAX_AGE}",
+        "Access-Control-Expose-Headers": "ETag",
+        **_CORS_HEADERS,
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(None, status=304, headers=headers)
+    return Response(body, headers={"Content-Type": "application/json", **headers})
+
+
+async def _json_body(ctx) -> dict:
+    """读取 JSON 请求体，格式错误时返回 400"""
+    try:
+        body = await ctx.request.json()
+    except Exception:
+        raise HTTPError(400, "Invalid JSON body") from None
+    if not isinstance(body, dict):
+        raise HTTPError(400, "JSON body must be an object")
+    return body
+
+
+# 入口 Worker 和 Durable Object 共用的路由表；中间件由外向内依次为错误映射、CORS、计时、
+# 指标标签、响应压缩、分片转发
+router = Router()
+route_timer = RouteTimer(_request_seconds)
+
+
+@router.use
+async def _error_middleware(ctx, call_next):
+    """把 HTTPError 和未处理的异常转换为 JSON 错误响应"""
+    try:
+        return await call_next(ctx)
+    except HTTPError as e:
+        return _json_response({"error": e.message}, e.status)
     except Exception as e:
-        error_response = {
-            "error": f"Internal server error: {str(e)}",
+        return _json_response({
+            "error": f"Internal server error: {e!s}",
             "traceback": traceback.format_exc()
-        }
+        }, 500)
+
+
+@router.use
+async def _cors_middleware(ctx, call_next):
+    """直接回答 CORS 预检请求"""
+    if ctx.method == "OPTIONS":
+        return Response("", status=200, headers=_CORS_HEADERS)
+    return await call_next(ctx)
+
+
+router.use(route_timer)
+
+
+@router.use
+async def _exec_label_middleware(ctx, call_next):
+    """以路由名作为本次请求中执行指标的默认标签"""
+    if ctx.route is None:
+        return await call_next(ctx)
+    token = _exec_label.set(ctx.route.name)
+    try:
+        return await call_next(ctx)
+    finally:
+        _exec_label.reset(token)
+
+
+@router.use
+async def _compression_middleware(ctx, call_next):
+    """按 Accept-Encoding 协商响应编码，供 JSON 和 SSE 响应使用"""
+    token = _response_encoding.set(negotiate(ctx.request.headers.get("accept-encoding")))
+    try:
+        return await call_next(ctx)
+    finally:
+        _response_encoding.reset(token)
+
+
+@router.use
+async def _shard_middleware(ctx, call_next):
+    """在入口 Worker 中把需要 Durable Object 的路由转发到对应分片"""
+    shard_router = ctx.state.shard_router
+    if shard_router is None or ctx.route is None or ctx.route.edge:
+        return await call_next(ctx)
+
+    if ctx.route.name == "create_session":
+        # 在入口生成会话 ID，使会话落在其哈希对应的分片上
+        session_id = uuid.uuid4().hex
+        session_url = ctx.url._replace(path=f"/sessions/{session_id}").geturl()
+        shard, stub = shard_router.route(session_id)
+        return await _forward(stub, shard, ctx.request, session_url)
+
+    if ctx.route.name == "persistent_stream":
+        # 新的持久流在入口生成频道 ID，后续提交按该 ID 路由到同一分片
+        channel_id = uuid.uuid4().hex
+        channel_url = ctx.url._replace(path=f"/stream/persistent/{channel_id}").geturl()
+        shard, stub = shard_router.route(channel_id)
+        return await _forward(stub, shard, ctx.request, channel_url)
+
+    if ctx.route.name == "metrics":
+        # 每个分片有自己的指标，由 shard 查询参数指定要抓取的分片，不指定时合并全部分片
+        shard = ctx.query_value("shard")
+        if shard is None:
+            return _metrics_response(await _scrape_shards(shard_router, ctx.request))
+        if shard not in shard_router.shard_names:
+            raise HTTPError(404, f"Unknown shard: {shard}")
+        return await _forward(shard_router.stub(shard), shard, ctx.request)
+
+    if ctx.route.name == "read_output":
+        # 输出句柄带有保存它的分片名
+        shard = ctx.params["handle"].partition("~")[0]
+        if shard in shard_router.shard_names:
+            return await _forward(shard_router.route_to(shard), shard, ctx.request)
+
+    # 只有一个分片时无需计算路由键
+    key = await _routing_key(ctx) if len(shard_router.shard_names) > 1 else None
+    shard, stub = shard_router.route(key)
+    return await _forward(stub, shard, ctx.request)
+
+
+async def _discovery(ctx):
+    cached = _DISCOVERY_CACHE.get(ctx.path)
+    if cached is None:
+        cached = _precompute_discovery(_DISCOVERY_DATA[ctx.path]())
+        _DISCOVERY_CACHE[ctx.path] = cached
+    return _discovery_response(ctx.request, *cached)
+
+
+for _path in _DISCOVERY_DATA:
+    # 发现端点由入口 Worker 直接用预先序列化的响应回答，不转发给 Durable Object
+    router.add(("GET", "HEAD"), _path, _discovery, edge=True)
+
+
+@router.route("GET", "/stats")
+async def _stats(ctx):
+    response_data = {
+        "compile_cache": compile_cache.stats(),
+        "result_cache": ctx.state.result_cache.stats(),
+        "routes": route_timer.stats(),
+    }
+    if ctx.state.sessions is not None:
+        response_data["sessions"] = ctx.state.sessions.stats()
+    if ctx.state.subscribers is not None:
+        response_data["subscribers"] = ctx.state.subscribers.stats()
+    if _executor is not None:
+        response_data["executor"] = _executor.stats()
+    return _json_response(response_data)
+
+
+@metrics.collector
+def _collect_route_errors(state):
+    help_text = "Requests that raised an unhandled error, by route"
+    yield "mcp_request_errors_total", "counter", help_text, [
+        ({"route": name}, route["errors"]) for name, route in route_timer.stats().items()
+    ]
+
+
+@metrics.collector
+def _collect_executor(state):
+    if _executor is None:
+        return
+    pool = _executor.stats()
+    yield "mcp_exec_pool_processes", "gauge", "Execution pool processes, by state", [
+        ({"state": "live"}, pool["live"]),
+        ({"state": "idle"}, pool["idle"]),
+    ]
+    yield "mcp_exec_pool_retired_total", "counter", "Execution pool processes retired, by reason", [
+        ({"reason": "recycled"}, pool["recycled"]),
+        ({"reason": "crashed"}, pool["crashed"]),
+        ({"reason": "killed"}, pool["killed"]),
+    ]
+
+
+@metrics.collector
+def _collect_compile_cache(state):
+    compile_stats = compile_cache.stats()
+    yield "mcp_compile_cache_lookups_total", "counter", "Compile cache lookups, by result", [
+        ({"result": "hit"}, compile_stats["hits"]),
+        ({"result": "miss"}, compile_stats["misses"]),
+    ]
+    yield "mcp_compile_cache_hit_ratio", "gauge", "Fraction of compile cache lookups that hit", [
+        ({}, compile_stats["hit_rate"]),
+    ]
+    yield "mcp_compile_cache_bytes", "gauge", "Estimated size of cached code objects", [
+        ({}, compile_stats["bytes"]),
+    ]
+
+
+@shard_metrics.collector
+def _collect_result_cache(state):
+    result_stats = state.result_cache.stats()
+    yield "mcp_result_cache_lookups_total", "counter", "Result cache lookups, by result", [
+        ({"result": "memory_hit"}, result_stats["memory_hits"]),
+        ({"result": "storage_hit"}, result_stats["storage_hits"]),
+        ({"result": "miss"}, result_stats["misses"]),
+    ]
+
+
+@shard_metrics.collector
+def _collect_shard(state):
+    """Durable Object 中的会话和持久流"""
+    if state.sessions is None:
+        return
+    yield "mcp_sessions_active", "gauge", "Sessions held in memory", [({}, len(state.sessions))]
+    yield "mcp_sessions_bytes", "gauge", "Estimated memory used by session namespaces", [
+        ({}, state.sessions.stats()["total_bytes"]),
+    ]
+    yield "mcp_persistent_streams", "gauge", "Open persistent streams", [
+        ({}, len(state.subscribers)),
+    ]
+
+
+def _get_isolate_id() -> str:
+    """本 isolate 的随机标识；在首次导出时生成，使原生部署中 fork 出的各进程互不相同"""
+    global _isolate_id
+    if _isolate_id is None:
+        _isolate_id = uuid.uuid4().hex[:12]
+    return _isolate_id
+
+
+@router.route("GET", "/metrics")
+async def _metrics(ctx):
+    """以 Prometheus 文本格式导出指标
+
+    Durable Object 中，isolate 共享的指标带 isolate 标签，分片自身的指标带分片名标签。
+    同一 isolate 中的多个分片导出相同的 isolate 序列，由入口合并时去重，不会重复累加。
+    经入口 Worker 访问时可用 shard 参数指定分片，不指定时由入口合并全部分片的指标。
+    """
+    output_store = ctx.state.output_store
+    if output_store is None:
+        return _metrics_response(metrics.render() + shard_metrics.render(ctx.state))
+    isolate_labels = {"isolate": _get_isolate_id()}
+    shard_labels = {"shard": output_store.shard or "main"}
+    return _metrics_response(
+        metrics.render(None, isolate_labels) + shard_metrics.render(ctx.state, shard_labels)
+    )
+
+
+def _metrics_response(text: str):
+    return Response(text, headers={"Content-Type": METRICS_CONTENT_TYPE, **_CORS_HEADERS})
+
+
+def _sessions(ctx) -> SessionStore:
+    if ctx.state.sessions is None:
+        raise HTTPError(501, "Sessions require the Durable Object binding")
+    session_id = ctx.params.get("session_id")
+    if session_id is not None and not SESSION_ID_PATTERN.match(session_id):
+        raise HTTPError(400, "Invalid session id")
+    return ctx.state.sessions
+
+
+@router.route("POST", "/sessions")
+async def _create_session(ctx):
+    # 直接访问 Durable Object 时由这里生成会话 ID
+    ctx.params["session_id"] = uuid.uuid4().hex
+    return await _put_session(ctx)
+
+
+@router.route("POST", "/sessions/{session_id}")
+async def _put_session(ctx):
+    session, created = _sessions(ctx).create(ctx.params["session_id"])
+    return _json_response({"created": created, **session.info()}, 201 if created else 200)
+
+
+@router.route("POST", "/sessions/{session_id}/reset")
+async def _reset_session(ctx):
+    session_id = ctx.params["session_id"]
+    if not _sessions(ctx).reset(session_id):
+        raise HTTPError(404, "Session not found")
+    return _json_response({"session_id": session_id, "reset": True})
+
+
+@router.route("DELETE", "/sessions/{session_id}")
+async def _delete_session(ctx):
+    session_id = ctx.params["session_id"]
+    if not _sessions(ctx).drop(session_id):
+        raise HTTPError(404, "Session not found")
+    return _json_response({"session_id": session_id, "deleted": True})
+
+
+@router.route("GET", "/output/{handle}")
+async def _read_output(ctx):
+    """分页读取溢出到存储的输出"""
+    output_store = ctx.state.output_store
+    if output_store is None:
+        raise HTTPError(501, "Output paging requires the Durable Object binding")
+    stream = ctx.query_value("stream", "stdout")
+    try:
+        cursor = int(ctx.query_value("cursor", "0"))
+    except ValueError:
+        raise HTTPError(400, "Invalid cursor") from None
+    if stream not in ("stdout", "stderr"):
+        raise HTTPError(400, "Invalid stream")
+
+    page = output_store.read(ctx.params["handle"], stream, cursor)
+    if page is None:
+        raise HTTPError(404, "Output not found or expired")
+    return _json_response(page)
+
+
+@router.route("POST", "/stream")
+async def _stream(ctx):
+    """处理流式工具调用；默认输出 SSE"""
+    body = await _json_body(ctx)
+    code = body.get("code", "")
+    if not code:
         return Response(
-            json.dumps(error_response),
-            status=500,
-            headers={
-                "Content-Type": "application/json",
-                "Access-Control-Allow-Origin": "*",
-            }
-        )
\ No newline at end of file
+            "Error: No code provided",
+            status=400,
+            headers={"Content-Type": "text/plain", **_CORS_HEADERS}
+        )
+
+    stream_format = _stream_format(ctx, body.get("format"))
+    time_budget_ms = _time_budget_ms(body.get("timeout_ms"), ctx.state.env)
+    return _stream_response(
+        execute_python_code_stream(
+            code, time_budget_ms, **_flush_options(body),
+            label=_exec_label.get(), executor=_get_executor(ctx.state.env),
+        ),
+        stream_format,
+    )
+
+
+@router.route("POST", "/stream/execute")
+async def _stream_execute(ctx):
+    """以流式事件执行代码；默认输出 NDJSON"""
+    body = await _json_body(ctx)
+    stream_format = _stream_format(ctx, body.get("format"), default="ndjson")
+    return _stream_response(await _stream_execute_python(ctx, body), stream_format)
+
+
+def _subscribers(ctx) -> SubscriberHub:
+    if ctx.state.subscribers is None:
+        raise HTTPError(501, "Persistent streams require the Durable Object binding")
+    channel_id = ctx.params.get("channel_id")
+    if channel_id is not None and not SESSION_ID_PATTERN.match(channel_id):
+        raise HTTPError(400, "Invalid channel id")
+    return ctx.state.subscribers
+
+
+@router.route("GET", "/stream/persistent")
+@router.route("GET", "/stream/persistent/{channel_id}", name="join_persistent_stream")
+async def _persistent_stream(ctx):
+    """打开持久流：先发送 connection_established，之后转发提交到该频道的执行事件和心跳
+
+    默认输出 NDJSON。
+    """
+    hub = _subscribers(ctx)
+    stream_format = _stream_format(ctx, default="ndjson")
+    heartbeat_ms = _env_int(ctx.state.env, "PERSISTENT_HEARTBEAT_MS", DEFAULT_HEARTBEAT_MS)
+    requested = ctx.query_value("heartbeat_ms")
+    if requested is not None:
+        try:
+            heartbeat_ms = max(MIN_HEARTBEAT_MS, int(requested))
+        except ValueError:
+            raise HTTPError(400, "heartbeat_ms must be an integer") from None
+
+    # 直接访问 Durable Object 时由这里生成频道 ID
+    subscriber = hub.subscribe(ctx.params.get("channel_id") or uuid.uuid4().hex)
+    if subscriber is None:
+        raise HTTPError(503, "Too many persistent streams")
+    return _stream_response(hub.listen(subscriber, heartbeat_ms), stream_format)
+
+
+@router.route("POST", "/stream/persistent/{channel_id}")
+async def _submit_to_persistent_stream(ctx):
+    """在后台执行代码，事件带上 request_id 后发布到频道的持久流"""
+    hub = _subscribers(ctx)
+    channel_id = ctx.params["channel_id"]
+    body = await _json_body(ctx)
+    if not hub.subscribers(channel_id):
+        raise HTTPError(404, "No persistent stream is open for this channel")
+    events = await _stream_execute_python(ctx, body)
+    request_id = str(body.get("id") or uuid.uuid4().hex)
+    hub.spawn(channel_id, request_id, events)
+    return _json_response({
+        "channel_id": channel_id,
+        "request_id": request_id,
+        "subscribers": hub.subscribers(channel_id),
+    }, 202)
+
+
+@router.route("POST", "/tools/batch")
+async def _tools_batch(ctx):
+    """处理 /tools/batch 请求；stream 为真时逐个流式返回结果，默认格式为 SSE"""
+    body = await _json_body(ctx)
+    items = body.get("items")
+    error = _validate_batch(items, ctx.state.env)
+    if error:
+        raise HTTPError(400, error)
+
+    env, output_store = ctx.state.env, ctx.state.output_store
+    if body.get("stream"):
+        stream_format = _stream_format(ctx, body.get("format"))
+
+        async def stream_generator():
+            async for result in execute_python_batch(items, env, output_store):
+                yield {'type': 'item', **result}
+            yield {'type': 'end', 'count': len(items), 'timestamp': time.time()}
+
+        return _stream_response(stream_generator(), stream_format)
+
+    results = [result async for result in execute_python_batch(items, env, output_store)]
+    return _json_response({"results": results})
+
+
+@router.route("POST", "/tools/call")
+async def _tools_call(ctx):
+    """按名称分发到已注册的工具；arguments.stream 为真时返回事件流，默认格式为 NDJSON"""
+    body = await _json_body(ctx)
+    name = body.get("name")
+    handler = _TOOL_HANDLERS.get(name)
+    if handler is None:
+        raise HTTPError(404, "Tool not found")
+    args = body.get("arguments") or {}
+    if not isinstance(args, dict):
+        raise HTTPError(400, "arguments must be an object")
+    if args.get("stream"):
+        stream_handler = _TOOL_STREAMS.get(name)
+        if stream_handler is None:
+            raise HTTPError(400, f"Tool does not support streaming: {name}")
+        stream_format = _stream_format(ctx, args.get("format"), default="ndjson")
+        _exec_label.set(name)
+        return _stream_response(await stream_handler(ctx, args), stream_format)
+    _exec_label.set(name)
+    response_data, status = await handler(ctx, args)
+    return _json_response(response_data, status)
+
+
+# MCP Streamable HTTP 传输：/mcp 接收 JSON-RPC 消息或批量数组
+MCP_PROTOCOL_VERSIONS = ("2025-03-26", "2024-11-05")
+mcp = JSONRPCDispatcher()
+
+
+@mcp.method("initialize")
+async def _mcp_initialize(params, ctx):
+    requested = params.get("protocolVersion") if isinstance(params, dict) else None
+    if requested not in MCP_PROTOCOL_VERSIONS:
+        requested = MCP_PROTOCOL_VERSIONS[0]
+    return {
+        "protocolVersion": requested,
+        "capabilities": {"tools": {"listChanged": False}},
+        "serverInfo": {"name": SERVER_INFO["name"], "version": SERVER_INFO["version"]},
+    }
+
+
+@mcp.method("notifications/initialized")
+async def _mcp_initialized(params, ctx):
+    return None
+
+
+@mcp.method("ping")
+async def _mcp_ping(params, ctx):
+    return {}
+
+
+@mcp.method("tools/list")
+async def _mcp_tools_list(params, ctx):
+    return {"tools": TOOLS}
+
+
+@mcp.method("tools/call")
+async def _mcp_tools_call(params, ctx):
+    if not isinstance(params, dict):
+        raise JSONRPCError(INVALID_PARAMS, "params must be an object")
+    handler = _TOOL_HANDLERS.get(params.get("name"))
+    if handler is None:
+        raise JSONRPCError(INVALID_PARAMS, f"Unknown tool: {params.get('name')}")
+    args = params.get("arguments") or {}
+    if not isinstance(args, dict):
+        raise JSONRPCError(INVALID_PARAMS, "arguments must be an object")
+    _exec_label.set(params["name"])
+    try:
+        response_data, status = await handler(ctx, args)
+    except HTTPError as e:
+        # 参数错误是客户端的问题，以 INVALID_PARAMS 返回，不附带服务器端的回溯
+        code = INVALID_PARAMS if e.status < 500 else INTERNAL_ERROR
+        raise JSONRPCError(code, e.message) from None
+    # 工具自身的失败以 isError 结果返回，执行预算等附加信息放在 _meta 中
+    result = {
+        "content": response_data.get("content", []),
+        "isError": bool(response_data.get("isError")) or status >= 400,
+    }
+    meta = {key: value for key, value in response_data.items() if key not in ("content", "isError")}
+    if meta:
+        result["_meta"] = meta
+    return result
+
+
+def _accepts_event_stream(request) -> bool:
+    return "text/event-stream" in (request.headers.get("accept") or "")
+
+
+@router.route("POST", "/mcp")
+async def _mcp_post(ctx):
+    """处理 JSON-RPC 消息；批量请求并发执行，客户端接受 SSE 时按完成顺序逐条返回"""
+    try:
+        payload = await ctx.request.json()
+    except Exception:
+        return _json_response(error_response(None, PARSE_ERROR, "Parse error"), 400)
+
+    headers = {}
+    if isinstance(payload, dict) and payload.get("method") == "initialize":
+        # 会话 ID 同时作为分片路由键，使同一客户端的后续请求落在同一分片
+        headers["Mcp-Session-Id"] = uuid.uuid4().hex
+        headers["Access-Control-Expose-Headers"] = "Mcp-Session-Id"
+
+    if not isinstance(payload, list):
+        response = await mcp.handle(payload, ctx)
+        if response is None:
+            return Response(None, status=202, headers=_CORS_HEADERS)
+        return _json_response(response, headers=headers)
+
+    if not payload or len(payload) > BATCH_MAX_ITEMS:
+        message = f"Batch must contain 1 to {BATCH_MAX_ITEMS} messages"
+        return _json_response(error_response(None, INVALID_REQUEST, message), 400)
+    if all(isinstance(message, dict) and "id" not in message for message in payload):
+        # 只有通知时没有需要返回的响应，但仍要处理完再应答
+        async for _ in mcp.handle_batch(payload, ctx):
+            pass
+        return Response(None, status=202, headers=_CORS_HEADERS)
+
+    if _accepts_event_stream(ctx.request):
+        async def stream_generator():
+            async for response in mcp.handle_batch(payload, ctx):
+                yield f"event: message\ndata: {json.dumps(response)}\n\n"
+
+        return _sse_response(stream_generator())
+
+    responses = [response async for response in mcp.handle_batch(payload, ctx)]
+    return _json_response(responses)
+
+
+@router.route("GET", "/mcp", edge=True)
+async def _mcp_get(ctx):
+    # 服务器不主动推送消息，不提供 GET 打开的 SSE 流
+    raise HTTPError(405, "Method not allowed: POST JSON-RPC messages to /mcp")
+
+
+class _ToolSocket:
+    """一条 WebSocket 连接上的 JSON-RPC 工具调用
+
+    每个文本帧是一条 JSON-RPC 消息或批量数组，各调用并发执行，响应按完成顺序发回。
+    执行期间的输出以 notifications/output 帧实时转发，用 requestId 标明所属调用。
+    """
+
+    def __init__(self, server, ctx):
+        self._server = server
+        self._ctx = ctx
+        self._tasks = set()
+        self._listeners = []
+        self.closed = False
+
+    def attach(self):
+        from pyodide.ffi import create_proxy
+        for name, handler in (("message", self._on_message), ("close", self._on_close),
+                              ("error", self._on_close)):
+            proxy = create_proxy(handler)
+            self._listeners.append((name, proxy))
+            self._server.addEventListener(name, proxy)
+
+    def _send(self, message: dict):
+        if not self.closed:
+            self._server.send(json.dumps(message))
+
+    def _on_message(self, event):
+        if not isinstance(event.data, str):
+            self._send(error_response(None, INVALID_REQUEST, "Only text frames are supported"))
+            return
+        try:
+            payload = json.loads(event.data)
+        except ValueError:
+            self._send(error_response(None, PARSE_ERROR, "Parse error"))
+            return
+        messages = payload if isinstance(payload, list) else [payload]
+        for message in messages:
+            task = asyncio.ensure_future(self._handle(message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, message):
+        request_id = message.get("id") if isinstance(message, dict) else None
+        if request_id is None:
+            response = await mcp.handle(message, self._ctx)
+        else:
+            # 任务运行在自己的上下文副本中，监听器只作用于这一个调用
+            queue = asyncio.Queue()
+            _output_listener.set(lambda kind, text: queue.put_nowait((kind, text)))
+            forwarder = asyncio.ensure_future(self._forward_output(request_id, queue))
+            try:
+                response = await mcp.handle(message, self._ctx)
+            finally:
+                queue.put_nowait(None)
+                await forwarder
+        if response is not None:
+            self._send(response)
+
+    async def _forward_output(self, request_id, queue: asyncio.Queue):
+        """把一个调用的输出合并后以 notifications/output 帧发送"""
+        async for kind, text in coalesce_output(queue):
+            self._send({
+                "jsonrpc": "2.0",
+                "method": "notifications/output",
+                "params": {"requestId": request_id, "stream": kind, "content": text},
+            })
+
+    def _on_close(self, event):
+        if self.closed:
+            return
+        self.closed = True
+        for task in list(self._tasks):
+            task.cancel()
+        # 不能在监听器自身的调用中销毁它的代理，推迟到下一轮事件循环
+        asyncio.get_running_loop().call_soon(self._detach)
+
+    def _detach(self):
+        for name, proxy in self._listeners:
+            self._server.removeEventListener(name, proxy)
+            proxy.destroy()
+        self._listeners.clear()
+
+
+@router.route("GET", "/ws")
+async def _websocket(ctx):
+    """把连接升级为 WebSocket，在其上并发执行 JSON-RPC 工具调用"""
+    if (ctx.request.headers.get("upgrade") or "").lower() != "websocket":
+        raise HTTPError(426, "Expected a WebSocket upgrade")
+    from js import WebSocketPair
+    client, server = WebSocketPair.new().object_values()
+    server.accept()
+    _ToolSocket(server, ctx).attach()
+    return Response(None, status=101, web_socket=client)
+
+
+class FastMCPServer(DurableObject):
+    # Durable Object 自己处理所有路由，不再转发
+    shard_router = None
+
+    def __init__(self, ctx, env):
+        self.ctx = ctx
+        self.env = env
+        self.result_cache = ResultCache(
+            ctx.storage.sql,
+            ttl=_env_int(env, "RESULT_CACHE_TTL", 3600),
+            max_bytes=_env_int(env, "RESULT_CACHE_MAX_BYTES", 32 * 1024 * 1024),
+        )
+        self.sessions = SessionStore(
+            _make_exec_globals,
+            max_sessions=_env_int(env, "SESSION_MAX_COUNT", 64),
+            max_session_bytes=_env_int(env, "SESSION_MAX_BYTES", 16 * 1024 * 1024),
+            max_total_bytes=_env_int(env, "SESSION_TOTAL_MAX_BYTES", 128 * 1024 * 1024),
+        )
+        self.output_store = OutputStore(ctx.storage.sql, ttl=_env_int(env, "OUTPUT_TTL", 3600))
+        self.subscribers = SubscriberHub(
+            max_subscribers=_env_int(env, "PERSISTENT_MAX_SUBSCRIBERS", 256),
+        )
+
+    async def fetch(self, request):
+        """处理请求的核心逻辑"""
+        # 记录入口 Worker 告知的分片名，写入输出句柄以便分页请求路由回来
+        shard = request.headers.get(_SHARD_HEADER)
+        if shard:
+            self.output_store.shard = shard
+        return await router.dispatch(request, self)
+
+
+class _EdgeState:
+    """入口 Worker 处理请求时的状态；会话、输出分页和持久流只在 Durable Object 中可用"""
+
+    sessions = None
+    output_store = None
+    subscribers = None
+    result_cache = _stateless_result_cache
+
+    def __init__(self, env):
+        self.env = env
+        self.shard_router = _get_shard_router(env)
+
+
+def _get_shard_router(env):
+    """返回本 isolate 缓存的分片路由器；未绑定 Durable Object 时返回 None"""
+    global _shard_router
+    if _shard_router is None:
+        namespace = getattr(env, "ns", None)
+        if namespace is None:
+            return None
+        _shard_router = ShardRouter(namespace, _env_int(env, "MCP_SHARD_COUNT", 1))
+    return _shard_router
+
+
+async def _forward(stub, shard: str, request, url: str | None = None):
+    """把请求转发到分片，并通过请求头告知分片自己的名字"""
+    from js import Request
+    forwarded = Request.new(url or request.url, getattr(request, "js_object", request))
+    forwarded.headers.set(_SHARD_HEADER, shard)
+    return await stub.fetch(forwarded)
+
+
+async def _scrape_shards(shard_router: ShardRouter, request) -> str:
+    """并发抓取全部分片的指标并合并；各分片的样本以 shard 标签区分"""
+    async def scrape(name: str) -> str:
+        response = await _forward(shard_router.stub(name), name, request)
+        return await response.text()
+
+    texts = await asyncio.gather(*(scrape(name) for name in shard_router.shard_names))
+    return merge_expositions(texts)
+
+
+async def _peek_json(request):
+    """解析请求体的副本；原请求体保持未读，仍可原样转发到分片。无法解析时返回 None"""
+    js_request = getattr(request, "js_object", request)
+    try:
+        return json.loads(await js_request.clone().text())
+    except Exception:
+        return None
+
+
+def _call_routing_key(args) -> str | None:
+    """工具调用参数对应的路由键
+
+    会话中的调用发送到会话所在的分片；可缓存的调用以结果缓存键固定到同一分片，使重复调用命中缓存。
+    """
+    if not isinstance(args, dict):
+        return None
+    session_id = args.get("session_id")
+    if session_id and isinstance(session_id, str):
+        return session_id
+    if args.get("profile"):
+        return None
+    code, cache_key = args.get("code"), args.get("cache_key")
+    if isinstance(code, str) and (args.get("deterministic") or cache_key):
+        return ResultCache.make_key(code, cache_key)
+    return None
+
+
+def _body_routing_key(body) -> str | None:
+    """从 POST /tools/call 的请求体或 /mcp 的 tools/call 消息中提取路由键；批量消息取第一个"""
+    for message in body if isinstance(body, list) else (body,):
+        if not isinstance(message, dict):
+            continue
+        if "method" in message:
+            params = message.get("params")
+            if message["method"] != "tools/call" or not isinstance(params, dict):
+                continue
+            args = params.get("arguments")
+        else:
+            args = message.get("arguments")
+        key = _call_routing_key(args)
+        if key:
+            return key
+    return None
+
+
+async def _routing_key(ctx) -> str | None:
+    """提取分片路由键
+
+    依次取会话或持久流路径参数、工具调用参数、请求头和 session_id 查询参数。
+    工具调用参数排在请求头之前：MCP 客户端的每个请求都带有 Mcp-Session-Id。
+    """
+    if "session_id" in ctx.params:
+        return ctx.params["session_id"]
+    if "channel_id" in ctx.params:
+        return ctx.params["channel_id"]
+
+    if ctx.route.name in _BODY_ROUTED:
+        key = _body_routing_key(await _peek_json(ctx.request))
+        if key:
+            return key
+
+    for name in _ROUTING_KEY_HEADERS:
+        value = ctx.request.headers.get(name)
+        if value:
+            return value
+
+    return ctx.query_value("session_id")
+
+
+async def on_fetch(request, env):
+    """Cloudflare Workers 的入口点"""
+    return await router.dispatch(request, _EdgeState(env))
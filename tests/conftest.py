@@ -0,0 +1,11 @@
+"""Make the modules under src importable outside the Workers runtime.
+
+The runtime-only modules (js, pyodide.ffi, workers) resolve to the stand-ins
+that the benchmarks use; they must come before src on sys.path. The request and
+execution context fakes come from bench/fixtures.py.
+"""
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT / "bench" / "stubs"), str(ROOT / "src"), str(ROOT / "bench")]
@@ -0,0 +1,234 @@
+import asyncio
+
+import pytest
+from fixtures import Env, ExecutionContext, Request
+from js import Uint8Array
+
+import asgi
+
+URL = "https://example.com/"
+
+
+async def respond(send, body: bytes, status: int = 200):
+    await send({"type": "http.response.start", "status": status, "headers": []})
+    await send({"type": "http.response.body", "body": body})
+
+
+def response_bytes(response) -> bytes:
+    return response.body.to_bytes() if response.body is not None else b""
+
+
+@pytest.mark.asyncio
+async def test_concurrent_first_requests_share_one_startup():
+    events = []
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            await receive()
+            events.append("startup")
+            await asyncio.sleep(0.01)
+            scope["state"]["ready"] = True
+            await send({"type": "lifespan.startup.complete"})
+            await receive()
+            events.append("shutdown")
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+        await receive()
+        await respond(send, b"ready" if scope["state"].get("ready") else b"cold")
+
+    requests = [asgi.fetch(app, Request("GET", URL), Env()) for _ in range(5)]
+    responses = await asyncio.gather(*requests)
+    assert [response_bytes(response) for response in responses] == [b"ready"] * 5
+
+    await asgi.fetch(app, Request("GET", URL), Env())
+    assert events == ["startup"]
+
+    await asgi.shutdown_application(app)
+    assert events == ["startup", "shutdown"]
+
+
+@pytest.mark.asyncio
+async def test_failed_startup_is_retried_by_the_next_request():
+    attempts = 0
+
+    async def app(scope, receive, send):
+        nonlocal attempts
+        if scope["type"] == "lifespan":
+            await receive()
+            attempts += 1
+            if attempts == 1:
+                await send({"type": "lifespan.startup.failed", "message": "boom"})
+                return
+            await send({"type": "lifespan.startup.complete"})
+            await receive()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+        await receive()
+        await respond(send, b"ok")
+
+    with pytest.raises(RuntimeError, match="boom"):
+        await asgi.fetch(app, Request("GET", URL), Env())
+    response = await asgi.fetch(app, Request("GET", URL), Env())
+    assert response_bytes(response) == b"ok"
+    assert attempts == 2
+    await asgi.shutdown_application(app)
+
+
+async def upload_app(scope, receive, send):
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+        size += len(message["body"])
+        if not message["more_body"]:
+            break
+    await respond(send, str(size).encode())
+
+
+class CountingBody:
+    """Request body stream that records how many chunks have been pulled."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.pulled = 0
+
+    async def __aiter__(self):
+        for chunk in self._chunks:
+            self.pulled += 1
+            yield Uint8Array(chunk)
+
+
+@pytest.mark.asyncio
+async def test_content_length_over_the_limit_is_rejected_before_the_app_runs():
+    called = False
+
+    async def app(scope, receive, send):
+        nonlocal called
+        called = True
+        await upload_app(scope, receive, send)
+
+    request = Request("POST", URL, chunks=[b"x" * 10], headers={"Content-Length": "10"})
+    response = await asgi.process_request(app, request, Env(), None, max_body_size=5)
+    assert response.status == 413
+    assert not called
+
+
+@pytest.mark.asyncio
+async def test_body_over_the_limit_is_rejected_while_streaming():
+    request = Request("POST", URL, chunks=[b"x" * 4] * 10)
+    response = await asgi.process_request(upload_app, request, Env(), None, max_body_size=10)
+    assert response.status == 413
+
+
+@pytest.mark.asyncio
+async def test_body_within_the_limit_reaches_the_app():
+    request = Request("POST", URL, chunks=[b"x" * 4] * 10)
+    response = await asgi.process_request(upload_app, request, Env(), None, max_body_size=40)
+    assert response.status == 200
+    assert response_bytes(response) == b"40"
+
+
+@pytest.mark.asyncio
+async def test_body_is_pulled_as_the_app_reads_it():
+    request = Request("POST", URL)
+    request.body = CountingBody([b"x"] * 50)
+    pulled_at_first_message = None
+
+    async def app(scope, receive, send):
+        nonlocal pulled_at_first_message
+        await receive()
+        pulled_at_first_message = request.body.pulled
+        await upload_app(scope, receive, send)
+
+    response = await asgi.process_request(app, request, Env(), None)
+    assert response_bytes(response) == b"49"
+    # Only a bounded read-ahead is pulled before the app asks for more
+    assert pulled_at_first_message <= asgi.BODY_QUEUE_SIZE + 2
+    assert request.body.pulled == 50
+
+
+def streamed_bytes(response) -> bytes:
+    # The TransformStream stand-in's readable side is the list of written chunks
+    return b"".join(chunk.to_bytes() for chunk in response.body)
+
+
+@pytest.mark.asyncio
+async def test_later_more_body_chunks_are_delivered():
+    async def app(scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/x-ndjson")],
+        })
+        for i in range(3):
+            await send({"type": "http.response.body", "body": b"%d\n" % i, "more_body": True})
+        await send({"type": "http.response.body", "body": b"done\n"})
+
+    ctx = ExecutionContext()
+    response = await asgi.process_request(app, Request("GET", URL), Env(), ctx)
+    await ctx.drain()
+    assert response.status == 200
+    assert streamed_bytes(response) == b"0\n1\n2\ndone\n"
+
+
+@pytest.mark.asyncio
+async def test_single_chunk_response_is_not_streamed():
+    async def app(scope, receive, send):
+        await respond(send, b'{"ok": true}')
+
+    response = await asgi.process_request(app, Request("GET", URL), Env(), None)
+    assert isinstance(response.body, Uint8Array)
+    assert response_bytes(response) == b'{"ok": true}'
+
+
+@pytest.mark.asyncio
+async def test_error_after_streaming_started_ends_the_body():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"partial", "more_body": True})
+        raise RuntimeError("failed mid-stream")
+
+    ctx = ExecutionContext()
+    response = await asgi.process_request(app, Request("GET", URL), Env(), ctx)
+    await ctx.drain()
+    assert streamed_bytes(response) == b"partial"
+
+
+@pytest.mark.asyncio
+async def test_bridge_stats_count_the_bytes_copied_per_request():
+    before = dict(asgi.bridge_stats)
+    request = Request("POST", URL, chunks=[b"u" * 100] * 3)
+    response = await asgi.process_request(upload_app, request, Env(), None)
+    assert response_bytes(response) == b"300"
+
+    # 300 bytes of upload in, 3 bytes of response out
+    assert asgi.bridge_stats["requests"] == before["requests"] + 1
+    assert asgi.bridge_stats["bytes_copied"] == before["bytes_copied"] + 303
+    assert asgi.bridge_stats["max_request_bytes_copied"] >= 303
+
+
+@pytest.mark.asyncio
+async def test_bridge_counts_each_streamed_chunk_once():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        for _ in range(4):
+            await send({"type": "http.response.body", "body": b"x" * 1000, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    before = asgi.bridge_stats["bytes_copied"]
+    ctx = ExecutionContext()
+    response = await asgi.process_request(app, Request("GET", URL), Env(), ctx)
+    await ctx.drain()
+    assert len(streamed_bytes(response)) == 4000
+    assert asgi.bridge_stats["bytes_copied"] == before + 4000
+
+
+def test_bridge_accepts_memoryview_and_bytearray_bodies():
+    bridge = asgi.BufferBridge()
+    data = bytearray(b"abcdef")
+    chunk = bridge.to_js(memoryview(data)[2:])
+    assert chunk.to_bytes() == b"cdef"
+    response = bridge.response(data, status=200)
+    assert response.body.to_bytes() == b"abcdef"
+    assert bridge.bytes_copied == 10
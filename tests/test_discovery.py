@@ -0,0 +1,58 @@
+import asyncio
+import json
+
+import pytest
+from fixtures import Env, Request
+
+import worker
+from native_runtime import DurableObjectState
+
+URL = "https://example.com"
+
+
+@pytest.fixture
+def server():
+    server = worker.FastMCPServer(DurableObjectState(), Env())
+    yield server
+    server.ctx.storage.sql.close()
+
+
+@pytest.fixture
+def register_echo():
+    """Returns a function registering an extra tool; the tool is removed afterwards"""
+    def register():
+        @worker.register_tool("echo", "Echo the arguments", {"type": "object"})
+        async def echo(ctx, args):
+            return {"content": [{"type": "text", "text": json.dumps(args)}]}, 200
+
+    yield register
+    worker.TOOLS[:] = [tool for tool in worker.TOOLS if tool["name"] != "echo"]
+    worker._TOOL_HANDLERS.pop("echo", None)
+    worker._DISCOVERY_CACHE.clear()
+
+
+def get_tools(server, headers=None):
+    return asyncio.run(server.fetch(Request("GET", f"{URL}/tools", headers=headers)))
+
+
+def tool_names(response) -> list:
+    return [tool["name"] for tool in json.loads(response.body)["tools"]]
+
+
+def test_unchanged_tools_are_revalidated(server):
+    etag = get_tools(server).headers["ETag"]
+    assert get_tools(server, {"If-None-Match": etag}).status == 304
+
+
+def test_tool_registered_later_is_listed_under_a_new_etag(server, register_echo):
+    before = get_tools(server)
+    assert "echo" not in tool_names(before)
+
+    register_echo()
+    response = get_tools(server, {"If-None-Match": before.headers["ETag"]})
+    assert response.status == 200
+    assert "echo" in tool_names(response)
+    assert response.headers["ETag"] != before.headers["ETag"]
+
+    listed = asyncio.run(worker._mcp_tools_list({}, None))
+    assert [tool["name"] for tool in listed["tools"]] == tool_names(response)
@@ -0,0 +1,134 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fixtures import Env, Request
+
+import worker
+from metrics import Registry, merge_expositions
+from native_runtime import DurableObjectState
+from router import HTTPError, RequestContext
+from sharding import ShardRouter
+
+
+def make_registry() -> Registry:
+    registry = Registry()
+    registry.counter("requests_total", "Requests", ("route",)).inc(2, "tools")
+    registry.gauge("in_flight", "In flight").inc()
+
+    @registry.collector
+    def collect(context):
+        yield "sessions", "gauge", "Sessions", [({}, 3), ({"kind": "idle"}, 1)]
+
+    return registry
+
+
+def test_const_labels_are_added_to_every_sample():
+    text = make_registry().render(const_labels={"shard": "shard-1"})
+    assert 'requests_total{shard="shard-1",route="tools"} 2' in text
+    assert 'in_flight{shard="shard-1"} 1' in text
+    assert 'sessions{shard="shard-1"} 3' in text
+    assert 'sessions{shard="shard-1",kind="idle"} 1' in text
+
+
+def test_render_without_const_labels_is_unchanged():
+    text = make_registry().render()
+    assert 'requests_total{route="tools"} 2' in text
+    assert "in_flight 1" in text
+
+
+def test_merged_expositions_declare_each_family_once():
+    registry = make_registry()
+    merged = merge_expositions(
+        registry.render(const_labels={"shard": name}) for name in ("main", "shard-1")
+    )
+    lines = merged.splitlines()
+    assert lines.count("# TYPE requests_total counter") == 1
+    assert lines.count("# HELP sessions Sessions") == 1
+    # Samples of one family stay together, after its HELP and TYPE lines
+    start = lines.index("# TYPE in_flight gauge")
+    expected = ['in_flight{shard="main"} 1', 'in_flight{shard="shard-1"} 1']
+    assert lines[start + 1:start + 3] == expected
+
+
+def test_repeated_series_are_kept_once_with_the_latest_value():
+    first = 'up{isolate="a"} 1\nrequests{shard="main"} 1\n'
+    second = 'up{isolate="a"} 2\nrequests{shard="shard-1"} 1\n'
+    header = "# TYPE up gauge\n"
+    merged = merge_expositions([header + first, header + second])
+    assert merged.splitlines() == [
+        "# TYPE up gauge", 'up{isolate="a"} 2', 'requests{shard="main"} 1',
+        'requests{shard="shard-1"} 1',
+    ]
+
+
+def test_shards_in_one_isolate_do_not_double_count_isolate_metrics():
+    servers = []
+    for name in ("main", "shard-1"):
+        server = worker.FastMCPServer(DurableObjectState(), Env())
+        server.output_store.shard = name
+        servers.append(server)
+    before = worker.compile_cache.stats()["misses"]
+    worker.compile_cache.compile("print('metrics test')")
+
+    texts = [
+        asyncio.run(server.fetch(Request("GET", "https://example.com/metrics"))).body
+        for server in servers
+    ]
+    lines = merge_expositions(texts).splitlines()
+    misses = [line for line in lines if line.startswith("mcp_compile_cache_lookups_total")
+              and 'result="miss"' in line]
+    assert misses == [
+        f'mcp_compile_cache_lookups_total{{isolate="{worker._get_isolate_id()}",result="miss"}}'
+        f" {before + 1}"
+    ]
+    result_cache = [line for line in lines if line.startswith("mcp_result_cache_lookups_total")]
+    assert sum('shard="main"' in line for line in result_cache) == 3
+    assert sum('shard="shard-1"' in line for line in result_cache) == 3
+    for server in servers:
+        server.ctx.storage.sql.close()
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self._text = text
+
+    async def text(self):
+        return self._text
+
+
+def scrape(monkeypatch, query: str):
+    registry = make_registry()
+    scraped = []
+
+    async def forward(stub, shard, request, url=None):
+        scraped.append(shard)
+        return FakeResponse(registry.render(const_labels={"shard": shard}))
+
+    monkeypatch.setattr(worker, "_forward", forward)
+    router = ShardRouter(SimpleNamespace(idFromName=str, get=lambda name: name), 3)
+    request = SimpleNamespace(method="GET", url=f"https://example.com/metrics{query}", headers={})
+    ctx = RequestContext(request, SimpleNamespace(shard_router=router))
+    ctx.route, ctx.params = worker.router.match("GET", "/metrics")
+    response = asyncio.run(worker._shard_middleware(ctx, None))
+    return scraped, response
+
+
+def test_edge_merges_all_shards_when_no_shard_is_given(monkeypatch):
+    scraped, response = scrape(monkeypatch, "")
+    assert sorted(scraped) == ["main", "shard-1", "shard-2"]
+    lines = response.body.splitlines()
+    assert lines.count("# TYPE requests_total counter") == 1
+    assert sum(line.startswith("requests_total{") for line in lines) == 3
+
+
+def test_edge_forwards_to_the_requested_shard(monkeypatch):
+    scraped, response = scrape(monkeypatch, "?shard=shard-2")
+    assert scraped == ["shard-2"]
+    assert 'in_flight{shard="shard-2"} 1' in response._text
+
+
+def test_edge_rejects_an_unknown_shard(monkeypatch):
+    with pytest.raises(HTTPError) as info:
+        scrape(monkeypatch, "?shard=nope")
+    assert info.value.status == 404
@@ -0,0 +1,186 @@
+import asyncio
+import json
+
+import pytest
+
+import native
+import worker
+
+
+async def call(app, method, path, body=b"", chunks=None, disconnect_after=None):
+    """Drive app with one HTTP request; returns (status, headers, body, body messages).
+
+    After the request body the client stays connected until disconnect_after
+    response messages have been sent, then reports http.disconnect.
+    """
+    scope = {
+        "type": "http", "method": method, "path": path, "raw_path": path.encode(),
+        "query_string": b"", "headers": [(b"host", b"local:8000")], "scheme": "http",
+        "server": ("127.0.0.1", 8000),
+    }
+    parts = chunks if chunks is not None else [body]
+    incoming = [
+        {"type": "http.request", "body": part, "more_body": index < len(parts) - 1}
+        for index, part in enumerate(parts)
+    ]
+    disconnected = asyncio.Event()
+    sent = []
+
+    async def receive():
+        if incoming:
+            return incoming.pop(0)
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+        if disconnect_after is not None and len(sent) >= disconnect_after:
+            disconnected.set()
+
+    await asyncio.wait_for(app(scope, receive, send), 5)
+    start, messages = sent[0], sent[1:]
+    data = b"".join(message.get("body", b"") for message in messages)
+    return start["status"], dict(start["headers"]), data, messages
+
+
+class FakeServer:
+    """Stands in for FastMCPServer; fetch returns the given response"""
+
+    def __init__(self, response):
+        self.response = response
+        self.requests = []
+
+    async def fetch(self, request):
+        self.requests.append(request)
+        return self.response
+
+
+def app_with(response, max_body_bytes=native.DEFAULT_MAX_BODY_BYTES):
+    app = native.NativeApp(":memory:")
+    app._server = FakeServer(response)
+    app._max_body_bytes = max_body_bytes
+    return app
+
+
+@pytest.mark.asyncio
+async def test_plain_response_has_content_length():
+    app = app_with(worker.Response("hello", headers={"Content-Type": "text/plain"}))
+    status, headers, data, messages = await call(app, "GET", "/")
+    assert status == 200
+    assert headers[b"content-length"] == b"5"
+    assert headers[b"content-type"] == b"text/plain"
+    assert data == b"hello"
+    assert len(messages) == 1
+
+
+@pytest.mark.asyncio
+async def test_streaming_response_sends_each_chunk():
+    async def body():
+        yield "first\n"
+        yield b""
+        yield b"second\n"
+
+    app = app_with(worker.Response(body(), headers={"Content-Type": "text/event-stream"}))
+    status, headers, data, messages = await call(app, "GET", "/")
+    assert status == 200
+    assert b"content-length" not in headers
+    assert [message["body"] for message in messages] == [b"first\n", b"second\n", b""]
+    assert [message.get("more_body", False) for message in messages] == [True, True, False]
+    assert data == b"first\nsecond\n"
+
+
+@pytest.mark.asyncio
+async def test_client_disconnect_cancels_an_endless_stream():
+    closed = asyncio.Event()
+
+    async def body():
+        try:
+            while True:
+                yield b"tick\n"
+                await asyncio.sleep(0.001)
+        finally:
+            closed.set()
+
+    app = app_with(worker.Response(body()))
+    status, _, data, _ = await call(app, "GET", "/", disconnect_after=4)
+    assert status == 200
+    assert data.startswith(b"tick\n")
+    assert closed.is_set()
+
+
+@pytest.mark.asyncio
+async def test_body_over_the_limit_is_rejected():
+    app = app_with(worker.Response("unused"), max_body_bytes=10)
+    status, _, data, _ = await call(app, "POST", "/tools/call", chunks=[b"x" * 6, b"x" * 6, b"x"])
+    assert status == 413
+    assert json.loads(data) == {"error": "Request body too large"}
+    assert app._server.requests == []
+
+
+@pytest.mark.asyncio
+async def test_chunked_body_within_the_limit_is_joined():
+    app = app_with(worker.Response("ok"), max_body_bytes=10)
+    status, _, _, _ = await call(app, "POST", "/", chunks=[b'{"a"', b": 1}"])
+    assert status == 200
+    (request,) = app._server.requests
+    assert await request.json() == {"a": 1}
+    assert request.url == "http://local:8000/"
+
+
+@pytest.mark.asyncio
+async def test_disconnect_while_reading_the_body_sends_nothing():
+    app = app_with(worker.Response("unused"))
+    sent = []
+    scope = {"type": "http", "method": "POST", "path": "/", "headers": []}
+    incoming = [{"type": "http.request", "body": b"{", "more_body": True},
+                {"type": "http.disconnect"}]
+
+    async def receive():
+        return incoming.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    assert sent == []
+    assert app._server.requests == []
+
+
+@pytest.mark.asyncio
+async def test_max_body_bytes_comes_from_the_environment(monkeypatch):
+    monkeypatch.setenv("NATIVE_MAX_BODY_BYTES", "8")
+    app = native.NativeApp(":memory:")
+    status, _, _, _ = await call(app, "POST", "/tools/call", b"x" * 9)
+    assert status == 413
+    assert app._max_body_bytes == 8
+    app._server.ctx.storage.sql.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_execute_end_to_end():
+    app = native.NativeApp(":memory:")
+    body = json.dumps({"code": "for i in range(3): print(i)"}).encode()
+    status, headers, data, messages = await call(app, "POST", "/stream/execute", body)
+    assert status == 200
+    assert headers[b"content-type"] == b"application/x-ndjson"
+    assert len(messages) > 1
+    text = data.decode()
+    assert all(str(i) in text for i in range(3))
+    app._server.ctx.storage.sql.close()
+
+
+@pytest.mark.asyncio
+async def test_lifespan_starts_and_closes_the_server():
+    app = native.NativeApp(":memory:")
+    incoming = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+    sent = []
+
+    async def receive():
+        return incoming.pop(0)
+
+    async def send(message):
+        sent.append(message["type"])
+
+    await app({"type": "lifespan"}, receive, send)
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert app._server is not None
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from native_runtime import SqlStorage
+from output import BoundedCapture, OutputStore
+
+
+@pytest.fixture
+def sql():
+    storage = SqlStorage()
+    yield storage
+    storage.close()
+
+
+def count_pages(sql) -> int:
+    return sql.exec("SELECT COUNT(*) AS n FROM output_pages").toArray()[0].n
+
+
+def test_handle_is_created_on_first_spill(sql):
+    store = OutputStore(sql)
+    spill = store.spill()
+    capture = BoundedCapture(inline_limit=10, spill=spill.writer("stdout"), page_size=4)
+    capture.write("short")
+    assert spill.handle is None
+
+    capture.write("x" * 20)
+    capture.finish()
+    assert spill.handle is not None
+    first = store.read(spill.handle, "stdout", 0)
+    assert first["content"] == "xxxx"
+    assert first["next_cursor"] == 1
+
+
+def test_stdout_and_stderr_share_one_handle(sql):
+    store = OutputStore(sql)
+    spill = store.spill()
+    spill.writer("stdout")(0, "out")
+    spill.writer("stderr")(0, "err")
+    assert store.read(spill.handle, "stdout", 0)["content"] == "out"
+    assert store.read(spill.handle, "stderr", 0)["content"] == "err"
+
+
+def test_expired_pages_are_swept_at_most_once_per_interval(sql):
+    store = OutputStore(sql, ttl=0.01, sweep_interval=3600)
+    # The first handle sweeps and starts the interval
+    store.spill().writer("stdout")(0, "old")
+    time.sleep(0.02)
+
+    store.ttl = 3600
+    store.spill().writer("stdout")(0, "new")
+    assert count_pages(sql) == 2
+
+    store._next_sweep = 0.0
+    store.spill().writer("stdout")(0, "newer")
+    assert count_pages(sql) == 2
+    assert sql.exec("SELECT content FROM output_pages WHERE content = 'old'").toArray() == []
+
+
+def test_expired_pages_are_not_readable(sql):
+    store = OutputStore(sql, ttl=0.01)
+    spill = store.spill()
+    spill.writer("stdout")(0, "gone")
+    time.sleep(0.02)
+    assert store.read(spill.handle, "stdout", 0) is None
+
+
+def test_handle_carries_the_shard_name(sql):
+    store = OutputStore(sql)
+    store.shard = "shard-2"
+    assert store.new_handle().startswith("shard-2~")
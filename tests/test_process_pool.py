@@ -0,0 +1,134 @@
+import io
+import textwrap
+
+import pytest
+
+import process_pool
+import worker
+from process_pool import ExecutionProcessError, ProcessPool, RemoteError
+
+# Handler run by the pool processes in place of worker:_pool_job. The code
+# string selects what the job does.
+HANDLER = '''
+import os
+import time
+
+
+def job(code, time_budget_ms, stdout, stderr):
+    if code == "crash":
+        os._exit(3)
+    if code == "hang":
+        time.sleep(60)
+    if code == "raise":
+        return ("ValueError", "bad input", "Traceback: ..."), 1.0, 1.0, False
+    stdout.write(f"{os.getpid()}\\n")
+    return None, 1.0, 1.0, False
+'''
+
+
+@pytest.fixture
+def handler(tmp_path, monkeypatch):
+    """Make the pool processes import the test handler; returns its name"""
+    (tmp_path / "pool_handler.py").write_text(textwrap.dedent(HANDLER))
+    monkeypatch.setenv("PYTHONPATH", str(tmp_path))
+    return "pool_handler:job"
+
+
+async def run(pool, code, limit_ms=1000):
+    """Run code in the pool; returns the stdout text, which is the process id for plain jobs"""
+    out = io.StringIO()
+    await pool.run(code, out, out, worker.TimeBudget(limit_ms))
+    return out.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_process_is_recycled_after_max_jobs(handler):
+    pool = ProcessPool(handler, size=1, max_jobs=2)
+    pool.start()
+    try:
+        pids = [await run(pool, "pid") for _ in range(3)]
+        assert pids[0] == pids[1]
+        assert pids[2] != pids[1]
+        assert pool.stats()["recycled"] == 1
+        assert pool.stats()["jobs"] == 3
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_process_past_its_budget_is_killed_and_replaced(handler, monkeypatch):
+    monkeypatch.setattr(process_pool, "KILL_GRACE_MS", 50)
+    pool = ProcessPool(handler, size=1)
+    pool.start()
+    try:
+        before = await run(pool, "pid")
+        budget = worker.TimeBudget(50)
+        with pytest.raises(TimeoutError, match="time budget of 50 ms"):
+            await pool.run("hang", io.StringIO(), io.StringIO(), budget)
+        assert budget.exceeded
+        assert budget.used_ms >= 100
+        assert pool.stats()["killed"] == 1
+
+        after = await run(pool, "pid")
+        assert after != before
+        assert pool.stats()["live"] == 1
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_crashed_process_is_replaced(handler):
+    pool = ProcessPool(handler, size=1)
+    pool.start()
+    try:
+        before = await run(pool, "pid")
+        with pytest.raises(ExecutionProcessError, match="status 3"):
+            await run(pool, "crash")
+        assert pool.stats()["crashed"] == 1
+
+        after = await run(pool, "pid")
+        assert after != before
+        assert pool.stats()["live"] == 1
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_error_in_the_code_keeps_the_process(handler):
+    pool = ProcessPool(handler, size=1)
+    pool.start()
+    try:
+        before = await run(pool, "pid")
+        with pytest.raises(RemoteError, match="bad input") as excinfo:
+            await run(pool, "raise")
+        assert excinfo.value.type_name == "ValueError"
+        assert await run(pool, "pid") == before
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_closed_pool_rejects_work(handler):
+    pool = ProcessPool(handler, size=1)
+    pool.start()
+    await pool.close()
+    assert pool.stats()["live"] == 0
+    with pytest.raises(RuntimeError, match="closed"):
+        await run(pool, "pid")
+
+
+@pytest.mark.asyncio
+async def test_execute_python_code_in_the_pool():
+    env = type("Env", (), {"EXEC_BACKEND": "process", "EXEC_POOL_SIZE": "1"})()
+    executor = worker._get_executor(env)
+    try:
+        result = await worker.execute_python_code("print(6 * 7)", executor=executor)
+        assert result["stdout"] == "42\n"
+
+        result = await worker.execute_python_code(
+            "while True: pass", time_budget_ms=50, executor=executor
+        )
+        assert result["error"].startswith("TimeoutError")
+        assert executor.stats()["killed"] == 0
+    finally:
+        await worker.close_executor()
@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+from native_runtime import SqlStorage
+from result_cache import ResultCache
+
+
+def make_result(stdout="", stderr="", error=None):
+    return {"stdout": stdout, "stderr": stderr, "error": error}
+
+
+@pytest.fixture
+def cache():
+    sql = SqlStorage()
+    yield ResultCache(sql)
+    sql.close()
+
+
+def test_replacing_an_entry_does_not_double_count_its_size(cache):
+    cache.put("key", make_result(stdout="x" * 100))
+    cache.put("key", make_result(stdout="y" * 40))
+    assert cache.stats()["stored_bytes"] == 40
+    assert cache._stored_bytes() == 40
+
+
+def test_non_positive_ttl_is_not_stored(cache):
+    cache.put("expired", make_result(stdout="out"), ttl=-5)
+    cache.put("zero", make_result(stdout="out"), ttl=0)
+    assert cache.get("expired") is None
+    assert cache.get("zero") is None
+    assert cache.stats()["stored_bytes"] == 0
+
+
+def test_entry_expires_after_ttl(cache):
+    cache.put("short", make_result(stdout="out"), ttl=0.05)
+    assert cache.get("short")["stdout"] == "out"
+    time.sleep(0.1)
+    assert cache.get("short") is None
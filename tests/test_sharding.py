@@ -0,0 +1,133 @@
+import asyncio
+import json
+
+import pytest
+
+import worker
+from result_cache import ResultCache
+from router import RequestContext
+from sharding import ShardRouter
+
+
+class FakeNamespace:
+    """Durable Object namespace that counts the stubs it creates."""
+
+    def __init__(self):
+        self.created = []
+
+    def idFromName(self, name):  # noqa: N802
+        return name
+
+    def get(self, object_id):
+        stub = object()
+        self.created.append((object_id, stub))
+        return stub
+
+
+class FakeRequest:
+    """Request whose body can be read from a clone, like the runtime's Request."""
+
+    def __init__(self, method, url, body="", headers=None):
+        self.method = method
+        self.url = url
+        self.headers = headers or {}
+        self._body = body
+
+    def clone(self):
+        return self
+
+    async def text(self):
+        return self._body
+
+
+def routing_key(method, path, body="", headers=None):
+    request = FakeRequest(method, f"https://example.com{path}", body, headers)
+    ctx = RequestContext(request, None)
+    ctx.route, ctx.params = worker.router.match(method, path)
+    return asyncio.run(worker._routing_key(ctx))
+
+
+def test_keys_map_to_stable_shards():
+    keys = [f"session-{i}" for i in range(200)]
+    first = ShardRouter(FakeNamespace(), 4)
+    second = ShardRouter(FakeNamespace(), 4)
+    assert [first.shard_for_key(key) for key in keys] == [second.shard_for_key(key) for key in keys]
+    assert {first.shard_for_key(key) for key in keys} == set(first.shard_names)
+
+
+def test_adding_a_shard_moves_few_keys():
+    keys = [f"session-{i}" for i in range(1000)]
+    before = ShardRouter(FakeNamespace(), 4)
+    after = ShardRouter(FakeNamespace(), 5)
+    moved = sum(before.shard_for_key(key) != after.shard_for_key(key) for key in keys)
+    # Ideally about a fifth of the keys move to the new shard
+    assert moved < len(keys) * 0.35
+    assert all(
+        after.shard_for_key(key) == "shard-4"
+        for key in keys
+        if before.shard_for_key(key) != after.shard_for_key(key)
+    )
+
+
+def test_unkeyed_requests_go_to_the_least_recently_used_shard():
+    router = ShardRouter(FakeNamespace(), 3)
+    chosen = [router.route()[0] for _ in range(6)]
+    assert chosen == ["main", "shard-1", "shard-2"] * 2
+
+    router.route_to("main")
+    assert router.least_recently_used() == "shard-1"
+
+
+def test_stubs_are_reused():
+    namespace = FakeNamespace()
+    router = ShardRouter(namespace, 2)
+    stubs = {router.route("key")[1] for _ in range(5)}
+    assert len(stubs) == 1
+    assert len(namespace.created) == 1
+
+
+def test_shard_count_must_be_positive():
+    with pytest.raises(ValueError):
+        ShardRouter(FakeNamespace(), 0)
+
+
+def test_cacheable_calls_route_by_cache_key():
+    code = "print(sum(range(10)))"
+    arguments = {"code": code, "deterministic": True}
+    body = json.dumps({"name": "execute_python", "arguments": arguments})
+    headers = {"mcp-session-id": "client"}
+    assert routing_key("POST", "/tools/call", body, headers) == ResultCache.make_key(code)
+
+    message = (
+        '{"jsonrpc": "2.0", "id": 1, "method": "tools/call", "params": {"name": "execute_python",'
+        ' "arguments": {"code": "print(1)", "cache_key": "v1"}}}'
+    )
+    assert routing_key("POST", "/mcp", message, headers) == ResultCache.make_key("print(1)", "v1")
+
+
+def test_uncacheable_calls_fall_back_to_headers():
+    body = '{"name": "execute_python", "arguments": {"code": "print(1)"}}'
+    assert routing_key("POST", "/tools/call", body, {"x-client-id": "client"}) == "client"
+    assert routing_key("POST", "/tools/call", "not json") is None
+
+
+def test_session_calls_route_to_the_session_shard():
+    arguments = {"code": "print(x)", "session_id": "abc", "deterministic": True}
+    body = json.dumps({"name": "execute_python", "arguments": arguments})
+    assert routing_key("POST", "/tools/call", body, {"mcp-session-id": "client"}) == "abc"
+
+    message = json.dumps([
+        {"jsonrpc": "2.0", "method": "notifications/initialized"},
+        {"jsonrpc": "2.0", "id": 1, "method": "tools/call",
+         "params": {"name": "execute_python", "arguments": {"code": "1", "session_id": "abc"}}},
+    ])
+    assert routing_key("POST", "/mcp", message) == "abc"
+
+    # Requests on a session path route by the path parameter
+    assert routing_key("POST", "/sessions/abc/reset") == "abc"
+
+
+def test_session_key_matches_the_shard_the_session_was_created_on():
+    router = ShardRouter(FakeNamespace(), 4)
+    created_on, _ = router.route("abc")
+    assert router.route(routing_key("POST", "/sessions/abc/reset"))[0] == created_on
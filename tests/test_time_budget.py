@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+import worker
+from router import HTTPError
+from worker import TimeBudget
+
+
+@pytest.fixture(params=[True, False], ids=["watchdog", "in-band"])
+def threads_available(request, monkeypatch):
+    """Run each test with the watchdog thread and with the Pyodide in-band check."""
+    monkeypatch.setattr(worker, "_THREADS_AVAILABLE", request.param)
+    return request.param
+
+
+def run_snippet(source: str, limit_ms: int = 100) -> tuple[TimeBudget, float]:
+    budget = TimeBudget(limit_ms)
+    started = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        budget.run(exec, compile(source, "<string>", "exec"), {})
+    return budget, time.perf_counter() - started
+
+
+def test_infinite_loop_is_stopped(threads_available):
+    budget, elapsed = run_snippet("while True:\n    pass\n")
+    assert budget.exceeded
+    assert 0.1 <= elapsed < 2
+    assert budget.report()["used_ms"] >= 100
+
+
+def test_catching_the_timeout_does_not_escape_the_budget(threads_available):
+    source = (
+        "try:\n"
+        "    while True:\n"
+        "        pass\n"
+        "except TimeoutError:\n"
+        "    pass\n"
+        "while True:\n"
+        "    try:\n"
+        "        while True:\n"
+        "            pass\n"
+        "    except BaseException:\n"
+        "        continue\n"
+    )
+    budget, elapsed = run_snippet(source)
+    assert budget.exceeded
+    assert elapsed < 2
+
+
+def test_infinite_recursion_with_a_handler_is_stopped(threads_available):
+    source = (
+        "def spin():\n"
+        "    try:\n"
+        "        while True:\n"
+        "            pass\n"
+        "    except BaseException:\n"
+        "        return spin()\n"
+        "spin()\n"
+    )
+    _, elapsed = run_snippet(source)
+    assert elapsed < 2
+
+
+def test_budget_is_disarmed_after_the_run(threads_available):
+    run_snippet("while True:\n    pass\n", limit_ms=50)
+    # Loops and calls in this thread run unchecked once the budget has ended
+    total = 0
+    for i in range(100_000):
+        total += abs(i)
+    assert worker._active_budgets == {}
+    assert worker._monitored_budgets == 0
+
+
+def test_code_within_the_budget_runs_normally(threads_available):
+    budget = TimeBudget(1000)
+    namespace = {}
+    budget.run(exec, compile("total = sum(i for i in range(1000))", "<string>", "exec"), namespace)
+    assert namespace["total"] == 499500
+    assert not budget.exceeded
+
+
+@pytest.mark.parametrize(("requested", "expected"), [
+    (None, worker.DEFAULT_TIME_BUDGET_MS),
+    (250, 250),
+    ("250", 250),
+    (-5, 1),
+    (10**9, worker.MAX_TIME_BUDGET_MS),
+])
+def test_time_budget_ms_is_clamped(requested, expected):
+    assert worker._time_budget_ms(requested, None) == expected
+
+
+@pytest.mark.parametrize("requested", ["abc", [1], float("inf")])
+def test_invalid_time_budget_ms_is_rejected(requested):
+    with pytest.raises(HTTPError) as info:
+        worker._time_budget_ms(requested, None)
+    assert info.value.status == 400
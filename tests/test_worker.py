@@ -1,4 +1,5 @@
 import os
+import re
 import signal
 import socket
 import subprocess
@@ -84,8 +85,9 @@ def test_list_tools(web_server):
     assert response.status_code == 200
     data = response.json()
     assert "tools" in data
-    assert len(data["tools"]) == 1
-    assert data["tools"][0]["name"] == "execute_python"
+    names = [tool["name"] for tool in data["tools"]]
+    assert names[0] == "execute_python"
+    assert "execute_python_batch" in names
 
 
 def test_execute_python_simple(web_server):
@@ -211,4 +213,458 @@ def test_persistent_stream_endpoint(web_server):
         pass  # 预期的超时
     
     assert len(lines) >= 1
-    assert lines[0]["type"] == "connection_established"
\ No newline at end of file
+    assert lines[0]["type"] == "connection_established"
+
+def test_stream_endpoint_emits_output_chunks(web_server):
+    """Test that /stream forwards stdout chunks as separate SSE events."""
+    payload = {"code": "for i in range(3):\n    print(f'chunk {i}')"}
+
+    response = requests.post(f"{web_server.base_url}/stream", json=payload, stream=True)
+    assert response.status_code == 200
+    assert response.headers.get("content-type").startswith("text/event-stream")
+
+    events = []
+    for line in response.iter_lines():
+        if line.startswith(b"data: "):
+            events.append(json.loads(line[len(b"data: "):].decode("utf-8")))
+
+    types = [event["type"] for event in events]
+    assert types[0] == "start"
+    assert types[-1] == "end"
+    stdout = "".join(event["content"] for event in events if event["type"] == "stdout")
+    assert stdout == "chunk 0\nchunk 1\nchunk 2\n"
+    assert types.index("success") > types.index("stdout")
+
+
+def test_stream_coalesces_output_events(web_server):
+    """Test that tight print loops are coalesced and the thresholds are per request."""
+    code = "for i in range(200):\n    print(i)"
+    expected = "".join(f"{i}\n" for i in range(200))
+
+    def stdout_events(**options):
+        response = requests.post(f"{web_server.base_url}/stream", json={"code": code, **options})
+        events = [
+            json.loads(line[len(b"data: "):].decode("utf-8"))
+            for line in response.iter_lines()
+            if line.startswith(b"data: ")
+        ]
+        return [event["content"] for event in events if event["type"] == "stdout"]
+
+    coalesced = stdout_events()
+    unbuffered = stdout_events(flush_bytes=1, flush_interval_ms=0)
+    assert "".join(coalesced) == "".join(unbuffered) == expected
+    assert len(coalesced) < 200 < len(unbuffered)
+
+
+def test_compile_cache_stats(web_server):
+    """Test that repeated snippets are served from the compile cache."""
+    payload = {"name": "execute_python", "arguments": {"code": "print('cached snippet')"}}
+
+    before = requests.get(f"{web_server.base_url}/stats").json()["compile_cache"]
+    for _ in range(2):
+        response = requests.post(f"{web_server.base_url}/tools/call", json=payload)
+        assert response.status_code == 200
+    after = requests.get(f"{web_server.base_url}/stats").json()["compile_cache"]
+
+    assert after["hits"] > before["hits"]
+    assert {"misses", "evictions", "negative_hits"} <= set(after)
+
+
+def test_routing_errors_and_route_timings(web_server):
+    """Test that errors are mapped to JSON responses and routes are timed."""
+    response = requests.post(f"{web_server.base_url}/tools/call", data="not json")
+    assert response.status_code == 400
+    assert response.json()["error"] == "Invalid JSON body"
+
+    response = requests.get(f"{web_server.base_url}/no/such/route")
+    assert response.status_code == 404
+    assert response.json()["error"] == "Not found"
+
+    # Pin both requests to one shard so the second one sees the first one timed
+    headers = {"x-client-id": "route-timings"}
+    requests.get(f"{web_server.base_url}/stats", headers=headers)
+    routes = requests.get(f"{web_server.base_url}/stats", headers=headers).json()["routes"]
+    assert routes["stats"]["count"] >= 1
+    assert {"errors", "mean_ms", "max_ms"} <= set(routes["stats"])
+
+
+def test_deterministic_result_cache(web_server):
+    """Test that deterministic calls are served from the result cache on repeat."""
+    payload = {
+        "name": "execute_python",
+        "arguments": {"code": "print(sum(range(10)))", "deterministic": True},
+    }
+
+    first = requests.post(f"{web_server.base_url}/tools/call", json=payload).json()
+    second = requests.post(f"{web_server.base_url}/tools/call", json=payload).json()
+
+    assert "45" in first["content"][0]["text"]
+    assert second["content"] == first["content"]
+    assert second["cached"] is True
+
+
+def test_invalid_cache_ttl_is_rejected(web_server):
+    """Test that a non-numeric or non-positive cache_ttl is a client error."""
+    for ttl in ("abc", -10, 0):
+        payload = {
+            "name": "execute_python",
+            "arguments": {"code": "print(1)", "deterministic": True, "cache_ttl": ttl},
+        }
+        response = requests.post(f"{web_server.base_url}/tools/call", json=payload)
+        assert response.status_code == 400
+
+
+def test_non_string_code_is_rejected(web_server):
+    """Test that code that is not a string is a client error, also for cacheable calls."""
+    for arguments in ({"code": 5}, {"code": ["print(1)"], "deterministic": True}):
+        payload = {"name": "execute_python", "arguments": arguments}
+        response = requests.post(f"{web_server.base_url}/tools/call", json=payload)
+        assert response.status_code == 400
+        assert response.json()["content"][0]["text"] == "Error: code must be a string"
+
+
+def test_session_lifecycle(web_server):
+    """Test that a session keeps its namespace between calls until reset or deleted."""
+    response = requests.post(f"{web_server.base_url}/sessions")
+    assert response.status_code == 201
+    session_id = response.json()["session_id"]
+
+    def run(code):
+        payload = {"name": "execute_python", "arguments": {"code": code, "session_id": session_id}}
+        return requests.post(f"{web_server.base_url}/tools/call", json=payload)
+
+    assert run("table = [i * i for i in range(5)]").status_code == 200
+    assert "30" in run("print(sum(table))").json()["content"][0]["text"]
+
+    response = requests.post(f"{web_server.base_url}/sessions/{session_id}/reset")
+    assert response.status_code == 200
+    assert "NameError" in run("print(table)").json()["content"][0]["text"]
+
+    response = requests.delete(f"{web_server.base_url}/sessions/{session_id}")
+    assert response.status_code == 200
+    assert run("print(1)").status_code == 404
+
+
+def test_execution_time_budget(web_server):
+    """Test that a runaway loop is aborted with a TimeoutError and keeps partial output."""
+    payload = {
+        "name": "execute_python",
+        "arguments": {"code": "print('before loop')\nwhile True:\n    pass", "timeout_ms": 200},
+    }
+
+    response = requests.post(f"{web_server.base_url}/tools/call", json=payload)
+    assert response.status_code == 200
+    data = response.json()
+    text = data["content"][0]["text"]
+    assert "before loop" in text
+    assert "TimeoutError" in text
+    assert data["budget"]["exceeded"] is True
+    assert data["budget"]["limit_ms"] == 200
+
+
+def test_large_output_is_paged(web_server):
+    """Test that output beyond the inline limit is spilled and can be read page by page."""
+    payload = {
+        "name": "execute_python",
+        "arguments": {"code": "for i in range(20000):\n    print(i)", "output_limit": 1000},
+    }
+
+    data = requests.post(f"{web_server.base_url}/tools/call", json=payload).json()
+    output = data["output"]
+    assert output["stdout"]["inline_chars"] == 1000
+    assert output["handle"]
+
+    spilled = ""
+    cursor = 0
+    while cursor is not None:
+        page = requests.get(
+            f"{web_server.base_url}/output/{output['handle']}",
+            params={"stream": "stdout", "cursor": cursor},
+        ).json()
+        spilled += page["content"]
+        cursor = page["next_cursor"]
+
+    expected = "".join(f"{i}\n" for i in range(20000))
+    assert spilled == expected[1000:]
+
+
+def test_invalid_output_limit_is_rejected(web_server):
+    """Test that a non-integer output_limit is a client error and a negative one is raised to 1."""
+    payload = {"name": "execute_python", "arguments": {"code": "print(1)", "output_limit": "abc"}}
+    response = requests.post(f"{web_server.base_url}/tools/call", json=payload)
+    assert response.status_code == 400
+    assert response.json()["error"] == "output_limit must be a positive integer"
+
+    payload = {"name": "execute_python", "arguments": {"code": "print(12)", "output_limit": -5}}
+    data = requests.post(f"{web_server.base_url}/tools/call", json=payload).json()
+    assert data["output"]["stdout"]["inline_chars"] == 1
+
+    payload = {"items": [{"code": "print(1)"}, {"code": "print(2)", "output_limit": "abc"}]}
+    response = requests.post(f"{web_server.base_url}/tools/batch", json=payload)
+    assert response.status_code == 400
+    assert response.json()["error"] == "items[1]: output_limit must be a positive integer"
+
+
+def test_batch_endpoint(web_server):
+    """Test that a batch runs every item in its own namespace and budget."""
+    payload = {
+        "items": [
+            {"id": "first", "code": "value = 21\nprint(value * 2)"},
+            {"id": "isolated", "code": "print(value)"},
+            {"id": "runaway", "code": "while True:\n    pass", "timeout_ms": 100},
+        ]
+    }
+
+    response = requests.post(f"{web_server.base_url}/tools/batch", json=payload)
+    assert response.status_code == 200
+    results = {result["id"]: result for result in response.json()["results"]}
+
+    assert results["first"]["stdout"] == "42\n"
+    assert "NameError" in results["isolated"]["error"]
+    assert results["runaway"]["budget"]["exceeded"] is True
+
+
+def test_non_object_arguments_are_rejected(web_server):
+    """Test that tool arguments and batch items that are not objects are client errors."""
+    for arguments in (["print(1)"], "print(1)"):
+        payload = {"name": "execute_python", "arguments": arguments}
+        response = requests.post(f"{web_server.base_url}/tools/call", json=payload)
+        assert response.status_code == 400
+        assert response.json()["error"] == "arguments must be an object"
+
+    payload = {"items": [{"code": "print(1)"}, "print(2)"]}
+    response = requests.post(f"{web_server.base_url}/tools/batch", json=payload)
+    assert response.status_code == 400
+    assert response.json()["error"] == "every item must be an object"
+
+
+def test_batch_endpoint_streaming(web_server):
+    """Test that streamed batch results arrive as one SSE event per item."""
+    payload = {"items": [{"code": f"print({i})"} for i in range(3)], "stream": True}
+
+    response = requests.post(f"{web_server.base_url}/tools/batch", json=payload, stream=True)
+    assert response.status_code == 200
+
+    events = [
+        json.loads(line[len(b"data: "):].decode("utf-8"))
+        for line in response.iter_lines()
+        if line.startswith(b"data: ")
+    ]
+    assert [event["index"] for event in events if event["type"] == "item"] == [0, 1, 2]
+    assert events[-1] == {**events[-1], "type": "end", "count": 3}
+
+
+def test_discovery_endpoints_are_cacheable(web_server):
+    """Test that / and /tools carry an ETag and answer 304 when it matches."""
+    for path in ("/", "/tools"):
+        response = requests.get(f"{web_server.base_url}{path}")
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        assert "max-age" in response.headers["Cache-Control"]
+
+        cached = requests.get(f"{web_server.base_url}{path}", headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+        assert cached.content == b""
+
+
+def test_mcp_jsonrpc_endpoint(web_server):
+    """Test initialize, tools/list and tools/call over the JSON-RPC endpoint."""
+    url = f"{web_server.base_url}/mcp"
+    response = requests.post(url, json={
+        "jsonrpc": "2.0", "id": 1, "method": "initialize",
+        "params": {"protocolVersion": "2025-03-26", "capabilities": {},
+                   "clientInfo": {"name": "test", "version": "0"}},
+    })
+    assert response.status_code == 200
+    assert response.json()["result"]["protocolVersion"] == "2025-03-26"
+    headers = {"Mcp-Session-Id": response.headers["Mcp-Session-Id"]}
+
+    response = requests.post(url, json={"jsonrpc": "2.0", "method": "notifications/initialized"},
+                             headers=headers)
+    assert response.status_code == 202
+
+    response = requests.post(
+        url, json={"jsonrpc": "2.0", "id": 2, "method": "tools/list"}, headers=headers
+    )
+    assert "execute_python" in [tool["name"] for tool in response.json()["result"]["tools"]]
+
+    response = requests.post(
+        url, json={"jsonrpc": "2.0", "id": 3, "method": "no/such/method"}, headers=headers
+    )
+    assert response.json()["error"]["code"] == -32601
+
+
+def test_mcp_tools_call_with_invalid_arguments(web_server):
+    """Test that a tool rejecting its arguments gets invalid params, without a traceback."""
+    for arguments in ({"code": "print(1)", "timeout_ms": "x"}, {"code": "print(1)", "profile": 5}):
+        response = requests.post(f"{web_server.base_url}/mcp", json={
+            "jsonrpc": "2.0", "id": 1, "method": "tools/call",
+            "params": {"name": "execute_python", "arguments": arguments},
+        })
+        assert response.status_code == 200
+        error = response.json()["error"]
+        assert error["code"] == -32602
+        assert "data" not in error
+
+
+def test_mcp_jsonrpc_batch_streams_responses(web_server):
+    """Test that a JSON-RPC batch is answered with one SSE event per call."""
+    batch = [
+        {"jsonrpc": "2.0", "id": i, "method": "tools/call",
+         "params": {"name": "execute_python", "arguments": {"code": f"print({i} * 7)"}}}
+        for i in range(3)
+    ]
+    headers = {"Accept": "application/json, text/event-stream"}
+
+    response = requests.post(f"{web_server.base_url}/mcp", json=batch, headers=headers, stream=True)
+    assert response.status_code == 200
+    assert response.headers.get("content-type").startswith("text/event-stream")
+
+    messages = [
+        json.loads(line[len(b"data: "):].decode("utf-8"))
+        for line in response.iter_lines()
+        if line.startswith(b"data: ")
+    ]
+    assert sorted(message["id"] for message in messages) == [0, 1, 2]
+    for message in messages:
+        assert str(message["id"] * 7) in message["result"]["content"][0]["text"]
+        assert message["result"]["isError"] is False
+
+    response = requests.post(f"{web_server.base_url}/mcp", json=batch)
+    assert sorted(message["id"] for message in response.json()) == [0, 1, 2]
+
+
+def test_websocket_endpoint_requires_upgrade(web_server):
+    """Test that /ws rejects plain HTTP requests."""
+    response = requests.get(f"{web_server.base_url}/ws")
+    assert response.status_code == 426
+
+
+def test_large_results_are_gzip_compressed(web_server):
+    """Test that large JSON results are gzip encoded when the client accepts it."""
+    def call(code, encoding):
+        payload = {"name": "execute_python", "arguments": {"code": code}}
+        return requests.post(f"{web_server.base_url}/tools/call", json=payload,
+                             headers={"Accept-Encoding": encoding})
+
+    response = call("print('row,' * 20000)", "gzip")
+    assert response.headers.get("Content-Encoding") == "gzip"
+    assert "row," * 100 in response.json()["content"][0]["text"]
+
+    assert "Content-Encoding" not in call("print(1)", "gzip").headers
+    assert "Content-Encoding" not in call("print('row,' * 20000)", "identity").headers
+
+
+def test_stream_format_follows_accept_header(web_server):
+    """Test that streaming endpoints pick SSE or NDJSON from the Accept header."""
+    payload = {"code": "print('negotiated')"}
+
+    response = requests.post(f"{web_server.base_url}/stream", json=payload,
+                             headers={"Accept": "application/x-ndjson"}, stream=True)
+    assert response.headers.get("content-type") == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.iter_lines() if line]
+    assert lines[0]["type"] == "execution_start"
+    assert lines[-1]["type"] == "execution_complete"
+
+    response = requests.post(f"{web_server.base_url}/stream/execute", json=payload,
+                             headers={"Accept": "text/event-stream"}, stream=True)
+    assert response.headers.get("content-type").startswith("text/event-stream")
+    events = [
+        json.loads(line[len(b"data: "):])
+        for line in response.iter_lines()
+        if line.startswith(b"data: ")
+    ]
+    assert any(event["type"] == "stdout" and "negotiated" in event["content"] for event in events)
+
+    response = requests.post(f"{web_server.base_url}/stream/execute",
+                             json={**payload, "format": "xml"})
+    assert response.status_code == 400
+
+
+def test_persistent_stream_multiplexes_submissions(web_server):
+    """Test that executions submitted to a channel arrive on its persistent stream."""
+    response = requests.get(f"{web_server.base_url}/stream/persistent", stream=True, timeout=10)
+    assert response.status_code == 200
+    lines = response.iter_lines()
+    established = json.loads(next(line for line in lines if line))
+    assert established["type"] == "connection_established"
+    channel_id = established["channel_id"]
+
+    for request_id in ("first", "second"):
+        submitted = requests.post(
+            f"{web_server.base_url}/stream/persistent/{channel_id}",
+            json={"id": request_id, "code": f"print('from {request_id}')"},
+        )
+        assert submitted.status_code == 202
+        assert submitted.json()["request_id"] == request_id
+
+    completed = {}
+    for line in lines:
+        if not line:
+            continue
+        event = json.loads(line)
+        if event["type"] == "stdout":
+            assert f"from {event['request_id']}" in event["content"]
+        if event["type"] == "execution_complete":
+            completed[event["request_id"]] = event["success"]
+            if len(completed) == 2:
+                break
+    assert completed == {"first": True, "second": True}
+    response.close()
+
+    response = requests.post(f"{web_server.base_url}/stream/persistent/no-such-channel",
+                             json={"code": "print(1)"})
+    assert response.status_code == 404
+
+
+def test_metrics_endpoint_exports_prometheus_text(web_server):
+    """Test that /metrics exports route and execution metrics in Prometheus format."""
+    payload = {"name": "execute_python", "arguments": {"code": "print('metrics')"}}
+    assert requests.post(f"{web_server.base_url}/tools/call", json=payload).status_code == 200
+
+    response = requests.get(f"{web_server.base_url}/metrics")
+    assert response.status_code == 200
+    assert response.headers.get("content-type").startswith("text/plain")
+    text = response.text
+    # Without ?shard= the metrics of every shard are merged. Metrics shared by an isolate are
+    # labelled with the isolate and appear once; the state of each shard carries its shard name
+    assert text.count("# TYPE mcp_request_duration_seconds histogram") == 1
+    assert re.search(
+        r'mcp_exec_cpu_seconds_count\{isolate="[^"]+",tool="execute_python"\}', text
+    )
+    assert re.search(
+        r'mcp_executions_total\{isolate="[^"]+",tool="execute_python",outcome="success"\}', text
+    )
+    assert re.search(r'mcp_compile_cache_lookups_total\{isolate="[^"]+",result="miss"\}', text)
+    series = [line.rpartition(" ")[0] for line in text.splitlines() if not line.startswith("#")]
+    assert len(series) == len(set(series))
+
+    response = requests.get(f"{web_server.base_url}/metrics", params={"shard": "main"})
+    assert response.status_code == 200
+    assert re.search(r'mcp_executions_in_flight\{isolate="[^"]+"\}', response.text)
+    assert 'mcp_result_cache_lookups_total{shard="main",result="miss"}' in response.text
+
+
+def test_execute_python_profile_report(web_server):
+    """Test that profile: true returns CPU and memory profiling data with the result."""
+    code = (
+        "def fib(n):\n"
+        "    return n if n < 2 else fib(n - 1) + fib(n - 2)\n"
+        "rows = [list(range(100)) for _ in range(100)]\n"
+        "print(fib(15))"
+    )
+    arguments = {"code": code, "profile": True, "profile_top": 5}
+    payload = {"name": "execute_python", "arguments": arguments}
+    response = requests.post(f"{web_server.base_url}/tools/call", json=payload)
+    assert response.status_code == 200
+    data = response.json()
+    assert "610" in data["content"][0]["text"]
+
+    profile = data["profile"]
+    assert len(profile["functions"]) <= 5
+    assert any(entry["function"] == "fib" and entry["calls"] > 1 for entry in profile["functions"])
+    assert profile["memory"]["peak_bytes"] > 0
+    assert profile["memory"]["top_allocations"][0]["line"] == 3
+
+    payload["arguments"] = {"code": "print(1)"}
+    assert "profile" not in requests.post(f"{web_server.base_url}/tools/call", json=payload).json()